@@ -37,7 +37,7 @@ Example::
 
 '''
 #for usage with "from (package) import *"
-__all__=["ids3d","intpol_file","intpol_points","cutthrough","fourier","spectra","variable","timeevolution","pitchangle","gyrophaseangle","cut3d","lineout","fit","fieldtracer","non_maxwellianity","null_lines","interpolator_amr"
+__all__=["ids3d","intpol_file","intpol_points","cutthrough","fourier","spectra","variable","timeevolution","pitchangle","gyrophaseangle","cut3d","lineout","fit","fieldtracer","non_maxwellianity","null_lines","interpolator_amr","interpolation_plan",
          "spacecraft_to_simulation_frame","simulation_to_spacecraft_frame","simulation_to_observation_frame"]
 
 
@@ -50,7 +50,7 @@ from .cutthrough import cut_through, cut_through_step, cut_through_curve, cut_th
 from .fourier import fourier
 from .spectra import get_spectrum_energy, get_spectrum_alongaxis_vel
 from .variable import VariableInfo
-from .timeevolution import cell_time_evolution,point_time_evolution,VlsvTInterpolator
+from .timeevolution import cell_time_evolution,point_time_evolution,VlsvTInterpolator,time_series,time_series_for_file
 from .pitchangle import pitch_angles
 #from .backstream import extract_velocity_cells_sphere, extract_velocity_cells_non_sphere
 from .gyrophaseangle import gyrophase_angles_from_file
@@ -63,4 +63,5 @@ from .fieldtracer import dynamic_field_tracer
 from .non_maxwellianity import epsilon_M
 from .null_lines import LMN_null_lines_FOTE
 from .interpolator_amr import AMRInterpolator, supported_amr_interpolators
+from .interpolation_plan import InterpolationPlan, mesh_signature
 from .virtual_observations import spacecraft_to_simulation_frame,simulation_to_spacecraft_frame,simulation_to_observation_frame
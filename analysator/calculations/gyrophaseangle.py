@@ -22,7 +22,7 @@
 # 
 
 import numpy as np
-from .rotation import rotateVectorToVector
+from .rotation import rotateVectorToVector, rotation_array_matrix
 import logging
 
 def gyrophase_angles_from_file( vlsvReader, cellid):
@@ -98,8 +98,11 @@ def gyrophase_angles(bulk_velocity, B_unit, velocity_cell_data, velocity_coordin
    plt.hist(result[0].data, weights=result[1].data, bins=100, log=False)
    '''
    
-   # Get avgs data:
-   avgs = list(velocity_cell_data.values())
+   # Get avgs data (a dict from read_velocity_cells or a value array from read_velocity_cell_arrays):
+   if isinstance(velocity_cell_data, dict):
+      avgs = list(velocity_cell_data.values())
+   else:
+      avgs = np.asarray(velocity_cell_data)
    # Shift to plasma frame
    if plasmaframe == True:
       velocity_coordinates = velocity_coordinates - bulk_velocity
@@ -119,3 +122,37 @@ def gyrophase_angles(bulk_velocity, B_unit, velocity_cell_data, velocity_coordin
    return output_1d([gyro_angles, avgs], ["Gyrophase_angle", "avgs"], [units, ""])
    #plt.hist(gyro_angles, weights=avgs, bins=bins, log=log)
 
+def gyrophase_angles_batch(bulk_velocity, B_unit, cell_offsets, velocity_coordinates, plasmaframe=True, cosine=False):
+   ''' Calculates the gyrophase angles of the velocity cells of many spatial cells at once, the batched
+   counterpart of :func:`gyrophase_angles`.
+
+   :param bulk_velocity:        Bulk velocities of the spatial cells, [n,3]
+   :param B_unit:               Magnetic field unit vectors of the spatial cells, [n,3]
+   :param cell_offsets:         The velocity cells of spatial cell i are velocity_coordinates[cell_offsets[i]:cell_offsets[i+1]], [n+1]
+   :param velocity_coordinates: Velocity cell coordinates, [m,3]
+   :param cosine:               True if returning the gyrophase angles as a cosine plot
+   :param plasmaframe:          True if the user wants to get the gyrophase angle distribution in the plasma frame, default True
+   :returns: gyrophase angles of the velocity cells, [m]
+
+   .. seealso:: :func:`gyrophase_angles`
+   '''
+   bulk_velocity = np.reshape(bulk_velocity, (-1,3))
+   B_unit = np.reshape(B_unit, (-1,3))
+   cells = np.repeat(np.arange(len(cell_offsets)-1), np.diff(cell_offsets))
+   # Shift to plasma frame
+   if plasmaframe == True:
+      velocity_coordinates = velocity_coordinates - bulk_velocity[cells]
+   # Rotation of each B_unit onto the z-axis, as in rotateVectorToVector; fields along z are not rotated
+   vector_u = np.cross(B_unit, np.array([0.,0.,1.])[np.newaxis,:])
+   vector_u_len = np.linalg.norm(vector_u, axis=-1)
+   rotate = vector_u_len != 0.0
+   R = np.zeros((len(B_unit),3,3))
+   R[:] = np.identity(3)
+   if np.any(rotate):
+      angle = np.arccos(B_unit[rotate,2] / np.linalg.norm(B_unit[rotate], axis=-1))
+      R[rotate] = rotation_array_matrix(vector_u[rotate] / vector_u_len[rotate,np.newaxis], angle)
+   # Only the first two rotated components are needed
+   v_rotated = np.einsum("mij,mj->mi", R[cells,0:2,:], velocity_coordinates)
+   if cosine == True:
+      return np.cos(np.arctan2(v_rotated[:,0], v_rotated[:,1]))
+   return np.arctan2(v_rotated[:,0], v_rotated[:,1]) / (2*np.pi) * 360
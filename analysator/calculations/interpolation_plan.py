@@ -0,0 +1,184 @@
+#
+# This file is part of Analysator.
+# Copyright 2013-2016 Finnish Meteorological Institute
+# Copyright 2017-2024 University of Helsinki
+#
+# For details of usage, see the COPYING file and read the "Rules of the Road"
+# at http://www.physics.helsinki.fi/vlasiator/
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import numpy as np
+import warnings
+
+interpolation_plan_methods = {"nearest", "linear"}
+
+def mesh_signature(reader):
+   ''' Description of the spatial mesh of a reader: readers with equal signatures have the same
+   cells, so that interpolation stencils can be reused between them.
+
+   The signature is the geometry fingerprint of the mesh (the grid and a hash of the sorted cellids,
+   see :func:`vlsvcache.MeshRegistry.geometry_fingerprint`), computed once per mesh.
+
+   :param reader: a :class:`vlsvfile.VlsvReader`
+   :returns: a hashable tuple
+   '''
+   return reader.get_mesh_geometry().key
+
+class InterpolationPlan(object):
+   ''' Interpolation of SpatialGrid variables onto fixed coordinates, with the geometry worked out once.
+
+   The plan holds, for every coordinate, a stencil of cellids and their interpolation weights: the 8
+   surrounding cells for "linear" (dual cells of the generalized trilinear interpolant across
+   refinement interfaces) or the containing cell for "nearest". Interpolating a variable is then a
+   single read of the stencil cells, a gather and a weighted sum, for any variable and any file that
+   shares the mesh of the reader the plan was built from.
+
+   .. code-block:: python
+
+      import analysator as pt
+      f = pt.vlsvfile.VlsvReader("bulk.0001000.vlsv")
+      plan = pt.calculations.InterpolationPlan(f, coordinates)
+      B = plan.interpolate(f, "vg_b_vol")
+      rho = plan.interpolate(f, "proton/vg_rho")
+      for name in files:
+         g = pt.vlsvfile.VlsvReader(name)
+         if plan.matches(g):
+            rho_t = plan.interpolate(g, "proton/vg_rho")
+
+   Stencils are cellids, so a plan stays valid only as long as the grid does not change:
+   with dynamic refinement, check :func:`matches` and build a new plan when it fails.
+
+   .. seealso:: :func:`vlsvfile.VlsvReader.read_interpolated_variable`
+   '''
+
+   def __init__(self, reader, coordinates, method="linear", periodic=[True, True, True]):
+      ''' Build the stencils and weights of the coordinates on the mesh of reader.
+
+      :param reader:      a :class:`vlsvfile.VlsvReader`
+      :param coordinates: coordinates, [x,y,z] or an array of shape [n,3]
+      :kwarg method:      interpolation method, "linear" or "nearest"
+      :kwarg periodic:    periodicity of the system, three booleans
+      '''
+      if method.lower() not in interpolation_plan_methods:
+         raise NotImplementedError(method + ' is not a valid interpolation method for InterpolationPlan')
+      if (len(periodic)!=3):
+         raise ValueError("Periodic must be a list of 3 booleans.")
+
+      coordinates = np.array(coordinates, dtype=np.float64)
+      if coordinates.ndim == 1:
+         coordinates = coordinates[np.newaxis,:]
+      if(coordinates.shape[1] != 3):
+         raise IndexError("Coordinates are required to be three-dimensional (coords.shape[1]==3 or convertible to such))")
+
+      self.coordinates = coordinates
+      self.method = method.lower()
+      self.periodic = list(periodic)
+      self.signature = mesh_signature(reader)
+
+      closest_cell_ids = np.atleast_1d(reader.get_cellid(coordinates)).astype(np.int64)
+      if self.method == "nearest":
+         self.stencils = closest_cell_ids[:,np.newaxis]
+         self.weights = np.ones(self.stencils.shape)
+      else:
+         self.__build_linear(reader, closest_cell_ids)
+
+      # Stencil cells to read; cellid 0 (outside the domain) is kept apart and becomes nan
+      self.cellids, self.__gather = np.unique(self.stencils, return_inverse=True)
+      self.__gather = self.__gather.reshape(self.stencils.shape)
+      self.__has_missing = len(self.cellids) > 0 and self.cellids[0] == 0
+      if self.__has_missing:
+         self.cellids = self.cellids[1:]
+         self.__gather = self.__gather - 1
+         self.__gather[self.__gather < 0] = len(self.cellids)
+
+   def __build_linear(self, reader, closest_cell_ids):
+      ''' Stencils of the 8 cells around each coordinate, ordered as corners x + 2y + 4z, with trilinear weights.
+      '''
+      coordinates = self.coordinates
+      periodic = self.periodic
+
+      offsets = np.zeros(coordinates.shape,dtype=np.int32)
+      offsets[coordinates <= reader.get_cell_coordinates(closest_cell_ids)] = -1
+      lower_cell_ids = reader.get_cell_neighbor(closest_cell_ids, offsets, periodic, prune_uniques=True)
+
+      lower_cell_ids_unique, unique_cell_indices = np.unique(lower_cell_ids, return_inverse=True)
+      cellid_neighbors = np.zeros((lower_cell_ids_unique.shape[0],8), dtype=np.int64)
+      cellid_neighbors[lower_cell_ids_unique != 0, :] = reader.get_vg_regular_interp_neighbors(lower_cell_ids_unique[lower_cell_ids_unique != 0], periodic)
+
+      lower_cell_coordinates = reader.get_cell_coordinates(lower_cell_ids_unique)
+      upper_cell_coordinates = reader.get_cell_coordinates(cellid_neighbors[:,7])
+
+      # Fractional position between the lower and upper cell centres; zero along collapsed dimensions
+      scaled_coordinates = np.zeros_like(coordinates)
+      nonperiodic = (lower_cell_coordinates != upper_cell_coordinates)[unique_cell_indices]
+      lower = lower_cell_coordinates[unique_cell_indices]
+      upper = upper_cell_coordinates[unique_cell_indices]
+      scaled_coordinates[nonperiodic] = (coordinates[nonperiodic] - lower[nonperiodic])/(upper[nonperiodic] - lower[nonperiodic])
+
+      # get_vg_regular_interp_neighbors orders the corners as 4x + 2y + z, reorder to x + 2y + 4z
+      corners = np.array([[x,y,z] for z in [0,1] for y in [0,1] for x in [0,1]])
+      regular_order = 4*corners[:,0] + 2*corners[:,1] + corners[:,2]
+      self.stencils = cellid_neighbors[unique_cell_indices][:,regular_order]
+      self.weights = self.__trilinear_weights(scaled_coordinates, corners)
+
+      if np.any(self.stencils == 0):
+         warnings.warn("Coordinate in interpolation out of domain, output contains nans",UserWarning)
+
+      # Stencils across refinement interfaces use the dual cells of the generalized trilinear interpolant
+      refs0 = np.reshape(reader.get_amr_level(cellid_neighbors.reshape(-1)),(-1,8))
+      irregs = np.any(refs0 != refs0[:,0][:,np.newaxis],axis=1)[unique_cell_indices]
+      if np.any(irregs):
+         reader.build_duals(np.unique(closest_cell_ids[irregs]))
+         duals, ksis = reader.get_dual(coordinates[irregs], closest_cell_ids[irregs])
+         found = np.all(np.isfinite(ksis), axis=1)
+         irregular_stencils = reader.get_dual_cells(duals)
+         irregular_stencils[~found,:] = 0
+         self.stencils[irregs] = irregular_stencils
+         self.weights[irregs] = self.__trilinear_weights(ksis, corners)
+
+   @staticmethod
+   def __trilinear_weights(ksi, corners):
+      ksi = ksi[:,np.newaxis,:]
+      return np.prod(np.where(corners == 1, ksi, 1.0 - ksi), axis=2)
+
+   def matches(self, reader):
+      ''' Check whether this plan can be applied to reader, i.e. the mesh signatures agree.
+      '''
+      return mesh_signature(reader) == self.signature
+
+   def interpolate(self, reader, name, operator="pass"):
+      ''' Interpolate a variable of reader onto the coordinates of the plan.
+
+      :param reader:   a :class:`vlsvfile.VlsvReader` sharing the mesh of the plan, see :func:`matches`
+      :param name:     Name of the variable. FsGrid variables are passed to read_interpolated_fsgrid_variable
+                       with the method of the plan (only "linear" is supported there).
+      :kwarg operator: Datareduction operator. "pass" does no operation on data
+      :returns: numpy array with the data, [n, ...]
+      '''
+      if name[0:3] == 'fg_':
+         return reader.read_interpolated_fsgrid_variable(name, self.coordinates, operator, self.periodic, self.method)
+      if len(self.cellids) == 0:
+         # Everything is outside the domain, a single read gives the shape of the values
+         values = np.asarray(reader.read_variable(name, cellids=[1], operator=operator))[np.newaxis,...][0:0]
+      else:
+         values = np.asarray(reader.read_variable(name, cellids=self.cellids, operator=operator))
+         if len(self.cellids) == 1: # read_variable drops the cell dimension of single cells
+            values = values[np.newaxis,...]
+      if self.__has_missing:
+         values = np.concatenate([values.astype(np.float64), np.full((1,)+values.shape[1:], np.nan)])
+      stencil_values = values[self.__gather]
+      return np.einsum("pk,pk...->p...", self.weights, stencil_values)
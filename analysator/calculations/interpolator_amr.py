@@ -1,7 +1,6 @@
 from scipy.spatial import Delaunay
 import numpy as np
 from scipy.interpolate import LinearNDInterpolator
-from operator import itemgetter
 # from time import time
 import warnings
 import logging
@@ -99,56 +98,97 @@ def df(ksii, fii):
    res = np.stack((d0,d1,d2),axis = -1)
    return res
 
+# Corner k of a hexahedron sits at trilinear coordinates (k & 1, (k >> 1) & 1, (k >> 2) & 1), as in f and df
+hexahedron_corners = np.array([[k & 1, (k >> 1) & 1, (k >> 2) & 1] for k in range(8)], dtype=bool)
+
+def __trilinear_map(ksi, v_coords):
+   ''' Positions and Jacobians of the trilinear maps of hexahedra v_coords [n,8,3] at ksi [n,3].
+   '''
+   w = np.where(hexahedron_corners[np.newaxis,:,:], ksi[:,np.newaxis,:], 1.0 - ksi[:,np.newaxis,:])
+   dw = np.where(hexahedron_corners, 1.0, -1.0)[np.newaxis,:,:]
+   x = np.einsum("nk,nkd->nd", w[:,:,0]*w[:,:,1]*w[:,:,2], v_coords)
+   J = np.stack((np.einsum("nk,nkd->nd", dw[:,:,0]*w[:,:,1]*w[:,:,2], v_coords),
+                 np.einsum("nk,nkd->nd", w[:,:,0]*dw[:,:,1]*w[:,:,2], v_coords),
+                 np.einsum("nk,nkd->nd", w[:,:,0]*w[:,:,1]*dw[:,:,2], v_coords)), axis=-1)
+   return x, J
+
+def __solve3(J, r):
+   ''' Solve the 3x3 systems J s = r [n,3,3], [n,3] with Cramer's rule; singular systems give nan.
+   '''
+   a, b, c = J[:,:,0], J[:,:,1], J[:,:,2]
+   bc = np.cross(b, c)
+   det = np.einsum("nd,nd->n", a, bc)
+   with np.errstate(divide='ignore', invalid='ignore'):
+      s = np.stack((np.einsum("nd,nd->n", r, bc),
+                    np.einsum("nd,nd->n", r, np.cross(c, a)),
+                    np.einsum("nd,nd->n", r, np.cross(a, b))), axis=-1) / det[:,np.newaxis]
+   return s
+
 # For hexahedral vertices verts and point p, find the trilinear basis coordinates ksi
 # that interpolate the coordinates of verts to the tolerance tol.
 # This is an iterative procedure. Return nans in case of no convergence.
-def find_ksi(p, v_coords, tol= .1, maxiters = 200):
-   p = np.atleast_2d(p)
-   v_coords = np.atleast_3d(v_coords)
-   ksi0 = np.full_like(p, 0.5)
-   J = df(ksi0, v_coords)
-   # logging.info("J", J)
-   ksi_n = ksi0
-   ksi_n1 = np.full_like(ksi0, np.nan)
-   f_n =  f(ksi_n,v_coords)
-   # logging.info(f_n.shape, p.shape)
-   # logging.info(f_n)
-   f_n = f_n - p
-
-   resolved = np.full((p.shape[0],),False, dtype=bool)
-   diverged = np.full((p.shape[0],),False, dtype=bool)
-   
-   for i in range(maxiters):
-      
-      J[~resolved,:,:] = df(ksi_n[~resolved,:], v_coords[~resolved,:,:])
-      f_n[~resolved,:] = f(ksi_n[~resolved,:],v_coords[~resolved,:,:])-p[~resolved,:]
-      step = np.linalg.solve(J[~resolved,:,:], -f_n[~resolved,:,np.newaxis]).reshape(f_n[~resolved,:].shape)
-      ksi_n1[~resolved,:] = step + ksi_n[~resolved,:] # r_(n+1) 
-      ksi_n[~resolved,:] = ksi_n1[~resolved,:]
-      
-      resolved[~resolved] = (np.linalg.norm(f(ksi_n1[~resolved,:],v_coords[~resolved,:,:]) - p[~resolved,:],axis=1) < tol)
-      resolved[~resolved] = np.linalg.norm(ksi_n1[~resolved,:],axis=1) > 1e2 # Don't bother if the solution is diverging either, set to nans later
-         # convergence = True
-      if np.all(resolved):
-         break
-         # diverged = np.linalg.norm(ksi_n1,axis=1) > 1e2
-         # ksi_n1[diverged,:] = np.nan
-         # # logging.info("All converged in ", i, "iterations")
-         # return ksi_n1
-      
+def find_ksi(p, v_coords, tol= .1, maxiters = 200, ksi0 = None, return_stats = False):
+   ''' Newton iteration for the trilinear coordinates ksi [n,3] of points p [n,3] in hexahedra v_coords [n,8,3].
 
-   if np.all(resolved):
-      # logging.info("Converged after ", i, "iterations")
-      diverged = np.linalg.norm(ksi_n1,axis=1) > 1e2
-      ksi_n1[diverged,:] = np.nan
-      return ksi_n1
+   Unless ksi0 is given, each point starts from the regular-grid guess: the affine map of its hexahedron
+   at the centre, which is exact for parallelepipeds, so regular duals converge without iterating.
+   Only the unresolved points are carried to the next iteration, and each step solves the 3x3
+   systems in closed form.
+
+   :param p:           coordinates [n,3]
+   :param v_coords:    hexahedron vertex coordinates [n,8,3], corners ordered as in :func:`f`
+   :kwarg tol:         tolerance of the distance between p and the mapped ksi
+   :kwarg maxiters:    maximum number of Newton iterations
+   :kwarg ksi0:        initial guess [n,3], optional
+   :kwarg return_stats: if True, also return a dictionary of convergence statistics
+   :returns: ksi [n,3], nan for points that diverged or did not converge;
+             with return_stats, (ksi, stats) where stats holds the per-point "iterations" and the
+             counts "converged", "diverged" and "unconverged"
+   '''
+   p = np.atleast_2d(p).astype(np.float64)
+   v_coords = np.asarray(v_coords, dtype=np.float64)
+   if v_coords.ndim == 2: # a single hexahedron
+      v_coords = v_coords[np.newaxis,:,:]
+   npoints = p.shape[0]
+
+   if ksi0 is None:
+      centre, J = __trilinear_map(np.full((npoints,3), 0.5), v_coords)
+      ksi = 0.5 + __solve3(J, p - centre)
    else:
-      # warnings.warn("Generalized trilinear interpolation did not converge for " + str(np.sum(~convergence)) + " points. Nans inbound.")
-      diverged = np.linalg.norm(ksi_n1,axis=1) > 1e2
-      ksi_n1[diverged,:] = np.nan
-      ksi_n1[~resolved,:] = np.nan
-      return ksi_n1
-      
+      ksi = np.array(np.broadcast_to(ksi0, p.shape), dtype=np.float64)
+
+   iterations = np.zeros(npoints, dtype=np.int64)
+   converged = np.zeros(npoints, dtype=bool)
+   diverged = np.zeros(npoints, dtype=bool)
+
+   # Working copies of the active set, compacted as points resolve
+   active = np.arange(npoints)
+   p_a, v_a, ksi_a = p, v_coords, ksi
+   x_a, J_a = __trilinear_map(ksi_a, v_a)
+   for i in range(maxiters+1):
+      done = np.linalg.norm(x_a - p_a, axis=1) < tol
+      bad = ~done & ~(np.linalg.norm(ksi_a, axis=1) <= 1e2) # Don't bother if the solution is diverging either, set to nans later
+      ksi[active[done],:] = ksi_a[done,:]
+      converged[active[done]] = True
+      diverged[active[bad]] = True
+      keep = ~(done | bad)
+      if not np.all(keep):
+         active = active[keep]
+         p_a, v_a, ksi_a, x_a, J_a = p_a[keep], v_a[keep], ksi_a[keep], x_a[keep], J_a[keep]
+      if len(active) == 0 or i == maxiters:
+         break
+      ksi_a = ksi_a + __solve3(J_a, p_a - x_a)
+      iterations[active] += 1
+      x_a, J_a = __trilinear_map(ksi_a, v_a)
+
+   ksi[~converged,:] = np.nan
+   if return_stats:
+      return ksi, {"iterations":iterations,
+                   "converged":int(np.sum(converged)),
+                   "diverged":int(np.sum(diverged)),
+                   "unconverged":int(npoints - np.sum(converged) - np.sum(diverged))}
+   return ksi
+
 class HexahedralTrilinearInterpolator(object):
    ''' Class for doing general hexahedral interpolation, including degenerate hexahedra (...eventually).
    '''
@@ -173,7 +213,7 @@ class HexahedralTrilinearInterpolator(object):
          #    duals.append(d)
          #    ksis.append(ksi)
          duals, ksis = self.reader.get_dual(pts, cellids)
-         duals_corners = np.array(itemgetter(*duals)(self.reader._VlsvReader__dual_cells))
+         duals_corners = self.reader.get_dual_cells(duals)
          fi = self.reader.read_variable(self.var, duals_corners.reshape(-1), operator=self.operator)
          if(fi.ndim == 2):
             val_len = fi.shape[1]
@@ -209,7 +249,7 @@ class HexahedralTrilinearInterpolator(object):
          return np.array(vals)
       else:
          dual, ksi = self.reader.get_dual(pt)
-         dual_corners = self.__dual_cells[dual]
+         dual_corners = self.reader.get_dual_cells(dual)[0]
          fp = f(ksi, self.reader.read_variable(self.var, np.array(dual_corners), operator=self.operator)[np.newaxis,:])
          return fp
 
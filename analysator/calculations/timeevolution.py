@@ -31,6 +31,219 @@ try:
 except ImportError:
    from collections import Iterable
 
+# Interpolation plan of the latest time series file, reused for the following files while the mesh stays the same
+__latest_plan = [None]
+
+def __interpolation_plan( vlsvReader, coordinates, method ):
+   ''' An :class:`InterpolationPlan` of the coordinates on the mesh of vlsvReader, reusing the latest one if possible.
+   '''
+   plan = __latest_plan[0]
+   if (plan is None or plan.method != method.lower() or not np.array_equal(plan.coordinates, coordinates)
+         or not plan.matches(vlsvReader)):
+      plan = vlsvReader.get_interpolation_plan(coordinates, method=method)
+      __latest_plan[0] = plan
+   return plan
+
+def time_series_for_file( vlsvReader, variables, operators=None, cellids=None, coordinates=None, method=None, parameters=["time"] ):
+   ''' Reads the time series samples of a single file: all variables at all cellids or coordinates,
+       with one vectorised query per variable.
+
+       :param vlsvReader:              A :class:`vlsvfile.VlsvReader` or the name of a vlsv file
+       :param variables:               List of variable names
+       :param operators:               List of operators, one per variable (OPTIONAL, default "pass")
+       :param cellids:                 List of cell ids (give either cellids or coordinates)
+       :param coordinates:             List of coordinates [n,3]
+       :param method:                  None (default) samples the cell containing each coordinate, or the name of a
+                                       :func:`vlsvfile.VlsvReader.read_interpolated_variable` method ['nearest','linear'].
+                                       The interpolation stencils are kept in an :class:`InterpolationPlan` and reused
+                                       for consecutive files on the same mesh.
+       :param parameters:              List of parameter names to read, missing parameters are returned as nan
+       :returns: a tuple (parameter values, cellids, list of arrays of shape [n, components], one per variable)
+
+       .. seealso:: :func:`time_series`
+   '''
+   if isinstance(vlsvReader, str):
+      vlsvReader = pt.vlsvfile.VlsvReader(vlsvReader)
+      opened_here = True
+   else:
+      opened_here = False
+   if operators is None:
+      operators = ["pass" for i in range(len(variables))]
+
+   # Open the vlsv reader's file:
+   vlsvReader.optimize_open_file()
+   try:
+      parameter_values = []
+      for parameter in parameters:
+         try:
+            value = vlsvReader.read_parameter(parameter)
+         except ValueError:
+            value = None
+         parameter_values.append(np.nan if value is None else value)
+
+      if cellids is None:
+         coordinates = np.atleast_2d(np.asarray(coordinates, dtype=np.float64))
+         # The grid may be refined differently in each file, so the cells are looked up per file
+         cellids = np.atleast_1d(vlsvReader.get_cellid(coordinates)).astype(np.int64)
+      else:
+         cellids = np.atleast_1d(np.asarray(cellids, dtype=np.int64))
+
+      if coordinates is not None and method is not None:
+         plan = __interpolation_plan(vlsvReader, coordinates, method)
+      values = []
+      for variable, operator in zip(variables, operators):
+         if coordinates is not None and method is not None:
+            data = plan.interpolate(vlsvReader, variable, operator=operator)
+         else:
+            data = vlsvReader.read_variable(variable, cellids=cellids, operator=operator)
+         values.append(np.reshape(np.asarray(data, dtype=np.float64), (len(cellids),-1)))
+   finally:
+      if not opened_here:
+         # For optimization purposes we are now freeing vlsvReader's memory
+         # Note: Upon reading data vlsvReader created an internal hash map that takes a lot of memory
+         vlsvReader.optimize_clear_fileindex_for_cellid()
+         vlsvReader.optimize_clear_fileindex_for_cellid_blocks()
+      # Close the vlsv reader's file:
+      vlsvReader.optimize_close_file()
+
+   return parameter_values, cellids, values
+
+def __time_series_task( task ):
+   ''' Worker of :func:`time_series`, task is (index, reader or file name, keyword arguments).
+   '''
+   index, vlsvReader, kwargs = task
+   skip_unreadable = kwargs.pop("skip_unreadable")
+   try:
+      return index, time_series_for_file(vlsvReader, **kwargs)
+   except Exception as e:
+      if not skip_unreadable:
+         raise
+      logging.warning("Could not read " + str(getattr(vlsvReader, "file_name", vlsvReader)) + ": " + str(e))
+      return index, None
+
+def time_series( vlsvReader_list, variables, operators=None, cellids=None, coordinates=None, method=None, parameters=["time"], processes=1, chunksize=1, skip_unreadable=False ):
+   ''' Extracts time series of variables at fixed cellids or coordinates (virtual spacecraft) from a list of files.
+
+       Each file is opened once and every variable is read with one vectorised query. With processes > 1
+       the files are distributed over a process pool; results are streamed back as files finish and written
+       into arrays of shape [time, point, component], preallocated on the first result. Only the output
+       arrays and the samples of the files in flight are held in memory.
+
+       :param vlsvReader_list:         List of vlsv file names or :class:`vlsvfile.VlsvReader` objects
+       :param variables:               List of variable names
+       :param operators:               List of operators, one per variable (OPTIONAL, default "pass")
+       :param cellids:                 List of cell ids (give either cellids or coordinates)
+       :param coordinates:             List of coordinates [n,3]
+       :param method:                  None (default) samples the cell containing each coordinate, or the name of a
+                                       :func:`vlsvfile.VlsvReader.read_interpolated_variable` method ['nearest','linear']
+       :param parameters:              List of parameter names to read from each file ["time"]
+       :param processes:               Number of worker processes [1]. Workers reopen readers by file name.
+       :param chunksize:               Number of files handed to a worker at a time [1]
+       :param skip_unreadable:         If True, files that cannot be read are logged and left as nan [False]
+       :returns: a dictionary with the keys
+                 "parameters": dictionary of parameter name : array [time],
+                 "cellids":    array [time, point] of the sampled cellids (0 for unreadable files),
+                 "variables":  list of arrays [time, point, component], one per variable,
+                 "readable":   boolean array [time], False for files that could not be read
+
+       .. code-block:: python
+
+          import analysator as pt
+          # Example of usage:
+          files = ["bulk.%07d.vlsv" % i for i in range(1000,3000)]
+          series = pt.calculations.time_series( files, ["vg_b_vol", "proton/vg_rho"], coordinates=[[1e8,0,0],[1.2e8,0,0]], processes=16 )
+          t = series["parameters"]["time"]
+          bx_at_first_point = series["variables"][0][:,0,0]
+
+       .. seealso:: :func:`time_series_for_file`
+   '''
+   if (cellids is None) == (coordinates is None):
+      raise ValueError("Give either cellids or coordinates to time_series")
+   variables = list(np.atleast_1d(variables))
+   if operators is None:
+      operators = ["pass" for i in range(len(variables))]
+   if len(operators) != len(variables):
+      raise ValueError("time_series needs one operator per variable")
+   if coordinates is not None:
+      coordinates = np.atleast_2d(np.asarray(coordinates, dtype=np.float64))
+      npoints = coordinates.shape[0]
+   else:
+      cellids = np.atleast_1d(np.asarray(cellids, dtype=np.int64))
+      npoints = len(cellids)
+   ntimes = len(vlsvReader_list)
+
+   kwargs = {"variables":variables, "operators":operators, "cellids":cellids, "coordinates":coordinates,
+             "method":method, "parameters":list(parameters), "skip_unreadable":skip_unreadable}
+   if processes > 1:
+      # Readers are not sent to the workers, only their file names
+      tasks = [(t, getattr(r, "file_name", r), dict(kwargs)) for t,r in enumerate(vlsvReader_list)]
+   else:
+      tasks = [(t, r, dict(kwargs)) for t,r in enumerate(vlsvReader_list)]
+
+   result = {"parameters":{p: np.full(ntimes, np.nan) for p in parameters},
+             "cellids":np.zeros((ntimes, npoints), dtype=np.int64),
+             "variables":None,
+             "readable":np.zeros(ntimes, dtype=bool)}
+
+   def store(t, samples):
+      if samples is None:
+         return
+      parameter_values, sampled_cellids, values = samples
+      if result["variables"] is None:
+         result["variables"] = [np.full((ntimes, npoints, v.shape[1]), np.nan) for v in values]
+      for p, value in zip(parameters, parameter_values):
+         result["parameters"][p][t] = value
+      result["cellids"][t,:] = sampled_cellids
+      for j, v in enumerate(values):
+         result["variables"][j][t,:,:] = v
+      result["readable"][t] = True
+
+   if processes > 1:
+      from multiprocessing import Pool
+      with Pool(processes) as pool:
+         for t, samples in pool.imap_unordered(__time_series_task, tasks, chunksize=chunksize):
+            store(t, samples)
+   else:
+      for task in tasks:
+         store(*__time_series_task(task))
+
+   if result["variables"] is None:
+      raise RuntimeError("None of the files given to time_series could be read")
+   return result
+
+def __time_parameters( reader_0 ):
+   ''' Time parameters available in the files, judging by the first reader.
+   '''
+   # Check against legacy files with tstep instead of timestep:
+   if reader_0.check_parameter("tstep"):
+      parameters = ["t","tstep","fileIndex"]
+      parameter_units=["s","",""]
+   elif reader_0.check_parameter("timestep"):
+      parameters = ["t","timestep","fileIndex"]
+      parameter_units=["s","",""]
+   else:
+      logging.warning("Could not obtain tstep or timestep from readers. Returning only t and fileIndex.")
+      parameters = ["t","fileIndex"]
+      parameter_units=["s",""]
+   return parameters, parameter_units
+
+def __time_evolution_output( series, variables, npoints, parameters, parameter_units, units ):
+   ''' Formats a :func:`time_series` result as the output_1d list of cell_time_evolution and
+       point_time_evolution: the parameters first, then every variable for each point in turn.
+   '''
+   #construct empty units, if none are given
+   if (units == "") or (len(units) != len(variables)):
+      units=[ "" for i in range(len(variables))]
+   data = [series["parameters"][p] for p in parameters]
+   for i in range(npoints):
+      for j in range(len(variables)):
+         values = series["variables"][j][:,i,:]
+         data.append(values[:,0] if values.shape[1] == 1 else values)
+   from .output import output_1d
+   return output_1d( data,
+                     parameters +  [variables[(int)(i)%(int)(len(variables))] for i in range(len(data)-len(parameters))],
+                     parameter_units + [units[(int)(i)%(int)(len(units))] for i in range(len(data)-len(parameters))] )
+
 def cell_time_evolution( vlsvReader_list, variables, cellids, units="" ):
    ''' Returns variable data from a time evolution of some certain cell ids
 
@@ -58,60 +271,15 @@ def cell_time_evolution( vlsvReader_list, variables, cellids, units="" ):
           # Do post processing:
           rho_data = rho.data
           non_existing_example_function(rho_data)
-   
 
+       .. seealso:: :func:`time_series`
    '''
    vlsvReader_list = np.atleast_1d(vlsvReader_list)
    variables = np.atleast_1d(variables)
    cellids = np.atleast_1d(cellids)
-   reader_0 = vlsvReader_list[0]
-
-   # Check against legacy files with tstep instead of timestep:
-   if reader_0.check_parameter("tstep"):
-      parameters = ["t","tstep","fileIndex"]
-      parameter_units=["s","",""]
-   elif reader_0.check_parameter("timestep"):
-      parameters = ["t","timestep","fileIndex"]
-      parameter_units=["s","",""]
-   else:
-      logging.warning("Could not obtain tstep or timestep from readers. Returning only t and fileIndex.")
-      parameters = ["t","fileIndex"]
-      parameter_units=["s",""]
-   #construct empty units, if none are given
-   if (units == "") or (len(units) != len(variables)):
-      units=[ "" for i in range(len(variables))]
-   #construct data 
-   data = [[] for i in range(len(parameters)+len(cellids)*len(variables))]
-   for t in range(len(vlsvReader_list)):
-      # Get the vlsv reader
-      vlsvReader = vlsvReader_list[t]
-      # Open the vlsv reader's file:
-      vlsvReader.optimize_open_file()
-      #go through parameters
-      for j in range(len(parameters)):
-         # Read the parameter
-         # Save the data into the right slot in the data array:
-         data[j].append(vlsvReader.read_parameter( parameters[j]))
-
-      # Go through variables:
-      for j in range(len(variables)):
-         variable = variables[j]
-         # Read the variable for all cell ids
-         #variables_for_cellids = vlsvReader.read_variables_for_cellids( variable, cellids )
-         # Save the data into the right slot in the data array:
-         for i in range(len(cellids)):
-            data[len(parameters)+i*len(variables)+j].append(vlsvReader.read_variable( variable, cellids[i] ))
-            #TODO Use vectorization over cellids!
-
-      # For optimization purposes we are now freeing vlsvReader's memory
-      # Note: Upon reading data vlsvReader created an internal hash map that takes a lot of memory
-      vlsvReader.optimize_clear_fileindex_for_cellid()
-      # Close the vlsv reader's file:
-      vlsvReader.optimize_close_file()
-   from output import output_1d
-   return output_1d( data, 
-                     parameters +  [variables[(int)(i)%(int)(len(variables))] for i in range(len(data)-len(parameters))], 
-                     parameter_units + [units[(int)(i)%(int)(len(units))] for i in range(len(data)-len(parameters))] )
+   parameters, parameter_units = __time_parameters(vlsvReader_list[0])
+   series = time_series(vlsvReader_list, variables, cellids=cellids, parameters=parameters)
+   return __time_evolution_output(series, variables, len(cellids), parameters, parameter_units, units)
 
 
 def point_time_evolution( vlsvReader_list, variables, coordinates, units="", method='nearest'):
@@ -142,63 +310,17 @@ def point_time_evolution( vlsvReader_list, variables, coordinates, units="", met
           # Do post processing:
           rho_data = rho.data
           non_existing_example_function(rho_data)
-   
 
+       .. seealso:: :func:`time_series`
    '''
    vlsvReader_list = np.atleast_1d(vlsvReader_list)
    variables = np.atleast_1d(variables)
    coordinates = np.array(coordinates)
    if coordinates.ndim == 1:
       coordinates = coordinates[np.newaxis,:]
-   reader_0 = vlsvReader_list[0]
-
-   # Check against legacy files with tstep instead of timestep:
-   if reader_0.check_parameter("tstep"):
-      parameters = ["t","tstep","fileIndex"]
-      parameter_units=["s","",""]
-   elif reader_0.check_parameter("timestep"):
-      parameters = ["t","timestep","fileIndex"]
-      parameter_units=["s","",""]
-   else:
-      logging.warning("Could not obtain tstep or timestep from readers. Returning only t and fileIndex.")
-      parameters = ["t","fileIndex"]
-      parameter_units=["s",""]
-   #construct empty units, if none are given
-   if (units == "") or (len(units) != len(variables)):
-      units=[ "" for i in range(len(variables))]
-   #construct data 
-   data = [[] for i in range(len(parameters)+coordinates.shape[0]*len(variables))]
-   for t in range(len(vlsvReader_list)):
-      # Get the vlsv reader
-      vlsvReader = vlsvReader_list[t]
-      # Open the vlsv reader's file:
-      vlsvReader.optimize_open_file()
-      #go through parameters
-      for j in range(len(parameters)):
-         # Read the parameter
-         # Save the data into the right slot in the data array:
-         data[j].append(vlsvReader.read_parameter( parameters[j]))
-
-      # Go through variables:
-      for j in range(len(variables)):
-         variable = variables[j]
-         # Read the variable for all cell ids
-         #variables_for_cellids = vlsvReader.read_variables_for_cellids( variable, cellids )
-         # Save the data into the right slot in the data array:
-         for i in range(coordinates.shape[0]):
-            data[len(parameters)+i*len(variables)+j].append(vlsvReader.read_interpolated_variable( variable, coordinates[i,:], method=method ))
-            #TODO Use vectorization over coordinates!
-
-      # For optimization purposes we are now freeing vlsvReader's memory
-      # Note: Upon reading data vlsvReader created an internal hash map that takes a lot of memory
-      vlsvReader.optimize_clear_fileindex_for_cellid()
-      vlsvReader.optimize_clear_fileindex_for_cellid_blocks()
-      # Close the vlsv reader's file:
-      vlsvReader.optimize_close_file()
-   from output import output_1d
-   return output_1d( data, 
-                     parameters +  [variables[(int)(i)%(int)(len(variables))] for i in range(len(data)-len(parameters))], 
-                     parameter_units + [units[(int)(i)%(int)(len(units))] for i in range(len(data)-len(parameters))] )
+   parameters, parameter_units = __time_parameters(vlsvReader_list[0])
+   series = time_series(vlsvReader_list, variables, coordinates=coordinates, method=method, parameters=parameters)
+   return __time_evolution_output(series, variables, coordinates.shape[0], parameters, parameter_units, units)
 
 class VlsvTInterpolator:
    ''' Class for setting up a time-interpolation wrapper from a list of VLSV files.
@@ -243,8 +243,7 @@ def vSpaceReducer(vlsvReader, cid, slicetype, normvect, VXBins, VYBins, pop="pro
     inputcellsize=(vxmax-vxmin)/vxsize
     logging.info("Input velocity grid cell size "+str(inputcellsize))
 
-    velcells = vlsvReader.read_velocity_cells(cid, pop=pop)
-    velcellslist = list(zip(*velcells.items()))
+    vcellids, f = vlsvReader.read_velocity_cell_arrays(cid, pop=pop)
 
     if slicethick is not None and slicethick !=0:
         if slicethick < 0:
@@ -255,11 +254,10 @@ def vSpaceReducer(vlsvReader, cid, slicetype, normvect, VXBins, VYBins, pop="pro
             warnings.warn("You seem to be averaging across some width of the VDF. Are you sure you don't want to integrate instead?")
 
     # check that velocity space has cells
-    if(len(velcellslist) <= 0):
+    if(len(vcellids) <= 0):
         return (False,0,0,0)
 
-    f = np.asarray(velcellslist[1])
-    V = vlsvReader.get_velocity_cell_coordinates(velcellslist[0], pop=pop)
+    V = vlsvReader.get_velocity_cell_coordinates(vcellids, pop=pop)
     logging.info("Found "+str(len(V))+" v-space cells")
 
     # center on highest f-value
@@ -791,10 +789,8 @@ def plot_vdf(filename=None,
                 warn_bulk_centering = True
             else:
                 # fallback: get bulkV from the VDF itself
-                velcells = vlsvReader.read_velocity_cells(cellid, pop=pop)
-                velcellslist = list(zip(*velcells.items()))
-                f = np.asarray(velcellslist[1])
-                V = vlsvReader.get_velocity_cell_coordinates(velcellslist[0], pop=pop)
+                vcellids, f = vlsvReader.read_velocity_cell_arrays(cellid, pop=pop)
+                V = vlsvReader.get_velocity_cell_coordinates(vcellids, pop=pop)
                 Vbulk = np.average(V, axis=0, weights=f)
                 warn_bulk_centering = True
                 print(Vbulk)
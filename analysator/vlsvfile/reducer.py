@@ -22,6 +22,36 @@
 # 
 import logging
 
+def elementwise( operation ):
+   ''' Decorator declaring a data reducer operation element-wise: each output cell depends only on the
+       same cell of the inputs, so the operation may be evaluated over blocks of cells separately
+       (and in parallel, see :func:`VlsvReader.set_reducer_threads`). The operation must give the
+       same result for any block of two or more cells as for the whole array.
+
+       Example:
+       @elementwise
+       def plus( array ):
+          return array[0]+array[1]
+   '''
+   operation.elementwise = True
+   return operation
+
+def vspace_batch( operation ):
+   ''' Decorator declaring a velocity-space data reducer operation batched: instead of one cell at a time,
+       it is called on a chunk of cells as operation(variables, cell_offsets, velocity_cell_values, velocity_coordinates).
+       The variables are arrays with the chunk cells on the first axis, and the velocity cells of chunk
+       cell i are velocity_cell_values[cell_offsets[i]:cell_offsets[i+1]] (a CSR layout, see
+       :func:`VlsvReader.read_velocity_cells_batch`). The operation returns an array with one value per cell.
+
+       Example:
+       @vspace_batch
+       def total( variables, cell_offsets, velocity_cell_values, velocity_coordinates ):
+          cells = np.repeat(np.arange(len(cell_offsets)-1), np.diff(cell_offsets))
+          return np.bincount(cells, weights=velocity_cell_values, minlength=len(cell_offsets)-1)
+   '''
+   operation.vspace_batch = True
+   return operation
+
 class DataReducerVariable:
    ''' A class for creating custom variables that are being read by the VlsvReader class. This is useful for reading in variables that are not written in the vlsv file directly
    '''
@@ -32,8 +62,10 @@ class DataReducerVariable:
    latexunits = ""
    useVspace = False
    useReader = False
+   elementwise = False
+   vspace_batch = False
    vector_size=1
-   def __init__(self, variables, operation, units, vector_size, latex="", latexunits="",useVspace=False,useReader=False):
+   def __init__(self, variables, operation, units, vector_size, latex="", latexunits="",useVspace=False,useReader=False,elementwise=None,vspace_batch=None):
       ''' Constructor for the class
           :param variables          List of variables for doing calculations with
           :param operation          The operation (function) that operates on the variables
@@ -41,7 +73,13 @@ class DataReducerVariable:
           :param latex              Name of the variable in LaTeX markup
           :param latexunits         Units of the variable in LaTeX markup
           :param vector_size       Length of vector for reducer to return (scalars 1, vectors 3, tensors 9)
-          :param useVspace          Flag to determine whether the reducer will use velocity space data
+          :param useVspace          Flag to determine whether the reducer will use velocity space data. The operation is then
+                                    called per cell as operation(variables, velocity_cell_values, velocity_coordinates), with
+                                    the values and coordinates as arrays from :func:`VlsvReader.read_velocity_cell_arrays`
+          :param vspace_batch       Flag to declare a useVspace operation batched over chunks of cells, see :func:`vspace_batch`.
+                                    By default taken from the operation, if it was declared with the decorator.
+          :param elementwise        Flag to declare the operation element-wise, see :func:`elementwise`. By default
+                                    taken from the operation, if it was declared with the decorator.
           Example:
           def plus( array ):
              return array[0]+array[1]
@@ -56,4 +94,10 @@ class DataReducerVariable:
       self.latexunits = latexunits
       self.useVspace = useVspace
       self.useReader = useReader
+      if elementwise is None:
+         elementwise = getattr(operation, "elementwise", False)
+      self.elementwise = elementwise
+      if vspace_batch is None:
+         vspace_batch = getattr(operation, "vspace_batch", False)
+      self.vspace_batch = vspace_batch
 
@@ -25,9 +25,9 @@
 '''
 import logging
 import numpy as np
-from .reducer import DataReducerVariable
+from .reducer import DataReducerVariable, elementwise, vspace_batch
 from ..calculations.rotation import rotateTensorToVector, rotateArrayTensorToVector
-from ..calculations.gyrophaseangle import gyrophase_angles
+from ..calculations.gyrophaseangle import gyrophase_angles_batch
 from . import vlsvvariables
 import sys
 import math
@@ -236,6 +236,7 @@ def restart_rhoq( variables ):
          return None
    return rhoq
 
+@elementwise
 def rhom( variables ):
    ''' Data reducer function for calculating rhom from pre-multipop file
    '''
@@ -243,6 +244,7 @@ def rhom( variables ):
    mass = vlsvvariables.speciesamu[vlsvvariables.activepopulation]*mp
    return rho*mass
 
+@elementwise
 def rhoq( variables ):
    ''' Data reducer function for calculating rhoq from pre-multipop file
    '''
@@ -307,6 +309,7 @@ def v( variables ):
    else:
       return np.ma.divide(rho_v,rho[:,np.newaxis])
 
+@elementwise
 def vms( variables ):
    ''' Data reducer function for getting magnetosonic velocity 
        input: P, rhom, B
@@ -324,6 +327,7 @@ def vms( variables ):
    vms = np.sqrt( np.square(vs) + np.square(vA) )
    return vms
 
+@elementwise
 def vs( variables ):
    ''' Data reducer function for getting the sound speed
        input: P, rhom
@@ -334,6 +338,7 @@ def vs( variables ):
    vs = np.sqrt( np.ma.divide( P*5.0/3.0, rho_m ) )
    return vs
 
+@elementwise
 def va( variables ):
    ''' Data reducer function for getting the Alfven velocity
        input: rhom, B
@@ -348,6 +353,7 @@ def va( variables ):
    vA = np.ma.divide( Btot,np.sqrt( rho_m*mu_0 ) )
    return vA
 
+@elementwise
 def MA( variables ):
    ''' Data reducer function for getting the Alfvenic Mach number
    '''
@@ -356,6 +362,7 @@ def MA( variables ):
    MA = np.ma.divide(bulkv, Alfvenspeed)
    return MA
 
+@elementwise
 def Mms( variables ):
    ''' Data reducer function for getting the magnetosonic Mach number
    '''
@@ -364,6 +371,7 @@ def Mms( variables ):
    Mms = np.ma.divide(bulkv, magnetosonicspeed)
    return Mms
 
+@elementwise
 def ParallelVectorComponent( variables ):
    ''' Data reducer function for vector component parallel to the magnetic field (or another vector)
    '''
@@ -381,6 +389,7 @@ def ParallelVectorComponent( variables ):
       bgnorm = np.ma.divide(bgvector, np.ma.masked_equal(np.linalg.norm(bgvector, axis=-1),0)[:,np.newaxis])
       return (inputvector*bgnorm).sum(-1)
 
+@elementwise
 def PerpendicularVectorComponent( variables ):
    ''' Data reducer function for vector component perpendicular to the magnetic field (or another vector)
    '''
@@ -407,6 +416,7 @@ def PerpendicularVectorComponent( variables ):
       presqrt = np.sqrt(vmag*vmag - vpara*vpara)
       return np.sqrt(np.ma.masked_less(presqrt,0))
 
+@elementwise
 def FullTensor( variables ):
    ''' Data reducer function to reconstruct a full tensor from diagonal and off-diagonal
        components (e.g. the pressure tensor)
@@ -432,6 +442,7 @@ def FullTensor( variables ):
       result[:,2,2] = TensorDiagonal[:,2]
       return result
 
+@elementwise
 def RotatedTensor( variables ):
    ''' Data reducer for rotating e.g. the pressure tensor to align the z-component 
        with a vector, e.g. the magnetic field
@@ -445,6 +456,7 @@ def RotatedTensor( variables ):
    else:
       return rotateArrayTensorToVector(Tensor, B)
 
+@elementwise
 def ParallelTensorComponent( variables ):
    ''' Data reducer for finding the parallel component from a rotated field-aligned tensor
    '''
@@ -454,6 +466,7 @@ def ParallelTensorComponent( variables ):
    else:
       return RotatedTensor[:,2,2]
 
+@elementwise
 def PerpendicularTensorComponent( variables ):
    ''' Data reducer for finding the perpendicular component from a rotated field-aligned tensor
        e.g. perpendicular pressure
@@ -464,6 +477,7 @@ def PerpendicularTensorComponent( variables ):
    else:
       return 0.5*(RotatedTensor[:,0,0] + RotatedTensor[:,1,1])
 
+@elementwise
 def J( variables ):
    ''' Data reducer taking a jacobian (assume 9-component vector) and extracting the current
    via curl from the components of the jacobian (background or perturbed, as long as it has 9
@@ -488,6 +502,7 @@ def J( variables ):
 
    raise RuntimeError("Failed to extract current from Jacobian")
 
+@elementwise
 def TensorFromScalars(variables):
    '''Construct a 9-element vector ("tensor") from nine scalar fields.
    '''
@@ -500,6 +515,7 @@ def TensorFromScalars(variables):
                    axis=-1)
 
 
+@elementwise
 def Anisotropy( variables ):
    ''' Data reducer for finding the ratio of perpendicular to parallel components of a tensor
    '''
@@ -511,12 +527,14 @@ def Anisotropy( variables ):
       divisor = np.ma.masked_equal(np.ma.masked_invalid(RotatedTensor[:,2,2]),0)
       return 0.5*np.ma.divide(RotatedTensor[:,0,0] + RotatedTensor[:,1,1], divisor)
 
+@elementwise
 def Pressure( variables ):
    ''' Data reducer for finding the scalar pressure
    '''
    PTensorDiagonal = variables[0]
    return 1.0/3.0 * np.ma.sum(np.ma.masked_invalid(PTensorDiagonal),axis=-1)
 
+@elementwise
 def Pdyn( variables ):
    ''' Data reducer function for dynamic pressure
        Pdyn = rho_m*V^2
@@ -526,6 +544,7 @@ def Pdyn( variables ):
    rhom = np.array(variables[1])
    return Vmag*Vmag*rhom
 
+@elementwise
 def Pdynx( variables ):
    ''' Data reducer function for dynamic pressure with just V_x
        input: V, rhom
@@ -538,6 +557,7 @@ def Pdynx( variables ):
       Vx = V[0]
    return Vx*Vx*rhom
 
+@elementwise
 def Poynting( variables ):
    ''' Data reducer for the Poynting vector
    '''
@@ -545,6 +565,7 @@ def Poynting( variables ):
    B=np.array(variables[1])
    return np.cross(E, B) / mu_0
 
+@elementwise
 def Hallterm( variables ):
    ''' Data reducer for the deducing an estimate of the Hall term
    '''
@@ -553,6 +574,7 @@ def Hallterm( variables ):
    B=np.array(variables[2])
    return E + np.cross(V, B)
 
+@elementwise
 def Temperature( variables ):
    ''' Data reducer for converting pressure to temperature
    '''
@@ -579,6 +601,7 @@ def Temperature( variables ):
 
 
 
+@elementwise
 def gyrotropy(variables):
 # see Appendix in Swisdak 2016: https://doi.org/10.1002/2015GL066980  
     
@@ -611,12 +634,14 @@ def gyrotropy(variables):
     Q = 1 - 4 * I2 / (  (I1 - Ppar)*(I1 + 3* Ppar)  )
     return Q
 
+@elementwise
 def MagneticPressure( variables ):
    ''' Data reducer for finding the magnetic pressure
    '''
    Magneticfield = variables[0]
    return np.sum(np.asarray(Magneticfield)**2,axis=-1) / 2.0 / mu_0
 
+@elementwise
 def beta( variables ):
    ''' Data reducer for finding the plasma beta
    '''
@@ -624,6 +649,7 @@ def beta( variables ):
    Magneticfield = variables[1]   
    return 2.0 * mu_0 * np.ma.divide(Pressure, np.sum(np.asarray(Magneticfield)**2,axis=-1))
 
+@elementwise
 def beta_star( variables ):
    ''' Data reducer for finding the Brenner+2021 plasma beta
       beta* = (P_thermal + P_ram)/P_magnetic
@@ -634,6 +660,7 @@ def beta_star( variables ):
    return 2.0 * mu_0 * np.ma.divide(Pressure_thermal + Pressure_dynamic, np.sum(np.asarray(Magneticfield)**2,axis=-1))
 
 
+@elementwise
 def rMirror( variables ):
    # More efficient file access, now just takes PTensor and B
    PT = variables[0]
@@ -644,6 +671,7 @@ def rMirror( variables ):
    betaPerp = beta([PPerp,B])
    return betaPerp * (TAniso - 1)   
 
+@elementwise
 def thermalvelocity( variables ):
    Temperature = variables[0]
    mass = vlsvvariables.speciesamu[vlsvvariables.activepopulation]*mp
@@ -693,16 +721,25 @@ def Bz_linedipole_diff( variables ):
    divisor = np.ma.masked_less_equal( np.ma.masked_invalid(magnitude(Bb)),0)
    return np.ma.divide(np.abs(Bb[:,2] - Bzldp), divisor)
 
-def gyrophase_relstddev( variables, velocity_cell_data, velocity_coordinates ):
+@vspace_batch
+def gyrophase_relstddev( variables, cell_offsets, velocity_cell_data, velocity_coordinates ):
    # This reducer needs to be verified
    logging.warning("gyrophase_relstddev reducer called - please verify before use!")
-   bulk_velocity = variables[0]
-   B = variables[1]
-   B_unit = B / np.linalg.norm(B)
-   
-   gyrophase_data = gyrophase_angles(bulk_velocity, B_unit, velocity_cell_data, velocity_coordinates)
-   histo = np.histogram(gyrophase_data[0].data, weights=gyrophase_data[1].data, bins=36, range=[-180.0,180.0], density=True)
-   return np.std(histo[0])/np.mean(histo[0])
+   bulk_velocity = np.reshape(variables[0], (-1,3))
+   B = np.reshape(variables[1], (-1,3))
+   B_unit = B / np.linalg.norm(B, axis=-1)[:,np.newaxis]
+   ncells = len(cell_offsets)-1
+
+   gyro_angles = gyrophase_angles_batch(bulk_velocity, B_unit, cell_offsets, velocity_coordinates)
+   # Histograms of 36 bins over [-180,180] per cell, binned as np.histogram; the density normalization cancels in std/mean
+   bins = 36
+   edges = np.linspace(-180.0, 180.0, bins+1)
+   keep = np.isfinite(gyro_angles)
+   bin_index = np.clip(np.searchsorted(edges, gyro_angles[keep], side="right")-1, 0, bins-1)
+   cells = np.repeat(np.arange(ncells), np.diff(cell_offsets))[keep]
+   histo = np.bincount(cells*bins + bin_index, weights=np.asarray(velocity_cell_data, dtype=np.float64)[keep], minlength=ncells*bins).reshape(ncells,bins)
+   with np.errstate(divide="ignore", invalid="ignore"):
+      return np.std(histo, axis=1)/np.mean(histo, axis=1)
 
 def Dng( variables ):
    # This reducer needs to be verified
@@ -725,6 +762,7 @@ def Dng( variables ):
       N = PTensor - G
       return [np.divide(2.0*np.linalg.norm(N[i], 'fro'), PTensor[i].trace()) for i in np.arange(len(PParallel))]
 
+@elementwise
 def ion_inertial( variables ):
    rho = np.ma.masked_less_equal(np.ma.masked_invalid(np.array(variables[0])),0)
    mass = vlsvvariables.speciesamu[vlsvvariables.activepopulation]*mp
@@ -733,6 +771,7 @@ def ion_inertial( variables ):
    di = np.ma.divide(speedoflight,omegapi)
    return di
 
+@elementwise
 def gyroperiod( variables ):
    B = np.array(variables[0])
    Bmag = np.linalg.norm(B,axis=-1)
@@ -743,6 +782,7 @@ def gyroperiod( variables ):
    #return np.ma.divide(2.*math.pi,omegaci)
    return 2.*math.pi*(omegaci**-1)
 
+@elementwise
 def plasmaperiod( variables ):
    rho = np.ma.masked_less_equal(np.ma.masked_invalid(np.array(variables[0])),0)
    mass = vlsvvariables.speciesamu[vlsvvariables.activepopulation]*mp
@@ -751,6 +791,7 @@ def plasmaperiod( variables ):
    #return np.ma.divide(2.*math.pi,omegapi)
    return 2.*math.pi*(omegapi**-1)
 
+@elementwise
 def larmor( variables ):
    B = variables[0]
    Bmag = np.linalg.norm(B, axis=-1)
@@ -759,6 +800,7 @@ def larmor( variables ):
    charge = vlsvvariables.speciescharge[vlsvvariables.activepopulation]*elementalcharge
    return np.ma.divide(mass*vth,charge*Bmag)
 
+@elementwise
 def firstadiabatic( variables ):
    Tperp = variables[0]
    bvector = variables[1]
@@ -770,6 +812,7 @@ def vg_e_vol( variables, reader):
    fg_e = reader.read_fg_variable_as_volumetric("fg_e")
    return reader.fsgrid_array_to_vg(fg_e)
 
+@elementwise
 def JPerB_criteria( variables ):
    ''' Data reducer function for calculating J/B refinement criterion as it is done in Vlasiator
    '''
@@ -794,6 +837,7 @@ def vg_reflevel(variables, reader):
    cellids = variables[0]
    return reader.get_amr_level(cellids)
 
+@elementwise
 def mlt(variables):
     # return MLT values for give coordinates
     coords = np.atleast_2d(variables[0])
@@ -935,6 +979,7 @@ def ig_inplanecurrent( variables, reader ):
    return ig_sigmap * E - ig_sigmah * np.cross(E, ig_b_hat)
 
 
+@elementwise
 def Pressure_dilatation(variables):
    ''' Calculate the (proton) pressure dilatation interaction term -p*div(V)
        See e.g. Yang+2017: https://doi.org/10.1103/PhysRevE.95.061201
@@ -957,6 +1002,7 @@ def Pressure_dilatation(variables):
    else:
       return dilatation[0,...]
 
+@elementwise
 def PiD(variables):
    ''' Calculate the (proton) Pi-D interaction term
        See e.g. Yang+2017: https://doi.org/10.1103/PhysRevE.95.061201
@@ -989,6 +1035,7 @@ def PiD(variables):
 
  
    
+@elementwise
 def Pressure_strain(variables):
    ''' Calculate the (proton) pressure strain interaction -(P dot nabla) dot bulk velocity, a sum of the pdil and PiD interactions. A separate datareducer to avoid redundant Jacobian estimations.
        See e.g. Yang+2017: https://doi.org/10.1103/PhysRevE.95.061201
@@ -32,9 +32,10 @@ high precision.
 '''
 
 from ..calculations.null_lines import LMN_null_lines_FOTE
-from .reducer import DataReducerVariable
+from .reducer import DataReducerVariable, elementwise
 import numpy as np
 
+@elementwise
 def GGT( variables ):
    ''' Data reducer for MDD, or if you want to multiply a tensor with its transpose
    '''
@@ -54,6 +55,7 @@ def GGT( variables ):
    print("Error in GGT")
    return -1
 
+@elementwise
 def GTG( variables ):
    ''' Data reducer for MGA, or if you want to multiply a tensor's transpose with the tensor
    '''
@@ -73,6 +75,7 @@ def GTG( variables ):
    print("Error in GGT")
    return -1
 
+@elementwise
 def MGA( variables ):
    ''' Data reducer for obtaining the MGA eigensystem
    '''
@@ -95,6 +98,7 @@ def MGA( variables ):
    print("Error in MGA")
    return -1
 
+@elementwise
 def MDD( variables ):
    ''' Data reducer for obtaining the MGA eigensystem
    '''
@@ -122,6 +126,7 @@ def MDD( variables ):
    print("Error in MGA")
    return -1
 
+@elementwise
 def MDD_dimensionality( variables ):
    ''' Data reducer for obtaining the MGA eigensystem
         Rezeau+2018, doi:10.1002/2017JA024526
@@ -161,6 +166,7 @@ def MDD_dimensionality( variables ):
    print("Error in MGA")
    return -1
 
+@elementwise
 def LMN( variables ):
    ''' Data reducer to calculate the LMN basis vectors
         using the full B jacobian
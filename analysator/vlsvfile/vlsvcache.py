@@ -31,8 +31,13 @@ import warnings
 import numbers
 import numpy as np
 import pickle
+import hashlib
 from operator import itemgetter
 import re
+import weakref
+import itertools
+import threading
+from collections import OrderedDict
 try:
    import rtree 
    logging.info("Rtree found, but tread carefully - the file caching is somewhat unstable")
@@ -53,24 +58,211 @@ except:
             pass
 import time
 
+def physical_memory_bytes():
+   ''' Total physical memory of the node in bytes, or None if it cannot be determined.
+   '''
+   try:
+      return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+   except (ValueError, OSError, AttributeError):
+      return None
+
+class CacheMiss(KeyError):
+   ''' Raised when a variable is not (or no longer) in the variable cache.
+   '''
+   pass
+
 class VariableCache:
-    ''' Class for handling in-memory variable/reducer caching.
-    TODO: Add some maximum memory use guards.
-    '''
-    def __init__(self):
-        self.__varcache = {} # {(varname, operator):data}
-
-    def keys(self):
-        return self.__varcache.keys()
-    
-    def __getitem__(self, key):
-       return self.__varcache[key]
-       
-    def __setitem__(self, key, value):
-       self.__varcache[key] = value
-       
-
-    def read_variable_from_cache(self, reader, name, cellids, operator):
+   ''' Class for handling in-memory variable/reducer caching.
+
+   Entries are keyed by (lowercase variable name, operator) and evicted in least-recently-used
+   order when the cache exceeds its own byte budget (max_bytes), or when all caches in the
+   process together exceed the process-wide budget (see :func:`set_process_budget`).
+   Pinned entries (by default CellID) are never evicted.
+
+   Caches can be used from several threads: all caches in the process share one lock,
+   as eviction may cross from one cache to another.
+   '''
+   # Process-wide byte budget over all VariableCache instances, None for unbounded.
+   # Defaults to a quarter of the physical memory.
+   process_max_bytes = None if physical_memory_bytes() is None else physical_memory_bytes()//4
+   # Default byte budget of the cache of a single reader, which also holds the data reducer
+   # results of cache_derived_variables. Defaults to a sixteenth of the physical memory, or 1 GiB.
+   reader_max_bytes = 2**30 if physical_memory_bytes() is None else physical_memory_bytes()//16
+   __instances = weakref.WeakSet()
+   __access_counter = itertools.count()
+   __lock = threading.RLock()
+
+   class Entry:
+      __slots__ = ("data", "nbytes", "last_used", "pinned", "copy_on_read")
+
+      def __init__(self, data, pinned, copy_on_read):
+         self.data = data
+         self.nbytes = data.nbytes if isinstance(data, np.ndarray) else sys.getsizeof(data)
+         self.last_used = 0
+         self.pinned = pinned
+         self.copy_on_read = copy_on_read
+
+   def __init__(self, max_bytes=None, pinned_names=("cellid",)):
+      '''
+      :kwarg max_bytes:    int, byte budget of this cache, None for unbounded (process-wide budget still applies)
+      :kwarg pinned_names: variable names whose entries are never evicted
+      '''
+      self.__varcache = OrderedDict() # {(varname, operator):Entry}, least recently used first
+      self.max_bytes = max_bytes
+      self.pinned_names = set(n.lower() for n in pinned_names)
+      self.nbytes = 0
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+      VariableCache.__instances.add(self)
+
+   @classmethod
+   def set_process_budget(cls, max_bytes):
+      ''' Set the byte budget shared by all variable caches in this process (None for unbounded),
+      evicting least-recently-used entries across caches if needed.
+      '''
+      with cls.__lock:
+         cls.process_max_bytes = max_bytes
+         cls.__enforce_process_budget()
+
+   def set_budget(self, max_bytes):
+      ''' Set the byte budget of this cache (None for unbounded), evicting least-recently-used entries if needed.
+      '''
+      with VariableCache.__lock:
+         self.max_bytes = max_bytes
+         self.__enforce_budget()
+
+   @classmethod
+   def process_nbytes(cls):
+      ''' Total bytes held by all variable caches in this process.
+      '''
+      with cls.__lock:
+         return sum(cache.nbytes for cache in list(cls.__instances))
+
+   @staticmethod
+   def __key(key):
+      name, operator = key
+      return (name.lower(), operator)
+
+   def keys(self):
+      return self.__varcache.keys()
+
+   def __contains__(self, key):
+      return self.__key(key) in self.__varcache
+
+   def __len__(self):
+      return len(self.__varcache)
+
+   def __getitem__(self, key):
+      key = self.__key(key)
+      with VariableCache.__lock:
+         entry = self.__varcache[key]
+         self.__touch(key, entry)
+      return entry.data
+
+   def __setitem__(self, key, value):
+      self.add(key, value)
+
+   def __delitem__(self, key):
+      with VariableCache.__lock:
+         entry = self.__varcache.pop(self.__key(key))
+         self.nbytes -= entry.nbytes
+
+   def add(self, key, value, copy_on_read=False):
+      ''' Add data to the cache and evict least-recently-used entries to stay within the budgets.
+      Data larger than the budget of this cache is not stored.
+
+      :param key:   (variable name, operator)
+      :param value: data over the whole grid
+      :kwarg copy_on_read: Boolean [False], hand out copies of the data on reads of the whole grid,
+                           so that callers cannot modify the cached data in place
+      '''
+      key = self.__key(key)
+      entry = self.Entry(value, key[0] in self.pinned_names, copy_on_read)
+      with VariableCache.__lock:
+         if key in self.__varcache:
+            del self[key]
+         if not entry.pinned and self.max_bytes is not None and entry.nbytes > self.max_bytes:
+            return
+         self.__varcache[key] = entry
+         self.nbytes += entry.nbytes
+         self.__touch(key, entry)
+         self.__enforce_budget(keep=key)
+         VariableCache.__enforce_process_budget(keep=(self, key))
+
+   def pin(self, key):
+      ''' Exclude an entry from eviction.
+      '''
+      with VariableCache.__lock:
+         self.__varcache[self.__key(key)].pinned = True
+
+   def unpin(self, key):
+      ''' Allow an entry to be evicted again.
+      '''
+      with VariableCache.__lock:
+         self.__varcache[self.__key(key)].pinned = False
+
+   def clear(self):
+      ''' Drop all entries, pinned ones included.
+      '''
+      with VariableCache.__lock:
+         self.__varcache.clear()
+         self.nbytes = 0
+
+   def stats(self):
+      ''' Return a dictionary of the cache counters and sizes.
+      '''
+      return {"entries":len(self.__varcache), "nbytes":self.nbytes, "max_bytes":self.max_bytes,
+              "hits":self.hits, "misses":self.misses, "evictions":self.evictions}
+
+   def __touch(self, key, entry):
+      entry.last_used = next(VariableCache.__access_counter)
+      self.__varcache.move_to_end(key)
+
+   def __oldest_evictable(self, keep=None):
+      for key, entry in self.__varcache.items():
+         if not entry.pinned and key != keep:
+            return key, entry
+      return None, None
+
+   def __evict(self, key):
+      del self[key]
+      self.evictions += 1
+
+   def __enforce_budget(self, keep=None):
+      if self.max_bytes is None:
+         return
+      while self.nbytes > self.max_bytes:
+         key, entry = self.__oldest_evictable(keep)
+         if key is None:
+            break
+         self.__evict(key)
+
+   @classmethod
+   def __enforce_process_budget(cls, keep=None):
+      if cls.process_max_bytes is None:
+         return
+      caches = list(cls.__instances)
+      total = sum(cache.nbytes for cache in caches)
+      while total > cls.process_max_bytes:
+         victim = None
+         for cache in caches:
+            key, entry = cache.__oldest_evictable(keep[1] if keep is not None and keep[0] is cache else None)
+            if key is not None and (victim is None or entry.last_used < victim[2].last_used):
+               victim = (cache, key, entry)
+         if victim is None:
+            break
+         victim[0].__evict(victim[1])
+         total -= victim[2].nbytes
+
+   def __getstate__(self):
+      return self.__dict__.copy()
+
+   def __setstate__(self, state):
+      self.__dict__.update(state)
+      VariableCache.__instances.add(self)
+
+   def read_variable_from_cache(self, reader, name, cellids, operator):
       ''' Read variable from cache instead of the vlsv file.
          :param name: Name of the variable
          :param cellids: a value of -1 reads all data
@@ -80,36 +272,229 @@ class VariableCache:
          .. seealso:: :func:`read_variable`
       '''
 
-      var_data = self.__varcache[(name,operator)]
-      if var_data.ndim == 2:
-         value_len = var_data.shape[1]
-      else:
-         value_len = 1
-         
+      key = self.__key((name,operator))
+      with VariableCache.__lock:
+         entry = self.__varcache.get(key)
+         if entry is None: # May have been evicted by another thread since checking for it
+            raise CacheMiss(key)
+         self.__touch(key, entry)
+         self.hits += 1
+      var_data = entry.data
+
       if isinstance(cellids, numbers.Number):
          if cellids == -1:
+            if entry.copy_on_read:
+               return var_data.copy()
             return var_data
          else:
             return var_data[reader.get_cellid_fileindices(np.array([cellids],dtype=np.int64))][0,...]
       else:
-         if(len(cellids) > 0):
-            indices = reader.get_cellid_fileindices(np.array(cellids,dtype=np.int64))
+         # As in VlsvReader.read: cellid 0 gives nan (or the smallest integer), and a
+         # single requested cell is returned without the cell dimension
+         cellids = np.array(cellids,dtype=np.int64)
+         nonzero = cellids != 0
+         if np.any(nonzero):
+            indices = reader.get_cellid_fileindices(cellids[nonzero])
          else:
             indices = np.array([],dtype=np.int64)
-         if(len(cellids) == 1):
-            if value_len == 1:
-               return var_data[indices][0]
+         data = var_data[indices,...]
+         if not np.all(nonzero):
+            if np.issubdtype(data.dtype, np.integer):
+               data_out = np.full((len(cellids),)+data.shape[1:], np.iinfo(data.dtype).min, dtype=data.dtype)
             else:
-               return var_data[indices,:][0,:]
-         else:
-            if value_len == 1:
-               return var_data[indices]
-            else:
-               return var_data[indices,:]
+               data_out = np.full((len(cellids),)+data.shape[1:], np.nan, dtype=data.dtype)
+            data_out[nonzero,...] = data
+            data = data_out
+         if np.count_nonzero(nonzero) == 1:
+            return data[0,...]
+         return data
+
+class CellIDOctree(object):
+   ''' Point-to-cell lookup for SpatialGrid (AMR) meshes, as a flattened octree.
+
+   The base level is a dense array over the level 0 grid, and every refined cell is a node with
+   8 child slots. Entries hold the cellid of a leaf cell, -(node + 1) for a refined cell whose
+   children are in node of the next level, or 0 where there is no cell. A lookup is one gather per
+   refinement level for all points at once, with no searches.
+
+   Octrees depend only on the mesh, so readers share them through :class:`MeshRegistry`.
+   '''
+
+   def __init__(self, cellids, starts, cells, lengths, mins):
+      ''' Build the octree of a mesh.
+
+      :param cellids: numpy array of the cellids of the mesh
+      :param starts:  first cellid of each refinement level, and the first id past the finest level [levels+1]
+      :param cells:   number of cells along x, y and z on each level [levels, 3]
+      :param lengths: cell side lengths on each level [levels, 3]
+      :param mins:    minimum coordinates of the mesh [3]
+      '''
+      self.cells = np.asarray(cells, dtype=np.int64)
+      self.lengths = np.asarray(lengths, dtype=np.float64)
+      self.mins = np.asarray(mins, dtype=np.float64)
+      starts = np.asarray(starts, dtype=np.int64)
+      max_level = len(self.cells) - 1
+
+      cellids = np.unique(np.asarray(cellids, dtype=np.int64))
+      levels = np.searchsorted(starts, cellids, side="right") - 1
+      valid = (levels >= 0) & (levels <= max_level)
+      cellids, levels = cellids[valid], levels[valid]
+      indices = self.__decode(cellids - starts[levels], self.cells[levels])
+
+      # Refined cells of each level, as sorted linear indices on that level: the parents of
+      # everything, leaf or refined, on the next level
+      refined = [np.empty(0, dtype=np.int64) for level in range(max_level+1)]
+      for level in range(max_level, 0, -1):
+         children = np.concatenate((indices[levels == level], self.__decode(refined[level], self.cells[level])))
+         refined[level-1] = np.unique(self.__encode(children // 2, self.cells[level-1]))
+
+      self.__tables = [np.zeros(np.prod(self.cells[0]), dtype=np.int64)]
+      at = levels == 0
+      self.__tables[0][self.__encode(indices[at], self.cells[0])] = cellids[at]
+      self.__tables[0][refined[0]] = -(np.arange(len(refined[0]), dtype=np.int64) + 1)
+      for level in range(1, max_level+1):
+         table = np.zeros((len(refined[level-1]), 8), dtype=np.int64)
+         at = levels == level
+         for children, values in ((indices[at], cellids[at]),
+                                  (self.__decode(refined[level], self.cells[level]), -(np.arange(len(refined[level]), dtype=np.int64) + 1))):
+            nodes = np.searchsorted(refined[level-1], self.__encode(children // 2, self.cells[level-1]))
+            table[nodes, self.__slot(children)] = values
+         self.__tables.append(table)
+
+   @staticmethod
+   def __encode(indices, cells):
+      return indices[...,0] + cells[...,0]*(indices[...,1] + cells[...,1]*indices[...,2])
+
+   @staticmethod
+   def __decode(linear, cells):
+      cells = np.broadcast_to(cells, np.shape(linear) + (3,))
+      rest, i = np.divmod(linear, cells[...,0])
+      k, j = np.divmod(rest, cells[...,1])
+      return np.stack((i, j, k), axis=-1)
+
+   @staticmethod
+   def __slot(indices):
+      return (indices[:,0] & 1) + 2*(indices[:,1] & 1) + 4*(indices[:,2] & 1)
+
+   def lookup(self, coordinates):
+      ''' Cellids of the cells containing coordinates.
+
+      :param coordinates: numpy array of coordinates [n,3]
+      :returns: numpy array of cellids [n], 0 for coordinates outside the mesh
+      '''
+      coordinates = np.atleast_2d(coordinates)
+      cellids = np.zeros(coordinates.shape[0], dtype=np.int64)
+      indices = ((coordinates - self.mins)/self.lengths[0]).astype(np.int64)
+      inside = np.nonzero(np.all((indices >= 0) & (indices < self.cells[0]), axis=1))[0]
+      cellids[inside] = self.__tables[0][self.__encode(indices[inside], self.cells[0])]
+      for level in range(1, len(self.__tables)):
+         refined = inside[cellids[inside] < 0]
+         if len(refined) == 0:
+            break
+         indices = ((coordinates[refined] - self.mins)/self.lengths[level]).astype(np.int64)
+         cellids[refined] = self.__tables[level][-cellids[refined] - 1, self.__slot(indices)]
+         inside = refined
+      cellids[cellids < 0] = 0
+      return cellids
+
+   @property
+   def nbytes(self):
+      return sum(table.nbytes for table in self.__tables)
+
+class SharedMesh(object):
+   ''' Read-only objects derived from a mesh, built once and shared by all readers of that mesh.
+   Objects are built on first request under the lock of the entry, so concurrent readers do not
+   duplicate the work.
+   '''
+
+   def __init__(self, key):
+      self.key = key
+      self.__lock = threading.RLock()
+      self.__objects = {}
+
+   def get(self, name, build):
+      ''' The object stored under name, built with build() if not there yet.
+
+      :param name:  a hashable key
+      :param build: function without arguments returning the object
+      '''
+      with self.__lock:
+         if name not in self.__objects:
+            self.__objects[name] = build()
+         return self.__objects[name]
+
+   def __contains__(self, name):
+      return name in self.__objects
+
+   def __getstate__(self):
+      state = self.__dict__.copy()
+      del state["_SharedMesh__lock"]
+      return state
+
+   def __setstate__(self, state):
+      self.__dict__.update(state)
+      self.__lock = threading.RLock()
+
+class MeshRegistry(object):
+   ''' Process-wide registry of :class:`SharedMesh` entries, keyed by mesh fingerprints.
+
+   Two kinds of entries are used by the readers:
+
+   - layouts, keyed by :func:`layout_fingerprint`, for objects that refer to file order (CellID file
+     index, vg to fg index maps). Files of a run with a static mesh and no load balancing in between
+     share them.
+   - geometries, keyed by :func:`geometry_fingerprint`, for objects that depend only on the cells
+     (spatial index, dual mesh). All files with the same refinement share them.
+
+   Entries live as long as some reader holds them.
+
+   .. seealso:: :func:`vlsvfile.VlsvReader.get_mesh_layout`, :func:`vlsvfile.VlsvReader.get_mesh_geometry`
+   '''
+   __entries = weakref.WeakValueDictionary()
+   __lock = threading.Lock()
+
+   @staticmethod
+   def __digest(array):
+      return hashlib.blake2b(np.ascontiguousarray(array).data, digest_size=16).hexdigest()
+
+   @staticmethod
+   def __grid(reader):
+      return (tuple(int(n) for n in reader.get_spatial_mesh_size()),
+              tuple(float(x) for x in reader.get_spatial_mesh_extent()))
+
+   @classmethod
+   def layout_fingerprint(cls, reader, cellids):
+      ''' Key of the SpatialGrid of reader with its file order: the grid and a hash of CellID as stored.
+      '''
+      return ("layout",) + cls.__grid(reader) + (cls.__digest(np.asarray(cellids, dtype=np.int64)),)
+
+   @classmethod
+   def geometry_fingerprint(cls, reader, cellids_ordered):
+      ''' Key of the SpatialGrid cells of reader: the grid and a hash of the sorted cellids.
+      '''
+      return ("geometry",) + cls.__grid(reader) + (cls.__digest(np.asarray(cellids_ordered, dtype=np.int64)),)
+
+   @classmethod
+   def shared(cls, key):
+      ''' The :class:`SharedMesh` of key, registered anew if no reader holds it.
+      '''
+      with cls.__lock:
+         entry = cls.__entries.get(key)
+         if entry is None:
+            entry = SharedMesh(key)
+            cls.__entries[key] = entry
+         return entry
+
+   @classmethod
+   def entries(cls):
+      ''' Number of live entries.
+      '''
+      return len(cls.__entries)
 
 class FileCache:
    ''' Top-level class for caching to file.
    '''
+   __lock = threading.RLock() # Serialises metadata file updates between threads
 
    def __init__(self, reader) -> None:
       self.__metadata_dict = {}
@@ -192,8 +577,10 @@ class FileCache:
       return self.__rtree_index
 
    def add_metadata(self, reader, key, value):
-      self.__metadata_dict[key] = value
-      self.save_metadata(reader)
+      with FileCache.__lock:
+         self.get_metadata(reader, key, None) # Make sure existing metadata is read in before saving over it
+         self.__metadata_dict[key] = value
+         self.save_metadata(reader)
 
    def get_metadata_filename(self, reader):
       pth, base = os.path.split(reader.file_name)
@@ -221,17 +608,62 @@ class FileCache:
       '''
 
       if not self.__metadata_read:
-         try:
-            fn = self.get_metadata_filename(reader)
-            with open(fn,'rb') as f:
-               self.__metadata_dict = pickle.load(f)
-         except Exception as e:
-            logging.debug("No metadata file found at "+self.get_metadata_filename(reader)+":\n"+str(e))
-            
-         self.__metadata_read = True
+         with FileCache.__lock:
+            if not self.__metadata_read:
+               try:
+                  fn = self.get_metadata_filename(reader)
+                  with open(fn,'rb') as f:
+                     self.__metadata_dict = pickle.load(f)
+               except Exception as e:
+                  logging.debug("No metadata file found at "+self.get_metadata_filename(reader)+":\n"+str(e))
+
+               self.__metadata_read = True
      
       return self.__metadata_dict.get(key,default)
 
+   def get_sidecar_filename(self, reader, name):
+      return os.path.join(self.get_cache_folder(reader), name+".npy")
+
+   def get_file_stamp(self, reader):
+      ''' Size and modification time of the vlsv file, used to validate sidecar files.
+      '''
+      st = os.stat(reader.file_name)
+      return (st.st_size, st.st_mtime_ns)
+
+   def save_sidecar_array(self, reader, name, array):
+      ''' Save an array as a .npy sidecar file in the cache folder, stamped with the
+      size and modification time of the vlsv file.
+
+      :param name:  str, name of the sidecar
+      :param array: numpy array to save
+      '''
+      fn = self.get_sidecar_filename(reader, name)
+      try:
+         os.makedirs(self.get_cache_folder(reader), exist_ok=True)
+         tmpfn = fn+"."+str(os.getpid())+"."+str(threading.get_ident())+".tmp"
+         with open(tmpfn,'wb') as f:
+            np.save(f, np.asarray(array))
+         os.replace(tmpfn, fn)
+         self.add_metadata(reader, ("sidecar", name), self.get_file_stamp(reader))
+      except Exception as e:
+         logging.warning("Could not save sidecar file "+fn+", error: "+str(e))
+
+   def load_sidecar_array(self, reader, name):
+      ''' Memory-map a .npy sidecar file from the cache folder. Returns None if it does not
+      exist or was written for a different version (size/modification time) of the vlsv file.
+
+      :param name: str, name of the sidecar
+      '''
+      stamp = self.get_metadata(reader, ("sidecar", name), None)
+      if stamp is None or tuple(stamp) != self.get_file_stamp(reader):
+         return None
+      fn = self.get_sidecar_filename(reader, name)
+      try:
+         return np.load(fn, mmap_mode='r')
+      except Exception as e:
+         logging.debug("Could not load sidecar file "+fn+":\n"+str(e))
+         return None
+
 # Stashed hdf5 snippet
 # import h5py
    # def get_h5_metadata(self, key, default):
@@ -298,3 +730,36 @@ class PicklableFile(object):
       del dict['_file_mode']
       del dict['_file_pos']
       self.__dict__.update(dict)
+
+class PicklableMemmap(object):
+   ''' Lazily created read-only memory map over a whole file. The mapping
+   itself is dropped on pickling and recreated on first use afterwards, so
+   that readers can be sent to worker processes without copying the map.
+   '''
+   def __init__(self, file_name):
+      self.file_name = file_name
+      self.__map = None
+
+   def get(self):
+      ''' Return the np.memmap (dtype uint8) of the whole file, mapping it if needed.
+      '''
+      if self.__map is None:
+         self.__map = np.memmap(self.file_name, dtype=np.uint8, mode='r')
+      return self.__map
+
+   def view(self, offset, dtype, count):
+      ''' Typed, read-only view of count elements of dtype starting at byte offset.
+      '''
+      return np.frombuffer(self.get(), dtype=dtype, count=count, offset=int(offset))
+
+   def close(self):
+      ''' Release the mapping; views handed out earlier keep their pages alive.
+      '''
+      self.__map = None
+
+   def __getstate__(self):
+      return {'file_name': self.file_name}
+
+   def __setstate__(self, state):
+      self.file_name = state['file_name']
+      self.__map = None
@@ -30,9 +30,12 @@ import os
 import sys
 import re
 import numbers
-import pickle # for caching linked readers, switch to VLSV/XML at some point - h5py?
 from abc import ABC, abstractmethod
 import weakref
+import threading
+import functools
+import hashlib
+import inspect
 
 from . import vlsvvariables,vlsvcache
 from .reduction import datareducers,multipopdatareducers,data_operators,v5reducers,multipopv5reducers,deprecated_datareducers
@@ -46,12 +49,41 @@ from ..calculations.variable import get_data
 import warnings
 import time
 from ..calculations.interpolator_amr import AMRInterpolator, supported_amr_interpolators
+from ..calculations.interpolation_plan import InterpolationPlan
 from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 
 
 interp_method_aliases = {"trilinear":"linear"}
 
-neighbors_cache_file = "neighbors_cache.pkl"
+neighbors_cache_file = "neighbors_cache.npz"
+
+# Smallest number of cells per block when element-wise data reducers are split over threads
+reducer_block_cells = 65536
+
+# Largest number of velocity blocks per chunk of cells handed to a velocity-space data reducer
+vspace_chunk_blocks = 16384
+
+# Reader of a velocity-space reducer worker process, opened once per process by _vspace_worker_init
+_vspace_worker_reader = None
+
+def _vspace_worker_init(file_name):
+   global _vspace_worker_reader
+   _vspace_worker_reader = VlsvReader(file_name)
+
+def _vspace_worker_task(task):
+   ''' Evaluates a chunk of a velocity-space data reducer in a worker process, task is (index, reducer, cellids, tag, mesh, pop).
+   '''
+   index, reducer, cellids, tag, mesh, pop = task
+   return index, _vspace_worker_reader._VlsvReader__evaluate_vspace_chunk(reducer, cellids, tag, mesh, pop)
+
+# Corners of a cell, and the cells around a vertex, as [x,y,z] offsets with z varying fastest
+dual_corner_offsets = np.array([[x,y,z] for x in [0,1] for y in [0,1] for z in [0,1]], dtype=np.int64)
+
+# (datatype attribute, datasize attribute) -> numpy dtype of VLSV arrays
+vlsv_datatypes = {("float",4):np.float32, ("float",8):np.float64,
+                  ("int",4):np.int32, ("int",8):np.int64,
+                  ("uint",4):np.uint32, ("uint",8):np.uint64}
 
 def dict_keys_exist(dictionary, query_keys, prune_unique=False):
    if query_keys.shape[0] == 0:
@@ -80,6 +112,248 @@ def dict_keys_exist(dictionary, query_keys, prune_unique=False):
 
    return mask
 
+def coalesce_ranges(range_starts, range_lengths, max_gap=0):
+   ''' Merge element ranges of a file array into as few contiguous reads as possible.
+
+   Ranges are sorted by start, and a range is merged into the previous read if at most
+   max_gap unrequested elements lie between them. Overlapping ranges share data.
+
+   :param range_starts:  array of range start indices, in request order
+   :param range_lengths: array of range lengths (> 0)
+   :kwarg max_gap:       int, largest number of unrequested elements to read through when merging
+   :returns: read_starts, read_lengths, positions: start and length of each merged read,
+             and for each requested range the position of its first element in the
+             concatenation of the reads
+   '''
+   range_starts = np.asarray(range_starts, dtype=np.int64)
+   range_lengths = np.asarray(range_lengths, dtype=np.int64)
+   if range_starts.size == 0:
+      return np.array([],dtype=np.int64), np.array([],dtype=np.int64), np.array([],dtype=np.int64)
+
+   order = np.argsort(range_starts, kind='stable')
+   starts = range_starts[order]
+   ends = starts + range_lengths[order]
+   reach = np.maximum.accumulate(ends)
+
+   new_read = np.empty(starts.size, dtype=bool)
+   new_read[0] = True
+   new_read[1:] = starts[1:] > reach[:-1] + max_gap
+   first = np.nonzero(new_read)[0]
+   read_of_range = np.cumsum(new_read) - 1
+
+   read_starts = starts[first]
+   read_lengths = np.maximum.reduceat(ends, first) - read_starts
+   read_positions = np.cumsum(read_lengths) - read_lengths
+
+   positions = np.empty(starts.size, dtype=np.int64)
+   positions[order] = read_positions[read_of_range] + starts - read_starts[read_of_range]
+   return read_starts, read_lengths, positions
+
+def coalesce_read_ranges(fileindices, max_gap=0):
+   ''' Plan contiguous read ranges for a set of file indices.
+
+   Each index is a range of one element for :func:`coalesce_ranges`: the ranges are sorted by
+   start, and an index is merged into the previous range if at most max_gap unrequested elements
+   lie between them. Repeated indices are kept, they overlap the same element of a range, so it is
+   read once and scatter points every repeat at it.
+
+   :param fileindices: array of element indices into a file array, in request order
+   :kwarg max_gap:     int, largest number of unrequested elements to read through when merging
+   :returns: range_starts, range_lengths, scatter: start index and length of each range,
+             and for each requested index its position in the concatenation of the ranges
+
+   .. seealso:: :func:`coalesce_ranges`
+   '''
+   fileindices = np.asarray(fileindices, dtype=np.int64)
+   return coalesce_ranges(fileindices, np.ones(fileindices.shape, dtype=np.int64), max_gap)
+
+def csr_take(indptr, data, rows):
+   ''' Gather rows of a compressed sparse row (CSR) structure.
+
+   :param indptr: row pointers, [n+1]
+   :param data:   row contents, [indptr[-1]]
+   :param rows:   indices of the rows to take, in order
+   :returns: indptr, data of the gathered rows
+   '''
+   rows = np.asarray(rows, dtype=np.int64)
+   lengths = indptr[rows+1] - indptr[rows]
+   new_indptr = np.zeros(len(rows)+1, dtype=np.int64)
+   np.cumsum(lengths, out=new_indptr[1:])
+   positions = np.arange(new_indptr[-1], dtype=np.int64) + np.repeat(indptr[rows] - new_indptr[:-1], lengths)
+   return new_indptr, data[positions]
+
+class SortedArrayMap(object):
+   ''' Map from int64 keys to fixed-size rows of numpy arrays, kept as a sorted key array and
+   row-aligned value arrays. Lookups are vectorised with searchsorted, and inserts merge a batch
+   of new keys at once. Every insert publishes a new set of arrays, so readers always see a
+   consistent snapshot.
+
+   :param value_specs: (row shape, dtype) of each value array
+   '''
+
+   def __init__(self, *value_specs):
+      self.__specs = value_specs
+      self.__lock = threading.Lock() # Serialises inserts, maps may be shared between readers
+      self.__arrays = (np.empty(0, dtype=np.int64),) + tuple(np.empty((0,)+tuple(shape), dtype=dtype) for shape, dtype in value_specs)
+
+   def __len__(self):
+      return len(self.__arrays[0])
+
+   def __find(self, keys, arrays):
+      keys = np.asarray(keys, dtype=np.int64)
+      positions = np.searchsorted(arrays[0], keys)
+      positions[positions == len(arrays[0])] = 0
+      found = (arrays[0][positions] == keys) if len(arrays[0]) > 0 else np.zeros(keys.shape, dtype=bool)
+      return found, positions
+
+   def contains(self, keys):
+      ''' Boolean mask of the keys present in the map.
+      '''
+      return self.__find(keys, self.__arrays)[0]
+
+   def get(self, keys):
+      ''' Look up keys.
+
+      :returns: found mask and a list of value arrays, zero-filled for keys not found
+      '''
+      arrays = self.__arrays
+      found, positions = self.__find(keys, arrays)
+      values = []
+      for array in arrays[1:]:
+         rows = array[positions] if len(array) > 0 else np.zeros(positions.shape + array.shape[1:], dtype=array.dtype)
+         rows[~found] = 0
+         values.append(rows)
+      return found, values
+
+   def insert(self, keys, *values):
+      ''' Add rows for keys not yet in the map; existing keys keep their rows.
+      '''
+      with self.__lock:
+         arrays = self.__arrays
+         keys, first = np.unique(np.asarray(keys, dtype=np.int64), return_index=True)
+         new = ~self.__find(keys, arrays)[0]
+         if not np.any(new):
+            return
+         merged_keys = np.concatenate((arrays[0], keys[new]))
+         order = np.argsort(merged_keys, kind='stable')
+         merged = [merged_keys[order]]
+         for array, value in zip(arrays[1:], values):
+            value = np.asarray(value, dtype=array.dtype)[first][new]
+            merged.append(np.concatenate((array, value))[order])
+         self.__arrays = tuple(merged)
+
+   def arrays(self):
+      ''' The sorted keys and the value arrays, for saving.
+      '''
+      return self.__arrays
+
+   def set_arrays(self, keys, *values):
+      ''' Replace the contents with sorted keys and row-aligned value arrays, as returned by :func:`arrays`.
+      '''
+      self.__arrays = (np.asarray(keys, dtype=np.int64),) + tuple(np.asarray(v, dtype=dt) for v, (shape, dt) in zip(values, self.__specs))
+
+class SortedCSRMap(object):
+   ''' Map from int64 keys to variable-length int64 lists, kept as sorted keys with the lists in
+   compressed sparse row (CSR) form. Lookups and inserts are batched as in :class:`SortedArrayMap`.
+   '''
+
+   def __init__(self):
+      self.__lock = threading.Lock() # Serialises inserts, maps may be shared between readers
+      self.__arrays = (np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+   def __len__(self):
+      return len(self.__arrays[0])
+
+   def contains(self, keys):
+      ''' Boolean mask of the keys present in the map.
+      '''
+      sorted_keys = self.__arrays[0]
+      keys = np.asarray(keys, dtype=np.int64)
+      if len(sorted_keys) == 0:
+         return np.zeros(keys.shape, dtype=bool)
+      positions = np.searchsorted(sorted_keys, keys)
+      positions[positions == len(sorted_keys)] = 0
+      return sorted_keys[positions] == keys
+
+   def get(self, keys):
+      ''' Look up keys, which must all be present.
+
+      :returns: indptr, data of the lists of the keys, in order
+      '''
+      sorted_keys, indptr, data = self.__arrays
+      positions = np.searchsorted(sorted_keys, np.asarray(keys, dtype=np.int64))
+      return csr_take(indptr, data, positions)
+
+   def insert(self, keys, indptr, data):
+      ''' Add the lists (given in CSR form) of keys not yet in the map.
+      '''
+      with self.__lock:
+         keys = np.asarray(keys, dtype=np.int64)
+         keys, first = np.unique(keys, return_index=True)
+         indptr, data = csr_take(np.asarray(indptr, dtype=np.int64), np.asarray(data, dtype=np.int64), first)
+         new = ~self.contains(keys)
+         if not np.any(new):
+            return
+         indptr, data = csr_take(indptr, data, np.nonzero(new)[0])
+         old_keys, old_indptr, old_data = self.__arrays
+         merged_keys = np.concatenate((old_keys, keys[new]))
+         merged_indptr = np.concatenate((old_indptr, old_indptr[-1] + indptr[1:]))
+         merged_data = np.concatenate((old_data, data))
+         order = np.argsort(merged_keys, kind='stable')
+         merged_indptr, merged_data = csr_take(merged_indptr, merged_data, order)
+         self.__arrays = (merged_keys[order], merged_indptr, merged_data)
+
+   def arrays(self):
+      ''' The sorted keys, indptr and data, for saving.
+      '''
+      return self.__arrays
+
+   def set_arrays(self, keys, indptr, data):
+      ''' Replace the contents with arrays as returned by :func:`arrays`.
+      '''
+      self.__arrays = (np.asarray(keys, dtype=np.int64), np.asarray(indptr, dtype=np.int64), np.asarray(data, dtype=np.int64))
+
+class DualMesh(object):
+   ''' The dual mesh structures of a SpatialGrid, built on demand. Vertices are keyed by vertex codes,
+   the vertex indices [i,j,k] at the finest resolution encoded into one integer (SEE: VlsvReader.get_vertex_codes).
+   They depend only on the cells, so readers of the same mesh share one DualMesh.
+   '''
+
+   def __init__(self):
+      self.duals = SortedArrayMap(((8,), np.int64), ((6,), np.float64)) # vertex code : cellids at the 8 corners of the dual cell, and its bounding box (xmin, ymin, zmin, xmax, ymax, zmax)
+      self.cell_vertices = SortedCSRMap() # cellid : vertex codes of the cell - corners first, then hanging nodes
+      self.cell_corner_vertices = SortedArrayMap(((8,), np.int64)) # cellid : vertex codes of the 8 corners - no hanging nodes!
+      self.cell_neighbours = SortedCSRMap() # cellid : cellids of all neighbors sharing a vertex
+      self.cell_duals = SortedArrayMap() # cellids whose vertices have their duals built
+      self.regular_neighbor_cache = SortedArrayMap(((8,), np.int64)) # cellid-of-low-corner : cellids of the 8 cells spanning its upper corner vertex
+
+# Positional reads leave the file position alone, so one open handle can serve many threads
+positional_reads = hasattr(os, "preadv") or hasattr(os, "pread")
+
+def pread_into(fileno, offset, buffer):
+   ''' Read into a writable buffer from byte offset of an open file descriptor without using or
+   moving the shared file position (os.preadv, or os.pread where preadv is missing).
+
+   :param fileno: file descriptor
+   :param offset: byte offset in the file
+   :param buffer: writable buffer (e.g. a uint8 numpy array), filled from the start
+   :returns: number of bytes read, less than len(buffer) only at the end of the file
+   '''
+   view = memoryview(buffer).cast("B")
+   nbytes = len(view)
+   done = 0
+   while done < nbytes:
+      if hasattr(os, "preadv"):
+         got = os.preadv(fileno, [view[done:]], offset+done)
+      else:
+         chunk = os.pread(fileno, nbytes-done, offset+done)
+         got = len(chunk)
+         view[done:done+got] = chunk
+      if got == 0:
+         break
+      done += got
+   return done
+
 def fsGlobalIdToGlobalIndex(globalids, bbox):
    indices = np.zeros((globalids.shape[0],3),dtype=np.int64)
 
@@ -120,14 +394,42 @@ def fsDecompositionFromGlobalIds(reader):
    return [xs.size, ys.size, zs.size]
 
 def map_vg_onto_fg_loop(arr, vg_cellids, refined_ids_start, refined_ids_end):
-   #arr = np.zeros(sz, dtype=np.int64) + 1000000000 # big number to catch errors in the latter code, 0 is not good for that
+   ''' Deprecated per-cell form of :func:`VlsvReader.map_vg_onto_fg`: writes into arr, for each cell i of vg_cellids,
+   the index i over the fsgrid cells from refined_ids_start[i] to refined_ids_end[i].
 
+   .. seealso:: :func:`VlsvReader.map_vg_onto_fg` :func:`VlsvReader.map_vg_onto_fg_levels`
+   '''
+   warnings.warn("map_vg_onto_fg_loop is deprecated, use VlsvReader.map_vg_onto_fg or VlsvReader.map_vg_onto_fg_levels instead", DeprecationWarning, stacklevel=2)
    for i in range(vg_cellids.shape[0]):
       arr[refined_ids_start[i,0]:refined_ids_end[i,0],
                            refined_ids_start[i,1]:refined_ids_end[i,1],
                            refined_ids_start[i,2]:refined_ids_end[i,2]] = i
    return arr
 
+def fsgrid_local_start(global_cells, ntasks, my_n):
+   ''' First global index of the cells owned by task my_n out of ntasks along a dimension of global_cells
+   fsgrid cells, as decomposed by FsGrid. Works elementwise on arrays.
+   '''
+   n_per_task = global_cells//ntasks
+   remainder = global_cells%ntasks
+   return np.where(my_n < remainder, my_n * (n_per_task+1), my_n * n_per_task + remainder)
+
+def fsgrid_local_size(global_cells, ntasks, my_n):
+   ''' Number of cells owned by task my_n out of ntasks along a dimension of global_cells fsgrid cells,
+   as decomposed by FsGrid. Works elementwise on arrays.
+   '''
+   n_per_task = global_cells//ntasks
+   remainder = global_cells%ntasks
+   return np.where(my_n < remainder, n_per_task+1, n_per_task)
+
+def fg_block_view(arr, block):
+   ''' View an fsgrid array [nx,ny,nz,...] as blocks of block[0]*block[1]*block[2] cells,
+   [nx/bx, bx, ny/by, by, nz/bz, bz, ...], so that one vg cell is arr[i,:,j,:,k,:].
+   Writes through the view reach arr when arr is contiguous.
+   '''
+   sz = arr.shape[0:3]
+   return arr.reshape((sz[0]//block[0], block[0], sz[1]//block[1], block[1], sz[2]//block[2], block[2]) + arr.shape[3:])
+
 def get_test_variable_length(test_variable):
    ''' Check the size and dimensions of a test variable.
    Returns number of elements and shape of an np.ndarray,
@@ -146,6 +448,10 @@ def get_test_variable_length(test_variable):
 
 class VlsvReader(object):
    ''' Class for reading VLSV files
+
+   A reader can be shared between threads: file reads are positional (no shared
+   file position, see :func:`optimize_open_file`), and the lazily built indices and
+   caches are constructed under a lock, once, and published only when complete.
    '''
 
 
@@ -193,22 +499,20 @@ class VlsvReader(object):
       def __init__(self, reader):
          self.reader = weakref.ref(reader)
          self.index = False
+         self.__lock = threading.Lock()
 
       def set_cellid_indices_ordered(self):
-         reader = self.reader()
-         if reader is None:
-            raise RuntimeError("File indexer object could not anymore find the reader object via stored weak reference")
+         with self.__lock:
+            if self.index: # Built by another thread meanwhile
+               return
+            reader = self.reader()
+            if reader is None:
+               raise RuntimeError("File indexer object could not anymore find the reader object via stored weak reference")
 
-         if reader.check_variable("CellID_ordered") and reader.check_variable("CellID_fileindex_ordered"):
-            self.__cellids_ordered = reader.read_variable("CellID_ordered")
-            self.__cellid_fileindex_ordered =  reader.read_variable("CellID_fileindex_ordered")
-         else:
-            cids = reader.read_variable("CellID")
-            index = np.array([i for i,c in enumerate(cids)],dtype=np.int64)
-            ids = np.argsort(cids)
-            self.__cellids_ordered = cids[ids]
-            self.__cellid_fileindex_ordered = index[ids]
-         self.index = True
+            cellids_ordered, cellid_fileindex_ordered = reader.get_cellid_ordering()
+            self.__cellids_ordered = cellids_ordered
+            self.__cellid_fileindex_ordered = cellid_fileindex_ordered
+            self.index = True
 
       def clear(self):
          self.index = False
@@ -242,7 +546,7 @@ class VlsvReader(object):
          self.reader = weakref.ref(reader)
          self.__fileindex_for_cellid = {}
          self.index = False
-         pass
+         self.__lock = threading.Lock()
 
       def get_cellid_locations(self):
          ''' Returns a dictionary with cell id as the key and the index of the cell id as the value. The index is used to locate the cell id's values in the arrays that this reader returns
@@ -256,19 +560,24 @@ class VlsvReader(object):
          if self.index:
             return
 
-         reader = self.reader()
-         if reader is None:
-            raise RuntimeError("File indexer object could not anymore find the reader object via stored weak reference")
-
-         cellids=self.reader().read(mesh="SpatialGrid",name="CellID", tag="VARIABLE")
-
-         #Check if it is not iterable. If it is a scale then make it a list
-         if(not isinstance(cellids, Iterable)):
-            cellids=[ cellids ]
-         # self.__fileindex_for_cellid = {cellid:index for index,cellid in enumerate(cellids)}
-         for index,cellid in enumerate(cellids):
-            self.__fileindex_for_cellid[cellid] = index
-         self.index = True
+         with self.__lock:
+            if self.index: # Built by another thread meanwhile
+               return
+            reader = self.reader()
+            if reader is None:
+               raise RuntimeError("File indexer object could not anymore find the reader object via stored weak reference")
+
+            cellids=self.reader().read(mesh="SpatialGrid",name="CellID", tag="VARIABLE")
+
+            #Check if it is not iterable. If it is a scale then make it a list
+            if(not isinstance(cellids, Iterable)):
+               cellids=[ cellids ]
+            # Fill a new dict and publish it complete, concurrent lookups may be using the old one
+            fileindex_for_cellid = {}
+            for index,cellid in enumerate(cellids):
+               fileindex_for_cellid[cellid] = index
+            self.__fileindex_for_cellid = fileindex_for_cellid
+            self.index = True
 
       def clear(self):
          self.index = False
@@ -287,12 +596,120 @@ class VlsvReader(object):
             print(e, cellids)
             raise e
 
+   class FooterIndex:
+      ''' Lookup table over the XML footer, built once when the footer is read.
+      '''
+
+      class Entry:
+         ''' One footer tag, with the offset and sizes of its array already converted to ints
+         (None where the attribute is missing).
+         '''
+         __slots__ = ("tag", "name", "mesh", "attrib", "datatype", "vector_size", "array_size", "element_size", "offset")
+
+         def __init__(self, child):
+            self.tag = child.tag
+            self.attrib = child.attrib
+            self.name = child.attrib.get("name")
+            self.mesh = child.attrib.get("mesh")
+            self.datatype = child.attrib.get("datatype")
+            self.vector_size = self.__to_int(child.attrib.get("vectorsize"))
+            self.array_size = self.__to_int(child.attrib.get("arraysize"))
+            self.element_size = self.__to_int(child.attrib.get("datasize"))
+            self.offset = self.__to_int(child.text)
+
+         @staticmethod
+         def __to_int(value):
+            if value is None:
+               return None
+            try:
+               return int(value)
+            except ValueError:
+               return None
+
+      def __init__(self, xml_root):
+         self.entries = [self.Entry(child) for child in xml_root]
+         self.__by_key = {} # {(tag, lowercase name, mesh) : first matching entry}
+         self.__by_tag_name = {} # {(tag, lowercase name) : [entries]}
+         self.__by_tag = {} # {tag : [entries]}
+         self.__by_name = {} # {lowercase name : [entries]}
+         for entry in self.entries:
+            lname = None if entry.name is None else entry.name.lower()
+            self.__by_key.setdefault((entry.tag, lname, entry.mesh), entry)
+            self.__by_tag_name.setdefault((entry.tag, lname), []).append(entry)
+            self.__by_tag.setdefault(entry.tag, []).append(entry)
+            self.__by_name.setdefault(lname, []).append(entry)
+
+      def find(self, tag="", name="", mesh="", require_name=True, require_mesh=True):
+         ''' Return the first footer entry (in file order) matching the query, or None.
+
+         :kwarg tag:  Tag of the entry, "" matches any
+         :kwarg name: Name of the entry (case insensitive), "" matches any
+         :kwarg mesh: Mesh of the entry, "" matches any
+         :kwarg require_name: Boolean [True]. If False, entries without a name attribute are not rejected by a name query.
+         :kwarg require_mesh: Boolean [True]. If False, entries without a mesh attribute are not rejected by a mesh query.
+         '''
+         name = name.lower()
+         if tag != "" and name != "" and mesh != "" and require_name and require_mesh:
+            return self.__by_key.get((tag, name, mesh))
+         if name != "" and require_name:
+            if tag != "":
+               candidates = self.__by_tag_name.get((tag, name), [])
+            else:
+               candidates = self.__by_name.get(name, [])
+         elif tag != "":
+            candidates = self.__by_tag.get(tag, [])
+         else:
+            candidates = self.entries
+
+         for entry in candidates:
+            if name != "":
+               if entry.name is None:
+                  if require_name:
+                     continue
+               elif entry.name.lower() != name:
+                  continue
+            if mesh != "":
+               if entry.mesh is None:
+                  if require_mesh:
+                     continue
+               elif entry.mesh != mesh:
+                  continue
+            return entry
+         return None
+
+      def find_all(self, tag):
+         ''' Return all footer entries with the given tag, in file order.
+         '''
+         return self.__by_tag.get(tag, [])
+
+   def synchronized(method):
+      ''' Decorator for running a method while holding the reader lock. Used for the lazy
+      construction of indices and caches, so that concurrent threads neither build them
+      twice nor see them half-built.
+      '''
+      @functools.wraps(method)
+      def wrap(self, *args, **kwargs):
+         with self.__lock:
+            return method(self, *args, **kwargs)
+      return wrap
+
    file_name=""
    def __del__(self):
       if (hasattr(self, "__fptr")) and self.__fptr is not None:
          self.__fptr.close()
 
-   def __init__(self, file_name, fsGridDecomposition=None, file_cache = 0, indexer = "ordered"):
+   def __getstate__(self):
+      state = self.__dict__.copy()
+      del state["_VlsvReader__lock"] # Locks cannot be pickled, a fresh one is made on unpickling
+      for shared in ("_VlsvReader__mesh_layout", "_VlsvReader__mesh_geometry", "_VlsvReader__dual_mesh", "_VlsvReader__cellid_octree"):
+         state[shared] = None # Looked up again from the registry of the unpickling process
+      return state
+
+   def __setstate__(self, state):
+      self.__dict__.update(state)
+      self.__lock = threading.RLock()
+
+   def __init__(self, file_name, fsGridDecomposition=None, file_cache = 0, indexer = "ordered", mmap = False):
       ''' Initializes the vlsv file (opens the file, reads the file footer and reads in some parameters)
 
           :param file_name:     Name of the vlsv file
@@ -302,9 +719,16 @@ class VlsvReader(object):
           :kwarg indexer:       String, ["ordered" | "dict" ] - which file layout indexer to use. "ordered" is new default - faster to initialize
                                     especially from L1 files. "dict" is the legacy mode, which is slow to initialize but may be faster with frequent small
                                     queries. :seealso:: :func:`set_cellid_indexer`
+          :kwarg mmap:          Boolean, [False]: memory-map the whole file once and serve array reads (VARIABLE, BLOCKVARIABLE,
+                                    BLOCKIDS, ...) as views or gathers over the map instead of seek+read calls. Full-array reads
+                                    then return read-only views; copy them before modifying in place.
+
+          The reader is thread-safe once constructed: reads from one reader may be issued concurrently
+          from a thread pool.
       '''
       # Make sure the path is set in file name:
       file_name = os.path.abspath(file_name)
+      self.__lock = threading.RLock() # Guards lazy index/cache construction, SEE: synchronized
 
       self.file_name = file_name
       self.file_cache = file_cache
@@ -313,8 +737,10 @@ class VlsvReader(object):
       except FileNotFoundError as e:
          logging.info("File not found: " + self.file_name)
          raise e
+      self.__mmap = vlsvcache.PicklableMemmap(self.file_name) if mmap else None
 
       self.__xml_root = ET.fromstring("<VLSV></VLSV>")
+      self.__footer = self.FooterIndex(self.__xml_root)
 
 
       # self.query_cellid_exist = self.__query_cellid_exists_dict
@@ -322,6 +748,7 @@ class VlsvReader(object):
       self.__fileindex_for_cellid = {} # to be deprecated, some function like get_cellid_locations are still widely used
       self.__full_fileindex_for_cellid = False # to be deprecated?
       self.__cellid_spatial_index=None
+      self.__cellid_octree = None
       self.__rankwise_fileindex_for_cellid = {} # {<mpi-rank> : {cellid: offset}}
       self.__loaded_fileindex_ranks = set()
 
@@ -332,18 +759,27 @@ class VlsvReader(object):
 
       self.__mesh_domain_sizes = {}
       self.__max_spatial_amr_level = -1
+      self.__amr_tables = None # SEE: get_amr_level_tables
       self.__grid_epsilon = None
       self.__fsGridDecomposition = fsGridDecomposition
+      self.__fsgrid_rank_boxes = None # SEE: get_fsgrid_rank_boxes
+      self.__read_gap_bytes = 65536 # SEE: set_read_gap_tolerance
+      self.__reducer_threads = 1 # SEE: set_reducer_threads
+      self.__vspace_processes = 1 # SEE: set_vspace_processes
 
       self.use_dict_for_blocks = False
       self.__fileindex_for_cellid_blocks={} # [0] is index, [1] is blockcount
       self.__cells_with_blocks = {} # per-pop
       self.__blocks_per_cell = {} # per-pop
       self.__blocks_per_cell_offsets = {} # per-pop
-      self.__order_for_cellid_blocks = {} # per-pop
+      self.__cells_with_blocks_ordered = {} # per-pop, sorted cellids with blocks
+      self.__order_for_cellid_blocks = {} # per-pop, index into __cells_with_blocks for each of __cells_with_blocks_ordered
       self.__vg_indexes_on_fg = np.array([]) # SEE: map_vg_onto_fg(self)
 
-      self.__variable_cache = vlsvcache.VariableCache() # {(varname, operator):data}
+      self.__variable_cache = vlsvcache.VariableCache(max_bytes=vlsvcache.VariableCache.reader_max_bytes) # {(varname, operator):data}, SEE: set_variable_cache_budget
+      self.cache_derived_variables = True # Store data reducer results over the whole grid in the (budgeted) variable cache
+      self.__derived_store = None # Names to persist in the cache folder (True for all), SEE: set_derived_store
+      self.__derived_store_misses = set() # {(varname, operator)} not found in the derived store
       self.__params_cache = {} # {name:data}
 
       self.__pops_init = False
@@ -353,15 +789,9 @@ class VlsvReader(object):
       self.__current_reducer_tree_nodes = set() # Set of strings of datareducer names
 
 
-                              # vertex-indices is a 3-tuple of integers
-      self.__dual_cells = {(0,0,0):(1,1,1,1,1,1,1,1)} # vertex-indices : 8-tuple of cellids at each corner (for x for y for z)
-      self.__dual_bboxes = {} # vertex-indices : 6-list of (xmin, ymin, zmin, xmax, ymax, zmax) for the bounding box of each dual cell
-      self.__cell_vertices = {} # cellid : varying-length tuple of vertex-indices - includes hanging nodes!
-      self.__cell_corner_vertices = {} # cellid : varying-length tuple of vertex-indices - no hanging nodes!
-      self.__cell_neighbours = {} # cellid : set of cellids (all neighbors sharing a vertex)
-      self.__cell_duals = {} # cellid : tuple of vertex-indices that span this cell
-      self.__regular_neighbor_cache = {} # cellid-of-low-corner : (8,) np.array of cellids)
-      self.__neighbors_cache_len = 0
+      self.__dual_mesh = None # SEE: DualMesh, shared between readers of the same mesh
+      self.__mesh_layout = None # SEE: get_mesh_layout
+      self.__mesh_geometry = None # SEE: get_mesh_geometry
       self.__neighbors_cache_available = os.path.isfile(os.path.join(self.get_cache_folder(),neighbors_cache_file))
       self.__neighbors_cache_loaded = False
 
@@ -460,6 +890,8 @@ class VlsvReader(object):
    def copy_cellid_indexer_handle(self, indexer=None):
       '''Copy the FileIndexer handles from another reader. NB clear the references via calling
       the function with default values once done (or feel free to implement weak referencing!)
+      Used for linked readers, whose files need not contain CellID. Readers of files that do
+      share their indexes automatically, SEE: get_mesh_layout.
 
       :param indexer: FileIndexer [none], FileIndex handle to use for the reader. Default None clears references.
       '''
@@ -472,6 +904,72 @@ class VlsvReader(object):
          self.query_cellid_exists = self.FileIndex.query_cellid_exists
          self.get_cellid_fileindices = self.FileIndex.get_cellid_fileindices
 
+   @synchronized
+   def get_mesh_layout(self):
+      ''' Shared holder of the objects that depend on the SpatialGrid of this file and its file order,
+      such as the CellID file index and the vg to fg index map. Readers in the process whose CellID
+      arrays are identical (same cells in the same order) get the same holder, so these objects are
+      built once per run rather than once per file.
+
+      :returns: a :class:`vlsvcache.SharedMesh`
+
+      .. seealso:: :class:`vlsvcache.MeshRegistry`, :func:`get_mesh_geometry`
+      '''
+      if self.__mesh_layout is None:
+         cellids = self.read_variable("CellID")
+         self.__mesh_layout = vlsvcache.MeshRegistry.shared(vlsvcache.MeshRegistry.layout_fingerprint(self, cellids))
+      return self.__mesh_layout
+
+   @synchronized
+   def get_mesh_geometry(self):
+      ''' Shared holder of the objects that depend only on the SpatialGrid cells of this file, such as
+      the spatial index and the dual mesh. Readers in the process with the same cells get the
+      same holder, whatever the order of the cells in their files.
+
+      :returns: a :class:`vlsvcache.SharedMesh`
+
+      .. seealso:: :class:`vlsvcache.MeshRegistry`, :func:`get_mesh_layout`
+      '''
+      if self.__mesh_geometry is None:
+         layout = self.get_mesh_layout()
+         self.__mesh_geometry = layout.get("geometry", lambda: vlsvcache.MeshRegistry.shared(
+                                           vlsvcache.MeshRegistry.geometry_fingerprint(self, self.get_cellid_ordering()[0])))
+      return self.__mesh_geometry
+
+   def get_cellid_ordering(self):
+      ''' The sorted SpatialGrid cellids and their indices in the file, shared between readers of the same layout.
+
+      :returns: a tuple of read-only numpy arrays (cellids_ordered, cellid_fileindex_ordered)
+      '''
+      return self.get_mesh_layout().get("cellid_ordering", self.__build_cellid_ordering)
+
+   def __build_cellid_ordering(self):
+      if self.check_variable("CellID_ordered") and self.check_variable("CellID_fileindex_ordered"):
+         cellids_ordered = self.read_variable("CellID_ordered")
+         cellid_fileindex_ordered =  self.read_variable("CellID_fileindex_ordered")
+      else:
+         cellids_ordered = self.get_sidecar_array("cellid_ordered")
+         cellid_fileindex_ordered = self.get_sidecar_array("cellid_fileindex_ordered")
+         if cellids_ordered is None or cellid_fileindex_ordered is None:
+            cids = self.read_variable("CellID")
+            ids = np.argsort(cids)
+            cellids_ordered = cids[ids]
+            cellid_fileindex_ordered = ids.astype(np.int64)
+            self.set_sidecar_array("cellid_ordered", cellids_ordered)
+            self.set_sidecar_array("cellid_fileindex_ordered", cellid_fileindex_ordered)
+      cellids_ordered = np.array(cellids_ordered)
+      cellid_fileindex_ordered = np.array(cellid_fileindex_ordered)
+      cellids_ordered.flags.writeable = False
+      cellid_fileindex_ordered.flags.writeable = False
+      return cellids_ordered, cellid_fileindex_ordered
+
+   def __get_dual_mesh(self):
+      dual_mesh = self.__dual_mesh
+      if dual_mesh is None:
+         dual_mesh = self.get_mesh_geometry().get("dual_mesh", DualMesh)
+         self.__dual_mesh = dual_mesh
+      return dual_mesh
+
    def set_cellid_indexer(self, method="dict", reset = False):
       ''' Set the methods for querying cellid existence and file index. "dict" is the usual Python
       dict implementation, which is slow to construct but fast for repeated accesses.
@@ -492,6 +990,180 @@ class VlsvReader(object):
 
       return self.FileIndex
 
+   def set_read_gap_tolerance(self, gap_bytes):
+      ''' Set how far apart requested cells may be in the file while still being read
+      with a single read call when reading variables for a list of cellids. Gaps up to
+      this size are read through and discarded, larger gaps start a new read.
+
+      :param gap_bytes: int, largest gap in bytes to read through (default 65536). 0 merges only adjacent cells.
+
+      .. seealso:: :func:`coalesce_read_ranges`
+      '''
+      if gap_bytes < 0:
+         raise ValueError("Read gap tolerance must be non-negative, got " + str(gap_bytes))
+      self.__read_gap_bytes = int(gap_bytes)
+
+   def set_reducer_threads(self, threads):
+      ''' Set the number of threads used to evaluate element-wise data reducers (see
+      :func:`reducer.elementwise`). Their inputs are split into blocks of at least
+      reducer_block_cells cells, evaluated on a thread pool and joined. NumPy releases the
+      GIL in the heavy operations (ufuncs, matmul, eigh), so the blocks run concurrently.
+
+      :param threads: int, number of threads (default 1, no threading). None uses all CPUs of the process.
+      '''
+      if threads is None:
+         threads = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+      if threads < 1:
+         raise ValueError("Number of reducer threads must be positive, got " + str(threads))
+      self.__reducer_threads = int(threads)
+
+   def set_vspace_processes(self, processes):
+      ''' Set the number of processes used to evaluate velocity-space data reducers (useVspace).
+      Their cells are split into chunks of at most vspace_chunk_blocks velocity blocks, which
+      are evaluated on a process pool. The workers open the file by name, so they see neither
+      linked readers nor settings changed on this reader.
+
+      :param processes: int, number of processes (default 1, evaluated in this process). None uses all CPUs of the process.
+
+      .. seealso:: :func:`reducer.vspace_batch`
+      '''
+      if processes is None:
+         processes = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+      if processes < 1:
+         raise ValueError("Number of velocity-space reducer processes must be positive, got " + str(processes))
+      self.__vspace_processes = int(processes)
+
+   def set_derived_store(self, enabled=True, names=None):
+      ''' Persist data reducer results over the whole grid in the cache folder of the file (the derived
+      store), to be served from there by later readers of the file instead of being recomputed.
+
+      Results are saved as .npy sidecars (see :func:`get_sidecar_array`), one per variable name and
+      operator, together with a fingerprint of their inputs: the size and modification time of this
+      file and of the linked files, and the code of the data reducers the variable is computed from.
+      A stored result is served only while the fingerprint matches, so rewriting a file, linking
+      another one or changing a reducer recomputes it.
+
+      .. code-block:: python
+
+         f = pt.vlsvfile.VlsvReader("bulk.0001000.vlsv")
+         f.set_derived_store(names=["vg_jacobian_v"])
+         jacobian = f.read_variable("vg_jacobian_v") # Computed once, later sessions read it from the cache folder
+
+      :kwarg enabled: Boolean [True], False disables the store for this reader
+      :kwarg names:   list of variable names to store, None for all data reducers
+      '''
+      if not enabled:
+         self.__derived_store = None
+      elif names is None:
+         self.__derived_store = True
+      else:
+         self.__derived_store = set(n.lower() for n in np.atleast_1d(names))
+      self.__derived_store_misses.clear()
+
+   def __derived_store_wants(self, name):
+      if self.__derived_store is None:
+         return False
+      return self.__derived_store is True or name in self.__derived_store
+
+   @staticmethod
+   def __derived_sidecar_name(name, operator):
+      return "derived_" + re.sub(r"[^0-9a-zA-Z_.-]", "-", name) + "_" + str(operator)
+
+   def __derived_store_key(self, name, operator):
+      ''' Fingerprint of the inputs of a data reducer result in the derived store, see :func:`set_derived_store`.
+      '''
+      digest = hashlib.blake2b(digest_size=16)
+      digest.update(repr((name, str(operator))).encode())
+      for reader in [self] + sorted(self.__linked_readers, key=lambda r: r.file_name):
+         st = os.stat(reader.file_name)
+         digest.update(repr((reader.file_name, st.st_size, st.st_mtime_ns)).encode())
+      # Code of the data reducers of the dependency graph, as read resolves it without caches
+      visited = set()
+      stack = [name]
+      while len(stack) > 0:
+         node = stack.pop()
+         if node in visited:
+            continue
+         visited.add(node)
+         kind, children, reducer, popname = self.__variable_graph_node(node, cached=False)
+         if reducer is not None:
+            code = getattr(reducer.operation, "__code__", None)
+            digest.update(repr((node, getattr(reducer.operation, "__module__", ""), getattr(reducer.operation, "__qualname__", ""),
+                                list(np.atleast_1d(reducer.variables)), reducer.vector_size, reducer.useVspace, reducer.useReader,
+                                None if code is None else [c for c in code.co_consts if not inspect.iscode(c)])).encode())
+            if code is not None:
+               digest.update(code.co_code)
+         stack.extend(children)
+      return digest.hexdigest()
+
+   def __load_derived(self, name, operator):
+      ''' Load a data reducer result from the derived store into the variable cache, see :func:`set_derived_store`.
+
+      :returns: True if a result with a matching input fingerprint was found
+      '''
+      if not self.__derived_store_wants(name) or (name,operator) in self.__derived_store_misses:
+         return False
+      sidecar = self.__derived_sidecar_name(name, operator)
+      stored = self.__metadata_cache.get_metadata(self, ("derived", sidecar), None)
+      data = None
+      if stored is not None and stored[0] == self.__derived_store_key(name, operator):
+         data = self.__metadata_cache.load_sidecar_array(self, sidecar)
+         if data is not None:
+            data = np.asarray(data)
+            if stored[1]:
+               mask = self.__metadata_cache.load_sidecar_array(self, sidecar+"_mask")
+               data = None if mask is None else np.ma.array(data, mask=np.asarray(mask))
+      if data is None:
+         self.__derived_store_misses.add((name,operator))
+         return False
+      logging.info("Read "+name+" from the derived store of "+self.file_name)
+      self.__variable_cache.add((name,operator), data, copy_on_read=True)
+      return True
+
+   def __save_derived(self, name, operator, data):
+      ''' Save a data reducer result over the whole grid into the derived store, see :func:`set_derived_store`.
+      '''
+      if not self.__derived_store_wants(name) or not data.dtype.kind in "biufc":
+         return
+      sidecar = self.__derived_sidecar_name(name, operator)
+      masked = np.ma.isMaskedArray(data) and np.ma.getmask(data) is not np.ma.nomask
+      # Invalidate the old entry first, so that a failed save does not leave it matching the new fingerprint
+      self.__metadata_cache.add_metadata(self, ("derived", sidecar), None)
+      self.__metadata_cache.save_sidecar_array(self, sidecar, np.ma.getdata(data))
+      if masked:
+         self.__metadata_cache.save_sidecar_array(self, sidecar+"_mask", np.ma.getmaskarray(data))
+      self.__metadata_cache.add_metadata(self, ("derived", sidecar), (self.__derived_store_key(name, operator), masked))
+      self.__derived_store_misses.discard((name,operator))
+
+   def __evaluate_reducer(self, reducer, tmp_vars):
+      ''' Call the operation of a data reducer on its input variables. Element-wise reducers on
+      enough cells are split into blocks of cells over a thread pool, see :func:`set_reducer_threads`.
+      '''
+      def evaluate(variables):
+         if reducer.useReader:
+            return reducer.operation( variables, self )
+         return reducer.operation( variables )
+
+      if not reducer.elementwise or self.__reducer_threads <= 1:
+         return evaluate(tmp_vars)
+      cell_arrays = [v for v in tmp_vars if isinstance(v, np.ndarray) and v.ndim > 0]
+      if len(cell_arrays) == 0:
+         return evaluate(tmp_vars)
+      ncells = len(cell_arrays[0])
+      nblocks = min(self.__reducer_threads, ncells // reducer_block_cells)
+      if nblocks < 2 or any(len(v) != ncells for v in cell_arrays):
+         return evaluate(tmp_vars)
+
+      bounds = np.linspace(0, ncells, nblocks+1).astype(np.int64)
+      def evaluate_block(block):
+         start, stop = bounds[block], bounds[block+1]
+         return evaluate([v[start:stop] if isinstance(v, np.ndarray) and v.ndim > 0 else v for v in tmp_vars])
+      with ThreadPoolExecutor(max_workers=nblocks) as pool:
+         results = list(pool.map(evaluate_block, range(nblocks)))
+      if any(isinstance(r, np.ma.MaskedArray) for r in results):
+         return np.ma.concatenate(results)
+      return np.concatenate(results)
+
    def get_grid_epsilon(self):
       if self.__grid_epsilon is None:
          # one-thousandth of the max refined cell; self.get_max_refinement_level() however reads all cellids, so just temp here by assuming 8 refinement levels.. which is plenty for now
@@ -606,6 +1278,7 @@ class VlsvReader(object):
       else:
          return self.__init_population(popname)
 
+   @synchronized
    def __init_population(self,popname):
       ''' Initialize metadata for a population. Incurs several small reads to the vlsv file,
           and initializes also the vlsvvariables.speciesprecipitationenergybins dict entry for this pop.
@@ -682,7 +1355,6 @@ class VlsvReader(object):
          pop.__dvy = ((pop.__vymax - pop.__vymin) / (float)(pop.__vyblocks)) / (float)(pop.__vyblock_size)
          pop.__dvz = ((pop.__vzmax - pop.__vzmin) / (float)(pop.__vzblocks)) / (float)(pop.__vzblock_size)
 
-      self.__meshes[popname]=pop
       if not os.getenv('PTNONINTERACTIVE'):
          logging.info("Found population " + popname)
 
@@ -700,6 +1372,7 @@ class VlsvReader(object):
          pop.__precipitation_centre_energy = np.asarray(energybins)
          vlsvvariables.speciesprecipitationenergybins[popname] = energybins
 
+      self.__meshes[popname]=pop # Publish only when complete, __popmesh does not take the lock
       return self.__meshes[popname]
 
 
@@ -745,8 +1418,20 @@ class VlsvReader(object):
       (xml_string,) = struct.unpack("%ds" % len(xml_data), xml_data)
       # Input the xml data into xml_root
       self.__xml_root = ET.fromstring(xml_string)
+      self.__footer = self.FooterIndex(self.__xml_root)
       fptr.close()
 
+   def __blocks_footer_entry(self, pop):
+      ''' Footer entry of the BLOCKIDS array of a population. Old avgs files did not set a name for BLOCKIDS.
+      '''
+      entry = self.__footer.find("BLOCKIDS", pop)
+      if entry is None and pop == "avgs":
+         blockids = self.__footer.find_all("BLOCKIDS")
+         if len(blockids) > 0:
+            entry = blockids[-1]
+      return entry
+
+   @synchronized
    def __read_fileindex_for_cellid(self):
       """ Read in the cell ids and create an internal dictionary to give the index of an arbitrary cellID
       """
@@ -781,65 +1466,35 @@ class VlsvReader(object):
          num_of_blocks = self.__fileindex_for_cellid_blocks[pop][cellid][1]
       else:
          # Uses arrays (much faster to initialize)
-         if not pop in self.__cells_with_blocks:
-            self.__set_cell_offset_and_blocks_nodict(pop)
          # Check that cells has vspace
-         try:
-            cells_with_blocks_index = self.__order_for_cellid_blocks[pop][cellid]
-         except:
+         cells_with_blocks_index, has_blocks = self.__get_cells_with_blocks_indices(cellid, pop)
+         if not has_blocks[0]:
             logging.info("Cell does not have velocity distribution")
             return []
-         offset = self.__blocks_per_cell_offsets[pop][cells_with_blocks_index]
-         num_of_blocks = self.__blocks_per_cell[pop][cells_with_blocks_index]
+         offset = self.__blocks_per_cell_offsets[pop][cells_with_blocks_index[0]]
+         num_of_blocks = self.__blocks_per_cell[pop][cells_with_blocks_index[0]]
 
 
-      if self.__fptr.closed:
-         fptr = open(self.file_name,"rb")
-      else:
-         fptr = self.__fptr
+      # Read in block values
+      entry = self.__footer.find("BLOCKVARIABLE", pop)
+      if entry is not None:
+         # Navigate to the correct position
+         offset_avgs = int(offset * entry.vector_size * entry.element_size)
 
-      # Read in avgs and velocity cell ids:
-      for child in self.__xml_root:
-         # Read in block values
-         if ("name" in child.attrib) and (child.attrib["name"] == pop) and (child.tag == "BLOCKVARIABLE"):
-            vector_size = ast.literal_eval(child.attrib["vectorsize"])
-            #array_size = ast.literal_eval(child.attrib["arraysize"])
-            element_size = ast.literal_eval(child.attrib["datasize"])
-            datatype = child.attrib["datatype"]
-
-            # Navigate to the correct position
-            offset_avgs = int(offset * vector_size * element_size + ast.literal_eval(child.text))
-#            for i in range(0, cells_with_blocks_index[0]):
-#               offset_avgs += blocks_per_cell[i]*vector_size*element_size
-
-            fptr.seek(offset_avgs)
-            if datatype == "float" and element_size == 4:
-               data_avgs = np.fromfile(fptr, dtype = np.float32, count = vector_size*num_of_blocks)
-            if datatype == "float" and element_size == 8:
-               data_avgs = np.fromfile(fptr, dtype = np.float64, count = vector_size*num_of_blocks)
-            data_avgs = data_avgs.reshape(num_of_blocks, vector_size)
-
-         # Read in block coordinates:
-         # (note the special treatment in case the population is named 'avgs'
-         if (pop == 'avgs' or ("name" in child.attrib) and (child.attrib["name"] == pop)) and (child.tag == "BLOCKIDS"):
-            vector_size = ast.literal_eval(child.attrib["vectorsize"])
-            #array_size = ast.literal_eval(child.attrib["arraysize"])
-            element_size = ast.literal_eval(child.attrib["datasize"])
-            datatype = child.attrib["datatype"]
-
-            offset_block_ids = int(offset * vector_size * element_size + ast.literal_eval(child.text))
-
-            fptr.seek(offset_block_ids)
-            if datatype == "uint" and element_size == 4:
-               data_block_ids = np.fromfile(fptr, dtype = np.uint32, count = vector_size*num_of_blocks)
-            elif datatype == "uint" and element_size == 8:
-               data_block_ids = np.fromfile(fptr, dtype = np.uint64, count = vector_size*num_of_blocks)
-            else:
-               raise ValueError("Error! Bad block id data!\n " \
-                        "Data type: " + datatype + ", element size: " + str(element_size))
-            data_block_ids = np.reshape(data_block_ids, (len(data_block_ids),) )
+         data_avgs = self.read_with_offset(entry.datatype, entry.offset, num_of_blocks, [offset_avgs], entry.element_size, entry.vector_size)
+         data_avgs = data_avgs.reshape(num_of_blocks, entry.vector_size)
 
-      fptr.close()
+      # Read in block coordinates:
+      # (note the special treatment in case the population is named 'avgs'
+      entry = self.__blocks_footer_entry(pop)
+      if entry is not None:
+         offset_block_ids = int(offset * entry.vector_size * entry.element_size)
+
+         if entry.datatype != "uint" or not entry.element_size in (4,8):
+            raise ValueError("Error! Bad block id data!\n " \
+                     "Data type: " + entry.datatype + ", element size: " + str(entry.element_size))
+         data_block_ids = self.read_with_offset(entry.datatype, entry.offset, num_of_blocks, [offset_block_ids], entry.element_size, entry.vector_size)
+         data_block_ids = np.reshape(data_block_ids, (len(data_block_ids),) )
 
       # Check to make sure the sizes match (just some extra debugging)
       logging.info("data_avgs = " + str(data_avgs) + ", data_block_ids = " + str(data_block_ids))
@@ -848,6 +1503,7 @@ class VlsvReader(object):
 
       return [data_block_ids, data_avgs]
 
+   @synchronized
    def __set_cell_offset_and_blocks(self, pop="proton"):
       ''' Read blocks per cell and the offset in the velocity space arrays for
           every cell with blocks into a private dictionary.
@@ -878,40 +1534,95 @@ class VlsvReader(object):
       from copy import copy
       offset = 0
       #self.__fileindex_for_cellid_blocks[pop] = {}
-      self.__fileindex_for_cellid_blocks[pop] = dict.fromkeys(cells_with_blocks) # should be faster but negligible difference
+      fileindex_for_cellid_blocks = dict.fromkeys(cells_with_blocks) # should be faster but negligible difference
       for i in range(0, len(cells_with_blocks)):
-         self.__fileindex_for_cellid_blocks[pop][cells_with_blocks[i]] = [copy(offset), copy(blocks_per_cell[i])]
+         fileindex_for_cellid_blocks[cells_with_blocks[i]] = [copy(offset), copy(blocks_per_cell[i])]
          offset += blocks_per_cell[i]
+      self.__fileindex_for_cellid_blocks[pop] = fileindex_for_cellid_blocks
 
+   @synchronized
    def __set_cell_offset_and_blocks_nodict(self, pop="proton"):
       ''' Read blocks per cell and the offset in the velocity space arrays for every cell with blocks.
           Stores them in arrays. Creates a private dictionary with addressing to the array.
           This method should be faster than the above function.
       '''
-      if pop in self.__cells_with_blocks:
+      if pop in self.__cells_with_blocks_ordered:
          # There's stuff already saved into the dictionary, don't save it again
          return
 
       logging.info("Getting offsets for population " + pop)
 
+      cells_with_blocks = self.get_sidecar_array("blocks_"+pop+"_cellids")
+      blocks_per_cell = self.get_sidecar_array("blocks_"+pop+"_counts")
+      blocks_per_cell_offsets = self.get_sidecar_array("blocks_"+pop+"_offsets")
+      if cells_with_blocks is not None and blocks_per_cell is not None and blocks_per_cell_offsets is not None:
+         self.__cells_with_blocks[pop] = cells_with_blocks
+         self.__blocks_per_cell[pop] = blocks_per_cell
+         self.__blocks_per_cell_offsets[pop] = blocks_per_cell_offsets.astype(np.int64, copy=False)
+         self.__set_order_for_cellid_blocks(pop)
+         return
+
       try:
-         self.__cells_with_blocks[pop] = np.atleast_1d(self.read(mesh="SpatialGrid",tag="CELLSWITHBLOCKS", name=pop))
-         self.__blocks_per_cell[pop] = np.atleast_1d(self.read(mesh="SpatialGrid",tag="BLOCKSPERCELL", name=pop))
+         cells_with_blocks = np.atleast_1d(self.read(mesh="SpatialGrid",tag="CELLSWITHBLOCKS", name=pop))
+         blocks_per_cell = np.atleast_1d(self.read(mesh="SpatialGrid",tag="BLOCKSPERCELL", name=pop))
       except Exception as e:
          try:
-            self.__cells_with_blocks[pop] = np.atleast_1d(self.read(mesh="SpatialGrid",tag="CELLSWITHBLOCKS"))
-            self.__blocks_per_cell[pop] = np.atleast_1d(self.read(mesh="SpatialGrid",tag="BLOCKSPERCELL"))
+            cells_with_blocks = np.atleast_1d(self.read(mesh="SpatialGrid",tag="CELLSWITHBLOCKS"))
+            blocks_per_cell = np.atleast_1d(self.read(mesh="SpatialGrid",tag="BLOCKSPERCELL"))
          except Exception as e2:
             logging.error("Could not read CELLSWITHBLOCKS or BLOCKSPERCELL successfully, after first searching for " +pop+"/[CELLSWITHBLOCKS/BLOCKSPERCELL]/SpatialGrid and then without pop; errors raised: \n Firstly"+str(e)+",\n Secondly "+str(e2))
             raise e2
 
-
-      self.__blocks_per_cell_offsets[pop] = np.empty(len(self.__cells_with_blocks[pop]))
-      self.__blocks_per_cell_offsets[pop][0] = 0.0
-      self.__blocks_per_cell_offsets[pop][1:] = np.cumsum(self.__blocks_per_cell[pop][:-1])
-      self.__order_for_cellid_blocks[pop] = {}
-      for index,cellid in enumerate(self.__cells_with_blocks[pop]):
-         self.__order_for_cellid_blocks[pop][cellid]=index
+      self.__cells_with_blocks[pop] = cells_with_blocks
+      self.__blocks_per_cell[pop] = blocks_per_cell
+      self.__blocks_per_cell_offsets[pop] = np.zeros(len(self.__cells_with_blocks[pop]), dtype=np.int64)
+      self.__blocks_per_cell_offsets[pop][1:] = np.cumsum(self.__blocks_per_cell[pop][:-1], dtype=np.int64)
+      self.set_sidecar_array("blocks_"+pop+"_cellids", self.__cells_with_blocks[pop])
+      self.set_sidecar_array("blocks_"+pop+"_counts", self.__blocks_per_cell[pop])
+      self.set_sidecar_array("blocks_"+pop+"_offsets", self.__blocks_per_cell_offsets[pop])
+      self.__set_order_for_cellid_blocks(pop)
+
+   def __set_order_for_cellid_blocks(self, pop):
+      ''' Sort the cells with blocks for searchsorted lookups, see __get_cells_with_blocks_indices.
+      Publishes __cells_with_blocks_ordered last; its presence marks the population as set up.
+      '''
+      cells_ordered = self.get_sidecar_array("blocks_"+pop+"_cellids_ordered")
+      order = self.get_sidecar_array("blocks_"+pop+"_order")
+      if cells_ordered is None or order is None:
+         order = np.argsort(self.__cells_with_blocks[pop], kind='stable').astype(np.int64)
+         cells_ordered = self.__cells_with_blocks[pop][order].astype(np.int64)
+         self.set_sidecar_array("blocks_"+pop+"_cellids_ordered", cells_ordered)
+         self.set_sidecar_array("blocks_"+pop+"_order", order)
+      self.__order_for_cellid_blocks[pop] = order
+      self.__cells_with_blocks_ordered[pop] = cells_ordered
+
+   def __get_cells_with_blocks_indices(self, cellids, pop):
+      ''' Vectorised lookup of cellids in the cells with blocks of a population.
+
+      :returns: indices into the CELLSWITHBLOCKS/BLOCKSPERCELL arrays (valid where the mask is True)
+                and a boolean mask telling which cellids have blocks
+      '''
+      if not pop in self.__cells_with_blocks_ordered:
+         self.__set_cell_offset_and_blocks_nodict(pop)
+      cells_ordered = self.__cells_with_blocks_ordered[pop]
+      cellids = np.atleast_1d(np.asarray(cellids)).astype(np.int64)
+      if len(cells_ordered) == 0:
+         return np.zeros(cellids.shape, dtype=np.int64), np.zeros(cellids.shape, dtype=bool)
+      qi = np.searchsorted(cells_ordered, cellids)
+      qi[qi == len(cells_ordered)] = len(cells_ordered)-1
+      mask = cells_ordered[qi] == cellids
+      return self.__order_for_cellid_blocks[pop][qi], mask
+
+   def cellids_have_vdf(self, cellids, pop="proton"):
+      ''' Vectorised query of which cellids have a velocity distribution
+
+      :param cellids: list or array of cellids
+      :kwarg pop:     Population ["proton"]
+      :returns: numpy array of booleans, one per cellid
+
+      .. seealso:: :func:`cellid_has_vdf`
+      '''
+      return self.__get_cells_with_blocks_indices(cellids, pop)[1]
 
    def __check_datareducer(self, name, reducer):
 
@@ -978,13 +1689,13 @@ class VlsvReader(object):
       for reader in self.__linked_readers:
          varlist.update(set(reader.get_variables()))
 
-      for child in self.__xml_root:
-         if child.tag == "VARIABLE" and "name" in child.attrib:
-            name = child.attrib["name"]
-            varlist.add(name)
+      for entry in self.__footer.find_all("VARIABLE"):
+         if entry.name is not None:
+            varlist.add(entry.name)
 
       return sorted(list(varlist))
 
+   @synchronized
    def get_reducers(self):
 
       varlist = set()
@@ -1013,6 +1724,7 @@ class VlsvReader(object):
       return sorted(list(varlist))
 
 
+   @synchronized
    def list(self, parameter=True, variable=True, mesh=False, datareducer=False, operator=False, other=False):
       ''' Print out a description of the content of the file. Useful
          for interactive usage. Default is to list parameters and variables, query selection can be adjusted with keywords:
@@ -1096,11 +1808,7 @@ class VlsvReader(object):
              else:
                 time = None
       '''
-      for child in self.__xml_root:
-         if child.tag == "PARAMETER" and "name" in child.attrib:
-            if child.attrib["name"].lower() == name.lower():
-               return True
-      return False
+      return self.__footer.find("PARAMETER", name) is not None
 
    def linked_readers_check_variable(self, name):
       ''' Test all linked variables if any of them returns True on test function
@@ -1145,11 +1853,7 @@ class VlsvReader(object):
       if self.linked_readers_check_variable(name):
          return True
 
-      for child in self.__xml_root:
-         if child.tag == "VARIABLE" and "name" in child.attrib:
-            if child.attrib["name"].lower() == name.lower():
-               return True
-      return False
+      return self.__footer.find("VARIABLE", name) is not None
 
    def check_population( self, popname ):
       ''' Checks if a given population is in the vlsv file
@@ -1168,22 +1872,12 @@ class VlsvReader(object):
                    # File is newer with proton population
                    plot_population('proton')
       '''
-      blockidsexist = False
-      foundpop = False
-      for child in self.__xml_root:
-         if child.tag == "BLOCKIDS":
-            if "name" in child.attrib:
-               if popname.lower() == child.attrib["name"].lower():
-                  foundpop = True
-            else:
-               blockidsexist = True
+      if self.__footer.find("BLOCKIDS", popname) is not None:
+         return True
+      blockidsexist = any(entry.name is None for entry in self.__footer.find_all("BLOCKIDS"))
       if blockidsexist:
-         for child in self.__xml_root:
-            if child.tag == "BLOCKVARIABLE":
-               if "name" in child.attrib:
-                  if popname.lower() == child.attrib["name"].lower(): # avgs
-                     foundpop = True
-      return foundpop
+         return self.__footer.find("BLOCKVARIABLE", popname) is not None # avgs
+      return False
 
    def get_all_variables( self ):
       ''' Returns all variables in the vlsv reader and the data reducer
@@ -1229,6 +1923,7 @@ class VlsvReader(object):
          return ranks
 
 
+   @synchronized
    def __read_fileindex_for_cellid_rank(self, rank):
       """ Read in the cell ids and create an internal dictionary to give the index of an arbitrary cellID
       """
@@ -1287,13 +1982,8 @@ class VlsvReader(object):
             array_size = ast.literal_eval(child.attrib["arraysize"])
             variable_offset = ast.literal_eval(child.text)
 
-            if self.__fptr.closed:
-               fptr = open(self.file_name,"rb")
-            else:
-               fptr = self.__fptr
-
-            fptr.seek(variable_offset)
-            info = fptr.read(array_size).decode("utf-8")
+            info = bytearray(array_size)
+            info = info[:self.__read_into(variable_offset, info)].decode("utf-8")
 
             print("Version Info for " + self.file_name)
             print(info)
@@ -1320,13 +2010,8 @@ class VlsvReader(object):
             array_size = ast.literal_eval(child.attrib["arraysize"])
             variable_offset = ast.literal_eval(child.text)
 
-            if self.__fptr.closed:
-               fptr = open(self.file_name,"rb")
-            else:
-               fptr = self.__fptr
-
-            fptr.seek(variable_offset)
-            configuration = fptr.read(array_size).decode("utf-8")
+            configuration = bytearray(array_size)
+            configuration = configuration[:self.__read_into(variable_offset, configuration)].decode("utf-8")
 
             return configuration
 
@@ -1422,61 +2107,113 @@ class VlsvReader(object):
       name = name.lower()
 
       # Seek for requested data in VLSV file
-      for child in self.__xml_root:
-         if tag != "":
-            if child.tag != tag:
-               continue
-         if name != "":
-            if "name" in child.attrib and child.attrib["name"].lower() != name:
-               continue
-         if mesh != "":
-            if "mesh" in child.attrib and child.attrib["mesh"] != mesh:
-               continue
-         if child.tag == tag:
-            # Found the requested data entry in the file
-            return ast.literal_eval(child.attrib[attribute])
+      entry = self.__footer.find(tag, name, mesh, require_name=False, require_mesh=False) if tag != "" else None
+      if entry is not None:
+         # Found the requested data entry in the file
+         return ast.literal_eval(entry.attrib[attribute])
 
       raise ValueError("Variable or attribute not found")
 
    def read_with_offset(self, datatype,variable_offset, read_size, read_offsets, element_size, vector_size):
 
-      # If someone had opened the filepointer already, let them handle it.
-      # They must know what they are doing, right? ;)
-      fptr_was_closed = True
-      if self.__fptr.closed:
-         fptr = open(self.file_name,"rb")
-      else:
-         fptr = self.__fptr
-         fptr_was_closed = False
+      if self.__mmap is not None:
+         return self.__read_with_offset_mmap(datatype, variable_offset, read_size, read_offsets, element_size, vector_size)
 
+      dtype = vlsv_datatypes[(datatype, element_size)]
       if len(read_offsets) !=1:
          arraydata = []
       for r_offset in read_offsets:
          use_offset = int(variable_offset + r_offset)
-         fptr.seek(use_offset)
-         if datatype == "float" and element_size == 4:
-            data = np.fromfile(fptr, dtype = np.float32, count=vector_size*read_size)
-         if datatype == "float" and element_size == 8:
-            data = np.fromfile(fptr, dtype=np.float64, count=vector_size*read_size)
-         if datatype == "int" and element_size == 4:
-            data = np.fromfile(fptr, dtype=np.int32, count=vector_size*read_size)
-         if datatype == "int" and element_size == 8:
-            data = np.fromfile(fptr, dtype=np.int64, count=vector_size*read_size)
-         if datatype == "uint" and element_size == 4:
-            data = np.fromfile(fptr, dtype=np.uint32, count=vector_size*read_size)
-         if datatype == "uint" and element_size == 8:
-            data = np.fromfile(fptr, dtype=np.uint64, count=vector_size*read_size)
+         data = np.empty(vector_size*read_size, dtype=dtype)
+         nbytes = self.__read_into(use_offset, data.view(np.uint8))
+         data = data[:nbytes//element_size] # Short at the end of the file, as np.fromfile would be
          if len(read_offsets)!=1:
             arraydata.append(data)
       if len(read_offsets) !=1:
          data = np.array(arraydata)
 
-      # Close file pointer again if it was closed to begin with
-      if fptr_was_closed:
-         fptr.close()
+      return data
+
+   def __read_into(self, offset, buffer):
+      ''' Fill buffer (writable, e.g. a uint8 view of a numpy array) with the file contents from byte offset on.
+
+      If the file has been opened with :func:`optimize_open_file`, the shared handle is used with positional
+      reads, which do not touch the file position and thus need no locking between threads. Otherwise
+      (and on platforms without positional reads) each call uses a private handle.
+
+      :returns: number of bytes read, less than len(buffer) only at the end of the file
+      '''
+      fptr = self.__fptr
+      if positional_reads and not fptr.closed:
+         return pread_into(fptr.fileno(), offset, buffer)
+      with open(self.file_name,"rb") as fptr:
+         fptr.seek(offset)
+         return fptr.readinto(memoryview(buffer).cast("B"))
+
+   def __read_with_offset_mmap(self, datatype, variable_offset, read_size, read_offsets, element_size, vector_size):
+      ''' Memory-mapped counterpart of read_with_offset: a single offset is served as a
+      read-only view over the map, several offsets as one fancy-index gather.
+      '''
+      dtype = vlsv_datatypes[(datatype, element_size)]
+      count = vector_size*read_size
+      if len(read_offsets) == 1:
+         return self.__mmap.view(variable_offset + int(read_offsets[0]), dtype, count)
+
+      element_offsets = np.asarray(read_offsets, dtype=np.int64)//element_size
+      if element_offsets.size == 0:
+         return np.empty((0,count), dtype=dtype)
+      span = int(np.max(element_offsets)) + count
+      mapped = self.__mmap.view(variable_offset, dtype, span)
+      return mapped[element_offsets[:,np.newaxis] + np.arange(count, dtype=np.int64)[np.newaxis,:]]
+
+   def read_with_ranges(self, datatype, variable_offset, range_starts, range_lengths, element_size, vector_size):
+      ''' Read several element ranges of a file array into one flat array, in the given order.
+
+      :param range_starts:  array of range start indices (in elements of vector_size values)
+      :param range_lengths: array of range lengths (in elements of vector_size values)
+      :returns: numpy array with the concatenated data of all ranges
+
+      .. seealso:: :func:`coalesce_read_ranges`
+      '''
+      dtype = vlsv_datatypes[(datatype, element_size)]
+      data = np.empty(int(np.sum(range_lengths))*vector_size, dtype=dtype)
+
+      if self.__mmap is not None:
+         position = 0
+         for start, length in zip(range_starts, range_lengths):
+            count = int(length)*vector_size
+            data[position:position+count] = self.__mmap.view(variable_offset + int(start)*element_size*vector_size, dtype, count)
+            position += count
+         return data
+
+      buffer = data.view(np.uint8)
+      position = 0
+      for start, length in zip(range_starts, range_lengths):
+         nbytes = int(length)*vector_size*element_size
+         if self.__read_into(int(variable_offset + int(start)*element_size*vector_size), buffer[position:position+nbytes]) != nbytes:
+            raise IOError("Unexpected end of file while reading "+self.file_name)
+         position += nbytes
 
       return data
 
+   def read_with_fileindices(self, datatype, variable_offset, fileindices, element_size, vector_size):
+      ''' Read the elements at the given file indices of a file array. The indices are
+      coalesced into as few reads as possible (see :func:`set_read_gap_tolerance`) and the
+      result is returned in the order of fileindices.
+
+      :returns: numpy array of shape (len(fileindices), vector_size)
+      '''
+      if self.__mmap is not None:
+         # The map already serves scattered elements without syscalls
+         read_offsets = np.asarray(fileindices, dtype=np.int64)*element_size*vector_size
+         data = self.read_with_offset(datatype, variable_offset, 1, read_offsets, element_size, vector_size)
+         return data.reshape(-1, vector_size)
+
+      max_gap = self.__read_gap_bytes // (element_size*vector_size)
+      range_starts, range_lengths, scatter = coalesce_read_ranges(fileindices, max_gap)
+      data = self.read_with_ranges(datatype, variable_offset, range_starts, range_lengths, element_size, vector_size)
+      return data.reshape(-1, vector_size)[scatter,:]
+
    def get_read_offsets(self, cellids, array_size, element_size, vector_size):
       ''' Figure out somewhat optimal offsets for read operations
       '''
@@ -1497,20 +2234,12 @@ class VlsvReader(object):
       # Define efficient method to read data in
       reorder_data = False
       if not isinstance(cellids, numbers.Number):
-         # Read multiple specified cells
-         # If we're reading a large amount of single cells, it'll be faster to just read all
-         # data from the file system and sort through it. For the CSC disk system, this
-         # becomes more efficient for over ca. 5000 cellids.
-         if len(cellids) >5000: # TODO re-evaluate threshold
-            reorder_data = True
-            result_size = len(cellids)
-            read_size = array_size
-            read_offsets = [0]
-         else: # Read multiple cell ids one-by-one
-            result_size = len(cellids)
-            read_size = 1
-            # read_offsets = [self.__fileindex_for_cellid[cid]*element_size*vector_size for cid in cellids]
-            read_offsets = self.get_cellid_fileindices(cellids)*element_size*vector_size
+         # Read multiple specified cells one-by-one. Note that read() does not use this but
+         # coalesces the reads via read_with_fileindices instead.
+         result_size = len(cellids)
+         read_size = 1
+         # read_offsets = [self.__fileindex_for_cellid[cid]*element_size*vector_size for cid in cellids]
+         read_offsets = self.get_cellid_fileindices(cellids)*element_size*vector_size
       else: # single cell or all cells
          if cellids < 0: # -1, read all cells
             result_size = array_size
@@ -1566,9 +2295,14 @@ class VlsvReader(object):
 
       # Force lowercase name for internal checks
       name = name.lower()
-      if tag == "VARIABLE":
-         if (name,operator) in self.__variable_cache.keys():
-            return self.read_variable_from_cache(name, cellids, operator)
+      # The cache holds fsgrid variables in grid order, while reads from the fsgrid mesh return file order
+      if tag == "VARIABLE" and mesh != "fsgrid":
+         if (name,operator) in self.__variable_cache:
+            try:
+               return self.read_variable_from_cache(name, cellids, operator)
+            except vlsvcache.CacheMiss: # Evicted by another thread meanwhile
+               pass
+         self.__variable_cache.misses += 1
 
       # Get population and variable names from data array name
       if '/' in name:
@@ -1584,82 +2318,51 @@ class VlsvReader(object):
          varname = name
 
       # Seek for requested data in VLSV file
-      for child in self.__xml_root:
-         if tag != "":
-            if child.tag != tag:
-               continue
-         # Verify that any requested name or mesh matches those of the data
-         if name != "":
-            if not "name" in child.attrib:
-               continue
-            if child.attrib["name"].lower() != name:
-               continue
-         if mesh != "":
-            if not "mesh" in child.attrib:
-               continue
-            if child.attrib["mesh"] != mesh:
-               continue
-         if child.tag == tag:
-            # Found the requested data entry in the file
-            vector_size = ast.literal_eval(child.attrib["vectorsize"])
-            array_size = ast.literal_eval(child.attrib["arraysize"])
-            element_size = ast.literal_eval(child.attrib["datasize"])
-            datatype = child.attrib["datatype"]
-            variable_offset = ast.literal_eval(child.text)
-
-            if not isinstance(cellids, numbers.Number):
-               cellids = np.array(cellids, dtype=np.int64)
-               cellids_nonzero = cellids[cellids!=0]
-            else:
-               cellids_nonzero = cellids
-
-            read_size, read_offsets, result_size, reorder_data = self.get_read_offsets(cellids_nonzero, array_size, element_size, vector_size)
-
+      entry = self.__footer.find(tag, name, mesh) if tag != "" else None
+      if entry is not None:
+         # Found the requested data entry in the file
+         vector_size = entry.vector_size
+         array_size = entry.array_size
+         element_size = entry.element_size
+         datatype = entry.datatype
+         variable_offset = entry.offset
+
+         if not isinstance(cellids, numbers.Number):
+            cellids = np.array(cellids, dtype=np.int64)
+            cellids_nonzero = cellids[cellids!=0]
+
+            # Multiple cell id's requested: read them in coalesced ranges and
+            # scatter back into the requested order
+            result_size = len(cellids_nonzero)
+            data = self.read_with_fileindices(datatype, variable_offset, self.get_cellid_fileindices(cellids_nonzero), element_size, vector_size)
+            if vector_size == 1:
+               data = data.reshape(-1)
+         else:
+            read_size, read_offsets, result_size, reorder_data = self.get_read_offsets(cellids, array_size, element_size, vector_size)
             data = self.read_with_offset(datatype, variable_offset, read_size, read_offsets, element_size, vector_size)
 
-            if len(read_offsets)==1 and reorder_data:
-               # Many single cell id's requested
-               # Pick the elements corresponding to the requested cells
-               arraydata = np.array(data)
-               if vector_size > 1:
-                  arraydata=arraydata.reshape(-1, vector_size)
-
-               # mask = ~dict_keys_exist(self.__fileindex_for_cellid, cellids_nonzero)
-               # mask = ~self.query_cellid_exists(cellids_nonzero)
-
-               # self.do_partial_fileindex_update(self.get_cell_coordinates(cellids_nonzero[mask]))
-
-               # append_offsets = [self.__fileindex_for_cellid[cid] for cid in cellids_nonzero]
-               append_offsets = self.get_cellid_fileindices(cellids_nonzero)
-               data = arraydata[append_offsets,...]
-               data = np.squeeze(data)
-
-            if len(read_offsets)!=1:
-               # Not-so-many single cell id's requested
-               data = np.squeeze(np.array(data))
+         if vector_size > 1:
+            data=data.reshape(result_size, vector_size)
 
-            if vector_size > 1:
-               data=data.reshape(result_size, vector_size)
-
-            if not isinstance(cellids, numbers.Number):
-               if np.issubdtype(data.dtype, np.floating):
-                  data_out = np.full_like(data, np.nan, shape=(len(cellids),*data.shape[1:]))
-               elif np.issubdtype(data.dtype, np.integer):
-                  data_out = np.full_like(data, np.iinfo(data.dtype).min, shape=(len(cellids),*data.shape[1:]))
-               else:
-                  raise ValueError("unexpected dtype encountered in read ("+str(data.dtype)+")")
-               data_out[cellids!=0,...] = data
-               data = data_out
+         if not isinstance(cellids, numbers.Number):
+            if np.issubdtype(data.dtype, np.floating):
+               data_out = np.full_like(data, np.nan, shape=(len(cellids),*data.shape[1:]))
+            elif np.issubdtype(data.dtype, np.integer):
+               data_out = np.full_like(data, np.iinfo(data.dtype).min, shape=(len(cellids),*data.shape[1:]))
+            else:
+               raise ValueError("unexpected dtype encountered in read ("+str(data.dtype)+")")
+            data_out[cellids!=0,...] = data
+            data = data_out
 
-            # If variable vector size is 1, and requested magnitude, change it to "absolute"
-            if vector_size == 1 and operator=="magnitude":
-               logging.info("Data variable with vector size 1: Changed magnitude operation to absolute")
-               operator="absolute"
+         # If variable vector size is 1, and requested magnitude, change it to "absolute"
+         if vector_size == 1 and operator=="magnitude":
+            logging.info("Data variable with vector size 1: Changed magnitude operation to absolute")
+            operator="absolute"
 
-            if result_size == 1:
-               return data_operators[operator](data[0])
-            else:
-               return data_operators[operator](data)
+         if result_size == 1:
+            return data_operators[operator](data[0])
+         else:
+            return data_operators[operator](data)
 
       # Check which set of datareducers to use
       if '/' in name and popname in self.active_populations:
@@ -1679,6 +2382,12 @@ class VlsvReader(object):
 
 
 
+      # Data reducer results persisted by an earlier reader, SEE: set_derived_store
+      if tag == "VARIABLE" and mesh != "fsgrid" and self.__load_derived(name, operator):
+         return self.read_variable_from_cache(name, cellids, operator)
+
+      requested_operator = operator
+
       # If this is a variable that can be summed over the populations (Ex. rho, PTensorDiagonal, ...)
       if hasattr(self, 'active_populations') and len(self.active_populations) > 0 and self.check_variable(self.active_populations[0]+'/'+name):
          self.__init_populations()  # verify all populations have been initialized
@@ -1686,7 +2395,7 @@ class VlsvReader(object):
          for pname in self.active_populations:
             vlsvvariables.activepopulation = pname
             tmp_vars.append( self.read( pname+'/'+name, tag, mesh, "pass", cellids ) )
-         return data_operators[operator](data_operators["sum"](tmp_vars))
+         return self.__cache_derived(name, tag, requested_operator, cellids, data_operators[operator](data_operators["sum"](tmp_vars)))
 
       # Check if the name is in datareducers
       if name in reducer_reg:
@@ -1700,35 +2409,16 @@ class VlsvReader(object):
 
          # Return the output of the datareducer
          if reducer.useVspace and not reducer.useReader:
-            actualcellids = self.read(mesh="SpatialGrid", name="CellID", tag="VARIABLE", operator=operator, cellids=cellids)
-            output = np.zeros(len(actualcellids))
-            index = 0
-            for singlecellid in actualcellids:
-               velocity_cell_data = self.read_velocity_cells(singlecellid)
-               # Get cells:
-               vcellids = list(velocity_cell_data.keys())
-               # Get coordinates:
-               velocity_coordinates = self.get_velocity_cell_coordinates(vcellids)
-               tmp_vars = []
-               for i in np.atleast_1d(reducer.variables):
-                  tmp_vars.append( self.read( i, tag, mesh, "pass", singlecellid ) )
-               output[index] = reducer.operation( tmp_vars , velocity_cell_data, velocity_coordinates )
-               index+=1
-               logging.info(str(index)+"/"+str(len(actualcellids)))
-
-            if reducer.useReader:
-               logging.info("Combined useVspace and useReader reducers not implemented!")
-               raise NotImplementedError()
-            else:
-               return data_operators[operator](output)
+            output = self.__read_vspace_reducer(reducer, cellids, tag, mesh)
+            return self.__cache_derived(name, tag, requested_operator, cellids, data_operators[operator](output))
+         elif reducer.useVspace:
+            logging.info("Combined useVspace and useReader reducers not implemented!")
+            raise NotImplementedError()
          else:
             tmp_vars = []
             for i in np.atleast_1d(reducer.variables):
                tmp_vars.append( self.read( i, tag, mesh, "pass", cellids ) )
-            if reducer.useReader:
-               return data_operators[operator](reducer.operation( tmp_vars, self ))
-            else:
-               return data_operators[operator](reducer.operation( tmp_vars ))
+            return self.__cache_derived(name, tag, requested_operator, cellids, data_operators[operator](self.__evaluate_reducer(reducer, tmp_vars)))
 
       # Check if the name is in multipop datareducers
       if 'pop/'+varname in reducer_multipop:
@@ -1751,7 +2441,7 @@ class VlsvReader(object):
             for pname in self.active_populations:
                vlsvvariables.activepopulation = pname
                tmp_vars.append( self.read( pname+'/'+varname, tag, mesh, "pass", cellids ) )
-            return data_operators[operator](data_operators["sum"](tmp_vars))
+            return self.__cache_derived(name, tag, requested_operator, cellids, data_operators[operator](data_operators["sum"](tmp_vars)))
          else:
             vlsvvariables.activepopulation = popname
 
@@ -1763,51 +2453,39 @@ class VlsvReader(object):
             else:
                tvar = i.split('/',1)[1]
                tmp_vars.append( self.read( popname+'/'+tvar, tag, mesh, "pass", cellids ) )
-         if reducer.useReader:
-            return data_operators[operator](reducer.operation( tmp_vars, self))
-         else:
-            return data_operators[operator](reducer.operation( tmp_vars ))
+         return self.__cache_derived(name, tag, requested_operator, cellids, data_operators[operator](self.__evaluate_reducer(reducer, tmp_vars)))
 
       if name!="":
          raise ValueError("Error: variable "+name+"/"+tag+"/"+mesh+"/"+operator+" not found in .vlsv file or in data reducers!\n Reader file "+self.file_name)
 
+   def __cache_derived(self, name, tag, operator, cellids, data):
+      ''' Store a data reducer result over the whole grid in the variable cache, if
+      cache_derived_variables is set. The cache keeps its own copy and serves copies, so
+      callers may modify the returned data freely; the per-reader budget bounds what is kept.
+      '''
+      if (tag == "VARIABLE" and isinstance(data, np.ndarray) and
+            isinstance(cellids, numbers.Number) and cellids == -1):
+         if self.cache_derived_variables:
+            self.__variable_cache.add((name,operator), data.copy(), copy_on_read=True)
+         self.__save_derived(name, operator, data)
+      return data
+
    def read_cellids_with_offset(self, start, ncells):
       import ast
       tag="VARIABLE"
       name="cellid"
       mesh="SpatialGrid"
 
-    # Seek for requested data in VLSV file
-      for child in self.__xml_root:
-         if tag != "":
-            if child.tag != tag:
-               continue
-         # Verify that any requested name or mesh matches those of the data
-         if name != "":
-            if not "name" in child.attrib:
-               continue
-            if child.attrib["name"].lower() != name:
-               continue
-         if mesh != "":
-            if not "mesh" in child.attrib:
-               continue
-            if child.attrib["mesh"] != mesh:
-               continue
-         if child.tag == tag:
-            # Found the requested data entry in the file
-            vector_size = ast.literal_eval(child.attrib["vectorsize"])
-            array_size = ast.literal_eval(child.attrib["arraysize"])
-            element_size = ast.literal_eval(child.attrib["datasize"])
-            datatype = child.attrib["datatype"]
-            variable_offset = ast.literal_eval(child.text)
-
-            result_size = ncells
-            read_size = ncells
-            read_offsets = [start*element_size*vector_size]
+      # Seek for requested data in VLSV file
+      entry = self.__footer.find(tag, name, mesh)
+      if entry is not None:
+         # Found the requested data entry in the file
+         read_size = ncells
+         read_offsets = [start*entry.element_size*entry.vector_size]
 
-            data = self.read_with_offset(datatype, variable_offset, read_size, read_offsets, element_size, vector_size)
+         data = self.read_with_offset(entry.datatype, entry.offset, read_size, read_offsets, entry.element_size, entry.vector_size)
 
-            return data
+         return data
 
    def read_metadata(self, name="", tag="", mesh=""):
       ''' Read variable metadata from the open vlsv file.
@@ -1825,160 +2503,134 @@ class VlsvReader(object):
       if tag == "" and name == "":
          logging.info("Bad arguments at read")
 
-      if self.__fptr.closed:
-         fptr = open(self.file_name,"rb")
-      else:
-         fptr = self.__fptr
-
       # Force lowercase name for internal checks
       name = name.lower()
 
       # Seek for requested data in VLSV file
-      for child in self.__xml_root:
-         if tag != "":
-            if child.tag != tag:
-               continue
-         if name != "":
-            if "name" in child.attrib and child.attrib["name"].lower() != name:
-               continue
-         if mesh != "":
-            if "mesh" in child.attrib and child.attrib["mesh"] != mesh:
-               continue
-         if not "name" in child.attrib:
-            continue
+      entry = None
+      if name != "":
+         entry = self.__footer.find(tag, name, mesh, require_mesh=False)
+      else:
+         for candidate in (self.__footer.find_all(tag) if tag != "" else self.__footer.entries):
+            if candidate.name is not None and (mesh == "" or candidate.mesh is None or candidate.mesh == mesh):
+               entry = candidate
+               break
+      if entry is not None:
          # Found the requested data entry in the file
-         try:
-            unit = child.attrib["unit"]
-         except:
-            unit = ""
-         try:
-            unitLaTeX = child.attrib["unitLaTeX"]
-         except:
-            unitLaTeX = ""
-         try:
-            variableLaTeX = child.attrib["variableLaTeX"]
-         except:
-            variableLaTeX = ""
-         try:
-            unitConversion = child.attrib["unitConversion"]
-         except:
-            unitConversion = ""
+         unit = entry.attrib.get("unit", "")
+         unitLaTeX = entry.attrib.get("unitLaTeX", "")
+         variableLaTeX = entry.attrib.get("variableLaTeX", "")
+         unitConversion = entry.attrib.get("unitConversion", "")
          return unit, unitLaTeX, variableLaTeX, unitConversion
 
       if name!="":
          raise IOError("Error: variable "+name+"/"+tag+"/"+mesh+" not found in .vlsv file!" )
-      fptr.close()
       return -1
 
 
 
-   def read_interpolated_fsgrid_variable(self, name, coordinates, operator="pass",periodic=[True,True,True], method="linear"):
-      ''' Read a linearly interpolated FSgrid variable value from the open vlsv file. Feel free to vectorize!
-      Note that this does not account for varying centerings of fsgrid data.
+   def __fsgrid_ordered_array(self, name, operator="pass"):
+      ''' Ordered fsgrid data of shape [nx, ny, nz, components], taken from the variable cache or read
+      into it on first use, so that repeated interpolations do not reassemble the fsgrid again.
+      '''
+      # Kept under its own key, which read and read_variable never look up, so the array does not leak out
+      key = ("fsgrid_ordered:"+name, operator)
+      try:
+         data = self.__variable_cache[key]
+      except KeyError:
+         data = self.read_fsgrid_variable(name, operator=operator)
+         self.__variable_cache.add(key, data)
+      return np.reshape(data, tuple(np.int64(self.get_fsgrid_mesh_size())) + (-1,))
+
+   def read_interpolated_fsgrid_variable(self, name, coordinates, operator="pass",periodic=[True,True,True], method="linear", centering=None):
+      ''' Read a trilinearly interpolated FSgrid variable value from the open vlsv file.
+      All coordinates are interpolated at once; the ordered fsgrid array is kept in the variable cache
+      between calls (see :func:`set_variable_cache_budget`).
+
       Arguments:
       :param name: Name of the (FSgrid) variable
-      :param coords: Coordinates from which to read data
-      :param periodic: Periodicity of the system. Default is periodic in all dimension
+      :param coordinates: Coordinates from which to read data, [x,y,z] or an array of shape [n,3]
+      :param periodic: Periodicity of the system. Default is periodic in all dimension.
+                       Along non-periodic dimensions, coordinates outside the domain return nan.
       :param operator: Datareduction operator. "pass" does no operation on data
-      :returns: numpy array with the data
-
-      .. seealso:: :func:`read` :func:`read_variable_info`
+      :param method: Interpolation method, only "linear" is supported
+      :param centering: Location of the data in the fsgrid cells:
+                        "volume" (cell centres), "face" (component i on the lower i-face, e.g. fg_b),
+                        "edge" (component i on the lower edge along i, e.g. fg_e) or
+                        "node" (lower cell corners). None picks face for fg_b, edge for fg_e and volume otherwise.
+      :returns: numpy array with the data, [n] or [n,components]; a single value for a single coordinate
+
+      .. seealso:: :func:`read` :func:`read_variable_info` :func:`read_fsgrid_variable`
       '''
 
-      if method != "Linear":
+      if method.lower() != "linear":
          raise NotImplementedError("interpolation method "+method+" not implemented for read_interpolated_fsgrid_variable, only linear supported so far.")
 
-      warnings.warn("read_interpolated_fsgrid_variable: face- vs. edge- centered variables not accounted for!")
-
       if name[0:3] != 'fg_':
          raise ValueError("Interpolation of FsGrid called on non-FsGrid data; exiting.")
 
       if (len(periodic)!=3):
          raise ValueError("Periodic must be a list of 3 booleans.")
 
-      #First off let's fetch the data and some meta
-      fg_data=self.read_fsgrid_variable( name,operator=operator)
-      fg_size=self.get_fsgrid_mesh_size()
-      nx,ny,nz=fg_size
-      extents=self.get_fsgrid_mesh_extent()
-      xmin,ymin,zmin,xmax,ymax,zmax=extents
-      dx=abs((xmax-xmin)/nx)
-      dy=abs((ymax-ymin)/ny)
-      dz=abs((zmax-zmin)/nz)
-
-      def getFsGridIndices(indices):
-         '''
-         Returns indices based on boundary conditions
-         '''
-         ind=-1*np.ones((3))
-         for c,index in enumerate(indices):
-            #Non periodic case
-            if ((index<0 or index>fg_size[c]-1) and not periodic[c]):
-               # Returns False, interpolateSingle converts that to nans
-               warnings.warn("Requested fsgrid index for interpolation outside simulation domain.", UserWarning)
-               return False
-             # Here we are either periodic or (not periodic and inside the domain)
-            if (index >= fg_size[c] or index <0):
-                ind[c] = index%fg_size[c]
-            elif (index>=0 and index<=fg_size[c]-1):
-                ind[c]=index
-            else:
-                #If we end up here then something is really wrong
-                raise ValueError("FsGrid interpolation ran into a failure and could not locate all neighbors.","Indices in question= ",indices)
-
-         return int(ind[0]),int(ind[1]),int(ind[2])
-
+      known_centerings = {"fg_b":"face", "fg_e":"edge"}
+      if centering is None:
+         centering = known_centerings.get(name.lower(), "volume")
+
+      # Sample positions within a cell, in units of the cell size, as groups of (components, offset)
+      if centering in ("face", "edge"):
+         # Staggered components are interpolated separately from the raw data, the operator is applied afterwards
+         data = self.__fsgrid_ordered_array(name, "pass")
+         if data.shape[-1] != 3:
+            raise ValueError(centering+"-centered interpolation needs a vector variable, "+name+" has "+str(data.shape[-1])+" components")
+         offsets = np.eye(3)*0.5 if centering == "edge" else 0.5 - np.eye(3)*0.5
+         groups = [(np.array([c]), offsets[c]) for c in range(3)]
+      elif centering in ("volume", "node"):
+         data = self.__fsgrid_ordered_array(name, operator)
+         groups = [(np.arange(data.shape[-1]), np.full(3, 0.5 if centering == "volume" else 0.0))]
+      else:
+         raise ValueError("Unknown centering ('"+str(centering)+"') for read_interpolated_fsgrid_variable")
 
+      coordinates = np.asarray(coordinates, dtype=np.float64)
+      single = (coordinates.ndim == 1)
+      coordinates = np.reshape(coordinates, (-1,3))
 
-      def interpolateSingle(r):
-         '''
-         Simple trilinear routine for interpolating fsGrid quantities
-         at arbitrary coordinates r.
-         Inputs:
-             r: array of coordinates at which to perform the interpolation.
-                Example: r=[x,y,z] in meters
-         Outputs:
-             Numpy array with interpolated data at r. Can be scalar or vector.
-         '''
-         import sys
-         if (len(r) !=3 ):
-            raise ValueError("Interpolation cannot be performed. Exiting")
-
-         x,y,z=r
-         xl=int(np.floor((x-xmin)/dx))
-         yl=int(np.floor((y-ymin)/dy))
-         zl=int(np.floor((z-zmin)/dz))
-
-         #Normalize distances in a unit cube
-         xd=(x-xmin)/dx - xl
-         yd=(y-ymin)/dy - yl
-         zd=(z-zmin)/dz - zl
-
-         # Calculate Neighbors' Weights
-         w=np.zeros(8)
-         w[0] = (1.0-xd)*(1.0-yd)*(1.0-zd)
-         w[1] = (xd)*(1.0-yd)*(1.0-zd)
-         w[2] = (1.0-xd)*(yd)*(1.0-zd)
-         w[3] = (xd)*(yd)*(1.0-zd)
-         w[4] = (1.0-xd)*(1.0-yd)*(zd)
-         w[5] = (xd)*(1.0-yd)*(zd)
-         w[6] = (1.0-xd)*(yd)*(zd)
-         w[7] = (xd)*(yd)*(zd)
-
-         retval = np.zeros_like(fg_data[0,0,0])
-         for k in [0,1]:
-            for j in [0,1]:
-               for i in [0,1]:
-                  retind=getFsGridIndices([xl+i,yl+j,zl+k])
-                  if (not retind): retval.fill(np.nan) # outside of a non periodic domain
-                  retval += w[4*k+2*j+i]*fg_data[retind]
-
-         return retval
-
-      ret=[]
-      for r in coordinates:
-         ret.append(interpolateSingle(r))
-      return np.asarray(ret)
+      size = np.int64(data.shape[0:3])
+      extents = self.get_fsgrid_mesh_extent()
+      lows = extents[0:3]
+      highs = extents[3:6]
+      cell_size = (highs - lows)/size
+      periodic = np.asarray(periodic, dtype=bool)
+      # Corner offsets of the 8 surrounding samples, in the order [x + 2y + 4z]
+      corners = np.array([[i,j,k] for k in [0,1] for j in [0,1] for i in [0,1]], dtype=np.int64)
+
+      result = np.empty((coordinates.shape[0], data.shape[-1]))
+      any_outside = False
+      chunk = 65536 # Bounds the [points, 8, components] temporaries
+      for start in range(0, coordinates.shape[0], chunk):
+         r = coordinates[start:start+chunk]
+         for components, offset in groups:
+            s = (r - lows)/cell_size - offset
+            lower = np.floor(s)
+            frac = (s - lower)[:,np.newaxis,:]
+            indices = lower.astype(np.int64)[:,np.newaxis,:] + corners
+            # Wrap periodic dimensions, clamp non-periodic ones to the outermost samples
+            indices = np.where(periodic, indices % size, np.clip(indices, 0, size-1))
+            weights = np.prod(np.where(corners == 1, frac, 1.0 - frac), axis=2)
+            values = data[indices[:,:,0,np.newaxis], indices[:,:,1,np.newaxis], indices[:,:,2,np.newaxis], components]
+            result[start:start+chunk, components] = np.einsum("pc,pcv->pv", weights, values)
+         outside = np.any(~periodic & ((r < lows) | (r > highs)), axis=1)
+         result[start:start+chunk][outside] = np.nan
+         any_outside = any_outside or np.any(outside)
+
+      if any_outside:
+         warnings.warn("Requested fsgrid interpolation outside simulation domain.", UserWarning)
+      if centering in ("face", "edge"):
+         result = data_operators[operator](result)
+      elif result.shape[-1] == 1:
+         result = result[:,0]
+      if single:
+         return result[0]
+      return result
 
    def read_interpolated_ionosphere_variable(self, name, coordinates, operator="pass", method="linear"):
       ''' Read a linearly interpolated ionosphere variable value from the open vlsv file.
@@ -1999,29 +2651,17 @@ class VlsvReader(object):
    def get_vg_regular_interp_neighbors(self, cellids, periodic = [True, True, True]):
 
 
-      len_cellids = np.atleast_1d(cellids).shape[0]
-      cellid_neighbors = np.zeros((len_cellids, 8))
-
-      in_cache = dict_keys_exist(self.__regular_neighbor_cache, cellids)
-
-      if(np.any(in_cache)):
-         cellid_neighbors[in_cache,:] = np.array(itemgetter(*cellids[in_cache])(self.__regular_neighbor_cache), dtype=np.int64)
+      cellids = np.atleast_1d(cellids).astype(np.int64)
+      in_cache, (cached,) = self.__get_dual_mesh().regular_neighbor_cache.get(cellids)
+      cellid_neighbors = cached.astype(np.float64)
       n_not_in_cache = np.sum(~in_cache)
 
       if n_not_in_cache > 0:
-         offsets = np.zeros((8,3), dtype=np.int32)
-         ii = 0
-         for x in [0,1]:
-            for y in [0,1]:
-               for z  in [0,1]:
-                  offsets[ii,:] = np.array((x,y,z), dtype=np.int32)
-                  ii+=1
-
-         cellids_rep = np.reshape(np.repeat(np.atleast_2d(cellids[~in_cache]), 8, axis=1).T,n_not_in_cache*8)
-         offsets = np.tile(offsets, (n_not_in_cache, 1))
+         cellids_rep = np.repeat(cellids[~in_cache], 8)
+         offsets = np.tile(dual_corner_offsets, (n_not_in_cache, 1))
          cellid_neighbors_new = self.get_cell_neighbor(cellids_rep, offsets, periodic, prune_uniques=False)
          cellid_neighbors_new = cellid_neighbors_new.reshape((-1,8))
-         self.__regular_neighbor_cache.update( {c:cellid_neighbors_new[i,:] for i,c in enumerate(cellids[~in_cache])})
+         self.__get_dual_mesh().regular_neighbor_cache.insert(cellids[~in_cache], cellid_neighbors_new)
          cellid_neighbors[~in_cache,:] = cellid_neighbors_new
 
       return cellid_neighbors
@@ -2062,101 +2702,39 @@ class VlsvReader(object):
 
       stack = True
       if len(np.shape(coordinates)) == 1:
-         stack = False
-         coordinates = np.atleast_2d(coordinates)
-
-      # Check one value for the length
-      test_variable = self.read_variable(name,cellids=[1],operator=operator)
-      value_length, value_shape, value_ndims = get_test_variable_length(test_variable)
-
-      ncoords = coordinates.shape[0]
-      if(coordinates.shape[1] != 3):
-         raise IndexError("Coordinates are required to be three-dimensional (coords.shape[1]==3 or convertible to such))")
-      closest_cell_ids = self.get_cellid(coordinates)
-
-      if method.lower() == "nearest":
-         if(coordinates.shape[0] > 1):
-            final_values = self.read_variable(name, cellids=closest_cell_ids, operator=operator)
-         else: # no need to re-read if we did the test_variable already!
-            final_values = test_variable
-         if stack:
-            return final_values.squeeze()
-         else:
-            if value_length == 1:
-               return final_values.squeeze()[()] # The only special case to return a scalar instead of an array
-            else:
-               return final_values.squeeze()
-      elif method.lower() != 'linear':
-         raise NotImplementedError(method + ' is not a valid interpolation method')
-
-      batch_closest_cell_coordinates=self.get_cell_coordinates(closest_cell_ids)
-
-      offsets = np.zeros(coordinates.shape,dtype=np.int32)
-      offsets[coordinates <= batch_closest_cell_coordinates] = -1
-
-      # This we cannot cache, unfortunately. np.unique on (closest_cell_ids,offsets) helps a bit in some cases.
-      lower_cell_ids = self.get_cell_neighbor(closest_cell_ids, offsets, periodic, prune_uniques=True)
-
-      lower_cell_ids_unique, unique_cell_indices = np.unique(lower_cell_ids, return_inverse=True)
-      ngbrvalues=np.full((len(lower_cell_ids_unique)*2*2*2,*value_shape),np.nan)
-
-      cellid_neighbors = np.zeros((lower_cell_ids_unique.shape[0],8))
-      cellid_neighbors[lower_cell_ids_unique != 0, :] = self.get_vg_regular_interp_neighbors(lower_cell_ids_unique[lower_cell_ids_unique != 0], periodic)
-      cellid_neighbors = cellid_neighbors.reshape((-1))
-
-
-      lower_cell_coordinatess=self.get_cell_coordinates(lower_cell_ids_unique)
-
-      upper_cell_ids = cellid_neighbors[7::8]
-      upper_cell_coordinatess=self.get_cell_coordinates(upper_cell_ids)
-
-      scaled_coordinates = np.zeros_like(coordinates)
-      nonperiodic = lower_cell_coordinatess != upper_cell_coordinatess
-      nonperiodic_all = nonperiodic[unique_cell_indices]
-      scaled_coordinates[nonperiodic_all] = (coordinates[nonperiodic_all] - lower_cell_coordinatess[unique_cell_indices][nonperiodic_all])/(upper_cell_coordinatess[unique_cell_indices][nonperiodic_all] - lower_cell_coordinatess[unique_cell_indices][nonperiodic_all])
+         stack = False
+         coordinates = np.atleast_2d(coordinates)
 
-      # neighbour tuples can also overlap, so choose only unique ones here as well for reading (should be moved to read_variable)
-      cellids_neighbors_unique, indices = np.unique(cellid_neighbors[cellid_neighbors!=0], return_inverse=True)
+      if(coordinates.shape[1] != 3):
+         raise IndexError("Coordinates are required to be three-dimensional (coords.shape[1]==3 or convertible to such))")
 
-      # Read the corner values for required cells and apply repeats to match the initial coordinates
-      if value_length > 1:
-         read_vals = self.read_variable(name, cellids=cellids_neighbors_unique, operator=operator)
-         ngbrvalues[cellid_neighbors!=0,:] = read_vals[indices,:]
-         # ngbrvalues[cellid_neighbors!=0,:] = self.read_variable(name, cellids=cellid_neighbors[cellid_neighbors!=0], operator=operator)
-      else:
-         read_vals = self.read_variable(name, cellids=cellids_neighbors_unique, operator=operator)[:,np.newaxis]
-         ngbrvalues[cellid_neighbors!=0,:] = read_vals[indices,:]
-         # ngbrvalues[cellid_neighbors!=0,:] = self.read_variable(name, cellids=cellid_neighbors[cellid_neighbors!=0], operator=operator)[:,np.newaxis]
-      # ngbrvalues = np.reshape(ngbrvalues, (ncoords,2,2,2,value_length))
-      nvals = len(lower_cell_ids_unique)
-      ngbrvalues = np.reshape(ngbrvalues, (nvals,2,2,2,*value_shape))
-
-      ngbrvalues = ngbrvalues[unique_cell_indices,...]
-      newax = (1,2, *[3+i for i,l in enumerate(value_shape)])
-      c2ds = (ngbrvalues[:,0,:,:,...]* (1 - np.expand_dims(scaled_coordinates[:,0],axis=newax)) +  ngbrvalues[:,1,:,:,...]*np.expand_dims(scaled_coordinates[:,0],axis=newax))
-      newax = (1, *[2+i for i,l in enumerate(value_shape)])
-      c1ds = (c2ds[:,0,:,...]*(1 - np.expand_dims(scaled_coordinates[:,1],axis=newax)) + c2ds[:,1,:,...] * np.expand_dims(scaled_coordinates[:,1],axis=newax))
-      newax = tuple(1+i for i,l in enumerate(value_shape))
-      final_values = (c1ds[:,0,...] * (1 - np.expand_dims(scaled_coordinates[:,2],axis=newax)) + c1ds[:,1,...] * np.expand_dims(scaled_coordinates[:,2],axis=newax))
-
-      if np.any(cellid_neighbors==0):
-         warnings.warn("Coordinate in interpolation out of domain, output contains nans",UserWarning)
-
-
-      refs0 = np.reshape(self.get_amr_level(cellid_neighbors),(-1,8))
-      if np.any(np.any(refs0 != refs0[:,0][:,np.newaxis],axis =1)):
-         irregs = np.any(refs0 != refs0[:,0][:,np.newaxis],axis =1)[unique_cell_indices]
-         final_values[irregs,...] = np.reshape(self.read_interpolated_variable_irregular(name, coordinates[irregs], operator, method=method.lower()),(-1,*value_shape))
-         # warnings.warn("Interpolation across refinement levels. Results are now better, but some discontinuitues might appear. If that bothers, try the read_interpolated_variable_irregular variant directly.",UserWarning)
+      final_values = self.get_interpolation_plan(coordinates, method, periodic).interpolate(self, name, operator)
 
       if stack:
          return final_values.squeeze()
       else:
-         if value_length == 1:
+         if final_values.size == 1:
             return final_values.squeeze()[()] # The only special case to return a scalar instead of an array
          else:
             return final_values.squeeze()
 
+   def get_interpolation_plan(self, coords, method="linear", periodic=[True, True, True]):
+      ''' Build an interpolation plan for the coordinates: the stencil cellids and weights of each coordinate.
+      Applying the plan skips the cell lookups, neighbour searches and weights of read_interpolated_variable,
+      so build one when the same coordinates are sampled for many variables or files on the same mesh.
+
+      :param coords: Coordinates, [x,y,z] or an array of shape [n,3]
+      :param method: Interpolation method, default "linear", options: ["nearest", "linear"]
+      :param periodic: Periodicity of the system. Default is periodic in all dimension
+      :returns: a :class:`calculations.InterpolationPlan`
+
+      .. seealso:: :func:`read_interpolated_variable`
+      '''
+      if method.lower() in interp_method_aliases.keys():
+         warnings.warn("Updated alias " +method+" -> "+interp_method_aliases[method.lower()])
+         method = interp_method_aliases[method.lower()]
+      return InterpolationPlan(self, get_data(coords), method, periodic)
+
    def get_duals(self,cids):
       ''' Get the union of dual cells that cover each of CellIDs in cids.
           Assumes all required duals are defined! TODO handling of missing duals, do not call separately.
@@ -2164,11 +2742,17 @@ class VlsvReader(object):
       :returns: Dict of vertex-indices v (3-tuple) : 8-tuple of cellids (corners of dual cells indexed by v)
       '''
 
-      fo = {c: self.__cell_duals[c] for c in cids}
-      vset = set().union(*fo.values())
-      
-      ret = {v: self.__dual_cells[v] for v in vset}
-      return ret
+      codes, cells = self.__duals_of_cells(cids)
+      indices = self.get_vertex_indices_from_codes(codes)
+      return {tuple(v): tuple(c) for v, c in zip(indices.tolist(), cells.tolist())}
+
+   def __duals_of_cells(self, cids):
+      ''' Vertex codes of the union of duals covering CellIDs cids, and the cellids at the corners of each dual.
+      '''
+      cids = np.unique(np.atleast_1d(cids).astype(np.int64))
+      cids = cids[cids != 0]
+      codes = np.unique(self.build_cell_vertices_csr(cids)[1])
+      return codes, self.__build_duals_of_vertices(codes)[0]
 
 
    def read_interpolated_variable_irregular(self, name, coords, operator="pass",periodic=[True, True, True],
@@ -2248,13 +2832,10 @@ class VlsvReader(object):
 
       containing_cells = np.unique(cellids)
       self.build_duals(containing_cells)
-      duals = self.get_duals(containing_cells)
+      cells_set = np.unique(self.__duals_of_cells(containing_cells)[1])
 
-      cells_set = set()
-      cells_set = cells_set.union(*duals.values())
-
-      cells_set.discard(0)
-      intp_wrapper = AMRInterpolator(self,cellids=np.array(list(cells_set)))
+      cells_set = cells_set[cells_set != 0]
+      intp_wrapper = AMRInterpolator(self,cellids=cells_set)
       intp = intp_wrapper.get_interpolator(name,operator, coords, method=method.lower(), methodargs=methodargs)
 
       final_values = intp(coords, cellids=cellids)[:,np.newaxis]
@@ -2279,11 +2860,18 @@ class VlsvReader(object):
 
        ... seealso:: :func:`read_fsgrid_variable`
        '''
-      var = self.read_fsgrid_variable(name, operator=operator)
       if cellids == -1:
-         return var
+         return self.read_fsgrid_variable(name, operator=operator)
       else:
-         return [self.downsample_fsgrid_subarray(cid, var) for cid in cellids]
+         # Read only the box around the fsgrid cells under the requested cells
+         slicemaps = [self.get_cell_fsgrid_slicemap(cid) for cid in cellids]
+         if len(slicemaps) == 0:
+            return []
+         low = np.min([lowi for lowi, upi in slicemaps], axis=0)
+         high = np.max([upi for lowi, upi in slicemaps], axis=0)+1
+         var = self.read_fsgrid_box(name, low, high, operator=operator)
+         return [self.__fsgrid_cell_mean(cid, var[lowi[0]-low[0]:upi[0]+1-low[0], lowi[1]-low[1]:upi[1]+1-low[1], lowi[2]-low[2]:upi[2]+1-low[2]])
+                 for cid, (lowi, upi) in zip(cellids, slicemaps)]
 
    def get_fsgrid_decomposition(self):
       # Try if in metadata
@@ -2325,81 +2913,126 @@ class VlsvReader(object):
       return self.__fsGridDecomposition
 
 
-   def read_fsgrid_variable(self, name, operator="pass"):
+   def get_fsgrid_rank_boxes(self):
+      ''' The boxes of fsgrid cells written by each rank, from the fsgrid domain decomposition.
+
+      :returns: a tuple (starts [ranks,3], sizes [ranks,3], offsets [ranks+1]), where offsets are the
+                positions (in cells) of the rank chunks in fsgrid variable arrays. Within a chunk, cells
+                are stored in Fortran order of the box.
+
+      .. seealso:: :func:`get_fsgrid_decomposition`
+      '''
+      if self.__fsgrid_rank_boxes is None:
+         bbox = np.int64(self.get_fsgrid_mesh_size())
+         decomposition = np.int64(self.get_fsgrid_decomposition())
+         ranks = np.arange(int(self.get_numWritingRanks("SpatialGrid")), dtype=np.int64)
+         tasks = np.stack(((ranks // decomposition[2]) // decomposition[1],
+                           (ranks // decomposition[2]) % decomposition[1],
+                           ranks % decomposition[2]), axis=-1)
+         starts = fsgrid_local_start(bbox, decomposition, tasks)
+         sizes = fsgrid_local_size(bbox, decomposition, tasks)
+         offsets = np.concatenate(([0], np.cumsum(np.prod(sizes, axis=1))))
+         self.__fsgrid_rank_boxes = (starts, sizes, offsets)
+      return self.__fsgrid_rank_boxes
+
+   def read_fsgrid_variable(self, name, operator="pass", low=None, high=None, out=None, memmap_file=None):
        ''' Reads fsgrid variables from the open vlsv file.
+
+       The data is reassembled rank chunk by rank chunk straight into the output array, keeping the
+       datatype of the file. With low and high, only the ranks whose chunks intersect the box are read,
+       and of those only the runs of cells inside the box.
+
        Arguments:
        :param name: Name of the variable
        :param operator: Datareduction operator. "pass" does no operation on data
-       :returns: *ordered* numpy array with the data
+       :kwarg low:   Lowest fsgrid indices [i,j,k] of a box to read (OPTIONAL, default whole grid)
+       :kwarg high:  Fsgrid indices [i,j,k] one past the highest of the box to read (OPTIONAL, default whole grid)
+       :kwarg out:   Preallocated output array of shape [nx,ny,nz] or [nx,ny,nz,components] of the box (OPTIONAL)
+       :kwarg memmap_file: Write the output into a new .npy file of this name and return it as a memory map (OPTIONAL)
+       :returns: *ordered* numpy array with the data. Dimensions of size 1 are squeezed out when reading the whole grid.
 
-       ... seealso:: :func:`read_variable`
+       ... seealso:: :func:`read_variable` :func:`read_fsgrid_box` :func:`get_fsgrid_rank_boxes`
        '''
 
        # Get fsgrid domain size (this can differ from vlasov grid size if refined)
-       bbox = self.get_fsgrid_mesh_size()
-       bbox = np.int32(bbox)
-
-       # Read the raw array data
-       rawData = self.read(mesh='fsgrid', name=name, tag="VARIABLE", operator=operator)
-
-       # Determine fsgrid domain decomposition
-       numWritingRanks = self.get_numWritingRanks("SpatialGrid")
-       if len(rawData.shape) > 1:
-         orderedData = np.zeros([bbox[0],bbox[1],bbox[2],rawData.shape[1]])
+       bbox = np.int64(self.get_fsgrid_mesh_size())
+       whole = low is None and high is None
+       low = np.zeros(3, dtype=np.int64) if low is None else np.maximum(np.int64(low), 0)
+       high = bbox.copy() if high is None else np.minimum(np.int64(high), bbox)
+       box_size = np.maximum(high - low, 0)
+
+       starts, sizes, offsets = self.get_fsgrid_rank_boxes()
+       name = name.lower()
+       entry = self.__footer.find("VARIABLE", name, "fsgrid")
+       if entry is None:
+          # Not stored as such (e.g. a data reducer): reassemble from the whole array in memory
+          rawData = self.read(mesh='fsgrid', name=name, tag="VARIABLE", operator=operator)
+          sample = rawData[0:2]
+          def read_rank_box(rank, lo, hi):
+             chunk = np.reshape(rawData[offsets[rank]:offsets[rank+1]], tuple(sizes[rank]) + np.shape(sample)[1:], order='F')
+             return chunk[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+       else:
+          if entry.vector_size == 1 and operator=="magnitude":
+             operator="absolute"
+          dtype = vlsv_datatypes[(entry.datatype, entry.element_size)]
+          sample = data_operators[operator](np.zeros((2, entry.vector_size) if entry.vector_size > 1 else 2, dtype=dtype))
+          max_gap = self.__read_gap_bytes // (entry.element_size*entry.vector_size)
+          def read_rank_box(rank, lo, hi):
+             # The chunk of a rank is its box in Fortran order: read the x-runs of the sub-box,
+             # which merge into a single range when the sub-box spans whole xy-planes
+             box = hi - lo
+             j, k = np.meshgrid(np.arange(lo[1], hi[1]), np.arange(lo[2], hi[2]), indexing='ij')
+             run_starts = (offsets[rank] + lo[0] + sizes[rank][0]*(j + sizes[rank][1]*k)).ravel(order='F')
+             read_starts, read_lengths, positions = coalesce_ranges(run_starts, np.full(run_starts.shape, box[0]), max_gap)
+             data = self.read_with_ranges(entry.datatype, entry.offset, read_starts, read_lengths, entry.element_size, entry.vector_size)
+             data = data.reshape(-1, entry.vector_size)
+             if len(data) != run_starts.size*box[0]:
+                data = data[(positions[:,np.newaxis] + np.arange(box[0])).ravel()]
+             if entry.vector_size == 1:
+                data = data[:,0]
+             return np.reshape(data_operators[operator](data), tuple(box) + np.shape(sample)[1:], order='F')
+       value_shape = np.shape(sample)[1:]
+
+       shape = tuple(int(n) for n in box_size) + value_shape
+       if out is not None:
+          orderedData = out
+       elif memmap_file is not None:
+          orderedData = np.lib.format.open_memmap(memmap_file, mode="w+", dtype=np.asarray(sample).dtype, shape=shape)
        else:
-         orderedData = np.zeros([bbox[0],bbox[1],bbox[2]])
-
-       def calcLocalStart(globalCells, ntasks, my_n):
-           n_per_task = globalCells//ntasks
-           remainder = globalCells%ntasks
-           if my_n < remainder:
-               return my_n * (n_per_task+1)
-           else:
-               return my_n * n_per_task + remainder
-       def calcLocalSize(globalCells, ntasks, my_n):
-           n_per_task = globalCells//ntasks
-           remainder = globalCells%ntasks
-           if my_n < remainder:
-               return n_per_task+1;
-           else:
-               return n_per_task
-
-       currentOffset = 0;
-       self.get_fsgrid_decomposition()
-
-       for i in range(0,numWritingRanks):
-           x = (i // self.__fsGridDecomposition[2]) // self.__fsGridDecomposition[1]
-           y = (i // self.__fsGridDecomposition[2]) % self.__fsGridDecomposition[1]
-           z = i % self.__fsGridDecomposition[2]
-
-           thatTasksSize = [calcLocalSize(bbox[0], self.__fsGridDecomposition[0], x), \
-                            calcLocalSize(bbox[1], self.__fsGridDecomposition[1], y), \
-                            calcLocalSize(bbox[2], self.__fsGridDecomposition[2], z)]
-           thatTasksStart = [calcLocalStart(bbox[0], self.__fsGridDecomposition[0], x), \
-                             calcLocalStart(bbox[1], self.__fsGridDecomposition[1], y), \
-                             calcLocalStart(bbox[2], self.__fsGridDecomposition[2], z)]
-
-           thatTasksEnd = np.array(thatTasksStart) + np.array(thatTasksSize)
-           totalSize = int(thatTasksSize[0]*thatTasksSize[1]*thatTasksSize[2])
-           # Extract datacube of that task...
-           if len(rawData.shape) > 1:
-               thatTasksData = rawData[currentOffset:currentOffset+totalSize,:]
-               thatTasksData = thatTasksData.reshape([thatTasksSize[0],thatTasksSize[1],thatTasksSize[2],rawData.shape[1]],order='F')
-
-               # ... and put it into place
-               orderedData[thatTasksStart[0]:thatTasksEnd[0],thatTasksStart[1]:thatTasksEnd[1],thatTasksStart[2]:thatTasksEnd[2],:] = thatTasksData
-           else:
-               # Special case for scalar data
-               thatTasksData = rawData[currentOffset:currentOffset+totalSize]
-               if (len(thatTasksData)>0):
-                  thatTasksData = thatTasksData.reshape([thatTasksSize[0],thatTasksSize[1],thatTasksSize[2]], order='F')
-
-                  # ... and put it into place
-                  orderedData[thatTasksStart[0]:thatTasksEnd[0],thatTasksStart[1]:thatTasksEnd[1],thatTasksStart[2]:thatTasksEnd[2]] = thatTasksData
-
-           currentOffset += totalSize
-
-       return np.squeeze(orderedData)
+          orderedData = np.zeros(shape, dtype=np.asarray(sample).dtype)
+
+       # Ranks whose chunks intersect the box
+       lows = np.maximum(starts, low)
+       highs = np.minimum(starts + sizes, high)
+       for rank in np.nonzero(np.all(highs > lows, axis=1))[0]:
+          # Extract the part of the datacube of that task inside the box...
+          thatTasksData = read_rank_box(rank, lows[rank]-starts[rank], highs[rank]-starts[rank])
+          # ... and put it into place
+          orderedData[tuple(slice(l, h) for l, h in zip(lows[rank]-low, highs[rank]-low))] = thatTasksData
+
+       if whole:
+          return np.squeeze(orderedData)
+       return orderedData
+
+   def read_fsgrid_box(self, name, low, high, operator="pass", out=None):
+      ''' Reads a box of cells of an fsgrid variable. Only the parts of the file holding the box are
+      read, located from the fsgrid domain decomposition.
+
+      :param name:     Name of the variable
+      :param low:      Lowest fsgrid indices [i,j,k] of the box
+      :param high:     Fsgrid indices [i,j,k] one past the highest of the box
+      :kwarg operator: Datareduction operator. "pass" does no operation on data
+      :kwarg out:      Preallocated output array (OPTIONAL)
+      :returns: numpy array of shape [high-low] or [high-low, components], with no dimensions squeezed out
+
+      .. code-block:: python
+
+         lowi, upi = f.get_bbox_fsgrid_slicemap(lower_corner, upper_corner)
+         B = f.read_fsgrid_box("fg_b", lowi, np.array(upi)+1)
+
+      .. seealso:: :func:`read_fsgrid_variable` :func:`get_bbox_fsgrid_slicemap`
+      '''
+      return self.read_fsgrid_variable(name, operator=operator, low=low, high=high, out=out)
 
    def read_fg_variable_as_volumetric(self, name, centering=None, operator="pass"):
       fgdata = self.read_fsgrid_variable(name, operator)
@@ -2486,31 +3119,72 @@ class VlsvReader(object):
       '''
 
       # add data to dict, use a tuple of (name,operator) as the key [tuples are immutable and hashable]
-      self.__variable_cache[(name,operator)] = self.read_variable(name, cellids=-1,operator=operator)
+      data = self.read_variable(name, cellids=-1,operator=operator)
+      self.__variable_cache[(name,operator)] = data
       # Also initialize the fileindex dict at the same go because it is very likely something you want to have for accessing cached values
       # self.__read_fileindex_for_cellid()
-      return self.__variable_cache[(name,operator)]
+      return data
 
-   def read_variable(self, name, cellids=-1,operator="pass"):
+   def set_variable_cache_budget(self, max_bytes=None, process_max_bytes=False):
+      ''' Set the memory budget of the in-memory variable cache. Least-recently-used entries
+      are evicted when a budget is exceeded; CellID stays pinned.
+
+      :kwarg max_bytes:         int, byte budget for this reader, None for unbounded. Readers start
+                                with vlsvcache.VariableCache.reader_max_bytes
+      :kwarg process_max_bytes: int, byte budget shared by all readers in the process, None for
+                                unbounded; False (default) leaves the process-wide budget unchanged
+
+      .. seealso:: :func:`get_variable_cache_stats`
+      '''
+      self.__variable_cache.set_budget(max_bytes)
+      if process_max_bytes is not False:
+         vlsvcache.VariableCache.set_process_budget(process_max_bytes)
+
+   def get_variable_cache_stats(self):
+      ''' Returns a dictionary of variable cache statistics: number of entries, bytes held,
+      byte budget and the hit/miss/eviction counters.
+      '''
+      return self.__variable_cache.stats()
+
+   def clear_variable_cache(self):
+      ''' Drop all entries from the in-memory variable cache of this reader.
+      '''
+      self.__variable_cache.clear()
+
+   def read_variable(self, name, cellids=-1,operator="pass", chunk_size=None, out=None, memmap_file=None):
       ''' Read variables from the open vlsv file.
       Arguments:
       :param name: Name of the variable
       :param cellids: a value of -1 reads all data
       :param operator: Datareduction operator. "pass" does no operation on data
-      :returns: numpy array with the data
-
-      .. seealso:: :func:`read` :func:`read_variable_info`
+      :kwarg chunk_size: Evaluate the variable over chunks of this many cells, in file order, to bound
+                         the memory used by data reducers. Only for reads of the whole grid. (OPTIONAL)
+      :kwarg out: Preallocated output array for a read of the whole grid (OPTIONAL)
+      :kwarg memmap_file: Write a read of the whole grid into a new .npy file of this name and return it
+                          as a memory map (OPTIONAL)
+      :returns: numpy array with the data. Masked data reducer results are masked arrays in chunked reads too;
+                their masks are kept apart from out and memmap_file (in <memmap_file>_mask.npy), where
+                masked floating point entries are nan.
+
+      .. seealso:: :func:`read` :func:`read_variable_info` :func:`read_variables`
       '''
       cellids = get_data(cellids)
-      if((name,operator) in self.__variable_cache.keys()):
-         return self.__variable_cache.read_variable_from_cache(self,name,cellids,operator)
-
+      chunked = chunk_size is not None or out is not None or memmap_file is not None
+      if chunked and not (isinstance(cellids, numbers.Number) and cellids == -1):
+         raise ValueError("Chunked reads (chunk_size, out, memmap_file) are only supported for the whole grid (cellids=-1)")
       # Wrapper, check if requesting an fsgrid variable
       if (self.check_variable(name) and (name.lower()[0:3]=="fg_")):
          if not cellids == -1:
             logging.warning( "CellID requests not supported for FSgrid variables! Aborting.")
             return False
-         return self.read_fsgrid_variable(name=name, operator=operator)
+         # fsgrid variables are streamed rank chunk by rank chunk
+         return self.read_fsgrid_variable(name=name, operator=operator, out=out, memmap_file=memmap_file)
+
+      if((name,operator) in self.__variable_cache and not chunked):
+         try:
+            return self.__variable_cache.read_variable_from_cache(self,name,cellids,operator)
+         except vlsvcache.CacheMiss: # Evicted by another thread meanwhile
+            pass
 
       #if(self.check_variable(name) and (name.lower()[0:3]=="ig_")):
       if name.lower()[0:3]=="ig_":
@@ -2523,22 +3197,232 @@ class VlsvReader(object):
       for reader in self.__linked_readers:
          try:
             reader.copy_cellid_indexer_handle(self.FileIndex) # For now we assume linked readers have the same layout, so reuse our indexer.
-            res = reader.read_variable(name=name, cellids=cellids, operator=operator)
+            res = reader.read_variable(name=name, cellids=cellids, operator=operator, chunk_size=chunk_size, out=out, memmap_file=memmap_file)
             logging.debug(self.file_name + ' read_variable ' + name+ ' from ' + reader.file_name + ', result ' + str(res))
             reader.copy_cellid_indexer_handle(None) # Clear the handles from the linked reader, so we don't have dangling references.
             return res
          except:
             pass
 
+      if chunked:
+         return self.__read_variable_chunked(name, operator, chunk_size, out, memmap_file)
+
       # Passes the list of cell id's onwards - optimization for reading is done in the lower level read() method
       return self.read(mesh="SpatialGrid", name=name, tag="VARIABLE", operator=operator, cellids=cellids)
 
-   def read_variable_info(self, name, cellids=-1, operator="pass"):
+   def __read_variable_chunked(self, name, operator, chunk_size, out=None, memmap_file=None):
+      ''' Evaluate a SpatialGrid variable over the whole grid in chunks of contiguous cells, in file order.
+
+      Every chunk is read by :func:`read` with the cellids of the chunk, so data reducers see only
+      chunk-sized inputs and temporaries; the results are written into the output one chunk at a time.
+      Masked results are returned as masked arrays, with the mask kept alongside the output (in a
+      <memmap_file>_mask.npy file next to memmap_file). In out and memmap_file, masked floating point
+      entries are filled with nan.
+      '''
+      entry = self.__footer.find("VARIABLE", "cellid", "SpatialGrid")
+      ncells = int(entry.array_size)
+      if chunk_size is None:
+         chunk_size = ncells
+      chunk_size = max(int(chunk_size), 2)
+      bounds = list(range(0, ncells, chunk_size)) + [ncells]
+      if len(bounds) > 2 and bounds[-1] - bounds[-2] == 1:
+         # read drops the cell dimension of single cells, keep them out of the last chunk
+         del bounds[-2]
+
+      output = out
+      mask = None
+      for start, stop in zip(bounds[:-1], bounds[1:]):
+         chunk_cellids = self.read_cellids_with_offset(start, stop-start)
+         data = self.read(mesh="SpatialGrid", name=name, tag="VARIABLE", operator=operator, cellids=chunk_cellids)
+         if not np.ma.isMaskedArray(data):
+            data = np.asarray(data)
+         data = data.reshape((stop-start,)+np.shape(data)[1 if stop-start > 1 else 0:])
+         if output is None:
+            shape = (ncells,)+data.shape[1:]
+            if memmap_file is not None:
+               output = np.lib.format.open_memmap(memmap_file, mode="w+", dtype=data.dtype, shape=shape)
+            else:
+               output = np.empty(shape, dtype=data.dtype)
+         if np.ma.isMaskedArray(data):
+            if mask is None:
+               # Cells of earlier, unmasked chunks stay unmasked
+               if memmap_file is not None:
+                  mask = np.lib.format.open_memmap(os.path.splitext(memmap_file)[0]+"_mask.npy", mode="w+", dtype=bool, shape=output.shape)
+                  mask[...] = False
+               else:
+                  mask = np.zeros(output.shape, dtype=bool)
+            mask[start:stop,...] = np.ma.getmaskarray(data)
+            if (out is not None or memmap_file is not None) and np.issubdtype(output.dtype, np.floating):
+               data = data.filled(np.nan)
+            else:
+               data = np.ma.getdata(data)
+         output[start:stop,...] = data
+      if mask is not None:
+         return np.ma.array(output, mask=mask, copy=False)
+      return output
+
+   def __variable_graph_node(self, name, cached=True):
+      ''' How :func:`read` resolves a SpatialGrid variable, as a node of a dependency graph.
+
+      :param name: lowercase name of the variable
+      :kwarg cached: Boolean [True], False resolves the variable regardless of the variable cache and the derived store
+      :returns: a tuple (kind, children, reducer, popname) where kind is
+                "read" for data read by :func:`read` as a whole (file arrays, cached or stored data, velocity space reducers),
+                "popsum" for sums over populations,
+                "reducer" for data reducers and
+                "multipop" for data reducers of a single population;
+                children are the names the node is computed from
+      '''
+      if self.__footer.find("VARIABLE", name, "SpatialGrid") is not None:
+         return "read", [], None, None
+      if cached and ((name,"pass") in self.__variable_cache or self.__load_derived(name, "pass")):
+         return "read", [], None, None
+
+      popname, varname = "pop", name
+      if '/' in name and name.split('/')[0] in self.active_populations:
+         popname, varname = name.split('/',1)
+      checkname = 'pop/'+varname if popname != "pop" else varname
+      if checkname in deprecated_datareducers.keys():
+         return "read", [], None, None
+
+      if varname[0:3]=="vg_" or varname[0:3]=="ig_":
+         reducer_reg = v5reducers
+         reducer_multipop = multipopv5reducers
+      else:
+         reducer_reg = datareducers
+         reducer_multipop = multipopdatareducers
+
+      if len(self.active_populations) > 0 and self.check_variable(self.active_populations[0]+'/'+name):
+         self.__init_populations()
+         return "popsum", [pname+'/'+name for pname in self.active_populations], None, None
+
+      if name in reducer_reg:
+         reducer = reducer_reg[name]
+         if reducer.useVspace:
+            return "read", [], reducer, None
+         return "reducer", [i.lower() for i in np.atleast_1d(reducer.variables)], reducer, None
+
+      if 'pop/'+varname in reducer_multipop:
+         reducer = reducer_multipop['pop/'+varname]
+         if reducer.useVspace:
+            return "read", [], reducer, None
+         if popname == "pop":
+            self.__init_populations()
+            return "popsum", [pname+'/'+varname for pname in self.active_populations], reducer, None
+         children = [i.lower() if '/' not in i else popname+'/'+i.split('/',1)[1].lower() for i in np.atleast_1d(reducer.variables)]
+         return "multipop", children, reducer, popname
+
+      # Unknown variables are left for read to report
+      return "read", [], None, None
+
+   def read_variables(self, names, cellids=-1, operators=None):
+      ''' Read several variables from the open vlsv file at once.
+
+      The data reducers of the requested variables are resolved into one dependency graph, so that
+      variables shared between reducers (and between populations) are read or computed only once.
+      The graph is evaluated in dependency order, and intermediate results are released as soon as
+      the last variable computed from them is done.
+
+      .. code-block:: python
+
+         beta, pdyn, temperature = f.read_variables(["vg_beta", "vg_pdyn", "vg_temperature"])
+
+      :param names:     List of variable names
+      :kwarg cellids:   a value of -1 reads all data, as in :func:`read_variable`
+      :kwarg operators: List of datareduction operators, one per variable (OPTIONAL, default "pass")
+      :returns: list of numpy arrays with the data, in the order of names
+
+      .. seealso:: :func:`read_variable` :func:`read`
+      '''
+      names = list(np.atleast_1d(names))
+      if operators is None:
+         operators = ["pass" for i in range(len(names))]
+      if len(operators) != len(names):
+         raise ValueError("read_variables needs one operator per variable")
+      cellids = get_data(cellids)
+      results = [None for i in range(len(names))]
+
+      # Variables that read_variable does not pass on to read, and results in the derived store, are read as such
+      graph_requests = {}
+      for i, (name, operator) in enumerate(zip(names, operators)):
+         lname = name.lower()
+         if ((name,operator) in self.__variable_cache or lname[0:3] in ("fg_", "ig_") or
+               any(reader.check_variable(name) for reader in self.__linked_readers) or
+               (self.__footer.find("VARIABLE", lname, "SpatialGrid") is None and self.__load_derived(lname, operator))):
+            results[i] = self.read_variable(name, cellids=cellids, operator=operator)
+         else:
+            graph_requests.setdefault(lname, []).append((i, operator))
+
+      # Build the dependency graph, with the nodes in topological order
+      nodes = {}
+      order = []
+      def visit(name, path):
+         if name in nodes:
+            return
+         if name in path:
+            raise ValueError("Error: circular data reducer dependency through "+name)
+         nodes[name] = self.__variable_graph_node(name)
+         for child in nodes[name][1]:
+            visit(child, path | {name})
+         order.append(name)
+      for name in graph_requests:
+         visit(name, frozenset())
+
+      consumers = {name: (1 if name in graph_requests else 0) for name in nodes}
+      for name in nodes:
+         for child in set(nodes[name][1]):
+            consumers[child] += 1
+
+      values = {}
+      for name in order:
+         kind, children, reducer, popname = nodes[name]
+         if kind == "read":
+            values[name] = self.read(mesh="SpatialGrid", name=name, tag="VARIABLE", operator="pass", cellids=cellids)
+         else:
+            tmp_vars = [values[child] for child in children]
+            if kind == "popsum":
+               data = data_operators["sum"](tmp_vars)
+            else:
+               if kind == "multipop":
+                  vlsvvariables.activepopulation = popname
+               data = self.__evaluate_reducer(reducer, tmp_vars)
+            values[name] = self.__cache_derived(name, "VARIABLE", "pass", cellids, data)
+            for child in set(children):
+               consumers[child] -= 1
+               if consumers[child] == 0:
+                  del values[child]
+
+         for i, operator in graph_requests.get(name, []):
+            if operator == "pass":
+               results[i] = values[name]
+               continue
+            # As in read: magnitudes of scalars are absolute values
+            entry = self.__footer.find("VARIABLE", name, "SpatialGrid") if kind == "read" else None
+            if kind == "read" and entry is None:
+               results[i] = self.read(mesh="SpatialGrid", name=name, tag="VARIABLE", operator=operator, cellids=cellids)
+               continue
+            vector_size = entry.vector_size if entry is not None else (reducer.vector_size if reducer is not None else None)
+            if vector_size == 1 and operator == "magnitude":
+               operator = "absolute"
+            results[i] = data_operators[operator](values[name])
+            if kind != "read":
+               self.__cache_derived(name, "VARIABLE", operator, cellids, results[i])
+         if name in graph_requests:
+            consumers[name] -= 1
+            if consumers[name] == 0:
+               del values[name]
+
+      return results
+
+   def read_variable_info(self, name, cellids=-1, operator="pass", chunk_size=None, out=None, memmap_file=None):
       ''' Read variables from the open vlsv file and input the data into VariableInfo
 
       :param name: Name of the variable
       :param cellids: a value of -1 reads all data
       :param operator: Datareduction operator. "pass" does no operation on data
+      :kwarg chunk_size: Evaluate the variable in chunks of this many cells, see :func:`read_variable` (OPTIONAL)
+      :kwarg out: Preallocated output array, see :func:`read_variable` (OPTIONAL)
+      :kwarg memmap_file: Write the data into a new .npy memory map, see :func:`read_variable` (OPTIONAL)
       :returns: numpy array with the data
 
       .. seealso:: :func:`read_variable`
@@ -2602,11 +3486,11 @@ class VlsvReader(object):
          latexunits = ""
 
       if name.startswith('fg_'):
-          data = self.read_fsgrid_variable(name=name, operator=operator)
+          data = self.read_fsgrid_variable(name=name, operator=operator, out=out, memmap_file=memmap_file)
       elif name.startswith('ig_'):
           data = self.read_ionosphere_variable(name=name, operator=operator)
       else:
-          data = self.read_variable(name=name, operator=operator, cellids=cellids)
+          data = self.read_variable(name=name, operator=operator, cellids=cellids, chunk_size=chunk_size, out=out, memmap_file=memmap_file)
 
       if operator != "pass":
          if operator=="magnitude":
@@ -2684,6 +3568,42 @@ class VlsvReader(object):
          return wrap
       return wrap_array_inner
 
+   def get_amr_level_tables(self):
+      ''' Per-refinement-level tables of the SpatialGrid ids, computed once per reader
+
+      :returns: a tuple (starts, cells, lengths):
+                starts  - first cellid of each level, with the first id past the finest level appended [levels+1],
+                cells   - number of cells along x, y and z on each level [levels, 3],
+                lengths - cell side lengths on each level [levels, 3]
+      '''
+      tables = self.__amr_tables
+      if tables is None:
+         levels = np.arange(self.get_max_refinement_level()+1, dtype=np.int64)
+         cells = np.array([self.__xcells, self.__ycells, self.__zcells], dtype=np.int64)[np.newaxis,:] * 2**levels[:,np.newaxis]
+         starts = np.concatenate(([1], 1 + np.cumsum(np.prod(cells, axis=1)))).astype(np.int64)
+         lengths = np.array([self.__xmax - self.__xmin, self.__ymax - self.__ymin, self.__zmax - self.__zmin])/cells
+         tables = (starts, cells, lengths)
+         self.__amr_tables = tables
+      return tables
+
+   def get_cell_geometry(self, cellids):
+      ''' Fused conversion of cellids to their refinement levels, indices, centre coordinates and sizes,
+      for large arrays of cellids. Equivalent to get_amr_level, get_cell_indices, get_cell_coordinates
+      and get_cell_dx, with the refinement level looked up once.
+
+      :param cellids:   numpy array of cell ids
+      :returns: a tuple of numpy arrays (levels [n], indices [n,3], coordinates [n,3], dx [n,3])
+
+      .. seealso:: :func:`get_amr_level_tables`
+      '''
+      cellids = np.atleast_1d(np.asarray(cellids)).astype(np.int64)
+      starts, cells, lengths = self.get_amr_level_tables()
+      levels = np.searchsorted(starts, cellids, side="right") - 1
+      indices = self.get_cell_indices(cellids, levels)
+      coordinates = np.array([self.__xmin,self.__ymin,self.__zmin]) + (indices + 0.5)*lengths[levels]
+      dx = np.array([[self.__dx,self.__dy,self.__dz]])/2.0**np.maximum(levels, 0)[:,np.newaxis]
+      return levels, indices, coordinates, dx
+
    @wrap_array(dimensions=1)
    def get_amr_level(self,cellid):
       '''Returns the AMR level of a given cell defined by its cellid
@@ -2691,19 +3611,9 @@ class VlsvReader(object):
       :param cellid:        The cell's cellid
       :returns:             The cell's refinement level in the AMR
       '''
-      AMR_count = np.zeros(np.array(cellid).shape, dtype=np.int64)
-      cellids = cellid.astype(np.int64)
-      iters = 0
-      while np.any(cellids > 0):
-         mask = cellids > 0
-         sub = 2**(3*AMR_count)*(self.__xcells*self.__ycells*self.__zcells)
-         np.subtract(cellids, sub.astype(np.int64), out = cellids, where = mask)
-         np.add(AMR_count, 1, out = AMR_count, where = mask)
-         iters = iters+1
-         if(iters > self.get_max_refinement_level()+1):
-            logging.info("Can't have that large refinements. Something broke.")
-            break
-      return AMR_count-1
+      starts = self.get_amr_level_tables()[0]
+      # Ids below 1 get level -1, ids past the finest level get max_refinement_level+1
+      return np.searchsorted(starts, cellid.astype(np.int64), side="right") - 1
 
    @wrap_array(dimensions=1)
    def get_cell_dx(self, cellid):
@@ -2716,13 +3626,9 @@ class VlsvReader(object):
 
       dxs = np.array([[self.__dx,self.__dy,self.__dz]])
 
-      dxs = dxs.repeat(cellid.shape[0], axis=0)
-
-      amrs = np.array([self.get_amr_level(cellid)]).transpose()
-      amrs = amrs.repeat(3,axis=1)
-      amrs[amrs < 0] = 0
+      amrs = np.maximum(self.get_amr_level(cellid), 0)[:,np.newaxis]
 
-      ret = dxs/2**amrs
+      ret = dxs/2.0**amrs
       return ret
 
    def get_cell_bbox(self, cellid):
@@ -2752,9 +3658,12 @@ class VlsvReader(object):
 
    def get_cell_fsgrid_subarray(self, cellid, array):
       '''Returns a subarray of the fsgrid array, corresponding to the fsgrid
-      covered by the SpatialGrid cellid.
+      covered by the SpatialGrid cellid. If array is a variable name, only the
+      subarray is read from the file.
       '''
       lowi, upi = self.get_cell_fsgrid_slicemap(cellid)
+      if isinstance(array, str):
+         return self.read_fsgrid_box(array, lowi, np.array(upi)+1)
       fssize=list(self.get_fsgrid_mesh_size())
       if 1 in fssize:
          #expand to have a singleton dimension for a reduced dim - lets slicing happen with ease
@@ -2770,8 +3679,11 @@ class VlsvReader(object):
 
    def get_bbox_fsgrid_subarray(self, low, up, array):
       '''Returns a subarray of the fsgrid array, corresponding to the (low, up) bounding box.
+      If array is a variable name, only the subarray is read from the file.
       '''
       lowi, upi = self.get_bbox_fsgrid_slicemap(low,up)
+      if isinstance(array, str):
+         return self.read_fsgrid_box(array, lowi, np.array(upi)+1)
       fssize=list(self.get_fsgrid_mesh_size())
       if 1 in fssize:
          #expand to have a singleton dimension for a reduced dim - lets slicing happen with ease
@@ -2789,9 +3701,12 @@ class VlsvReader(object):
 
    def downsample_fsgrid_subarray(self, cellid, array):
       '''Returns a mean value of fsgrid values underlying the SpatialGrid cellid.
+      If array is a variable name, only the values under the cell are read from the file.
       '''
       fsarr = self.get_cell_fsgrid_subarray(cellid, array)
+      return self.__fsgrid_cell_mean(cellid, fsarr)
 
+   def __fsgrid_cell_mean(self, cellid, fsarr):
       n = fsarr.size
       if fsarr.ndim == 4:
          n = n/3
@@ -2810,19 +3725,15 @@ class VlsvReader(object):
       '''
       cellIds=self.read_variable("CellID")
 
-      self.map_vg_onto_fg()
-      counts = np.bincount(np.reshape(self.__vg_indexes_on_fg, self.__vg_indexes_on_fg.size))
-      if array.ndim == 4:
-         numel = array.shape[3]
-         vgarr = np.zeros((len(cellIds),numel))
-         reshaped_mapping = np.reshape(self.__vg_indexes_on_fg,self.__vg_indexes_on_fg.size)
-         for i in range(numel):
-            wgts = np.reshape(array[:,:,:,i],array[:,:,:,i].size)
-            sums = np.bincount(reshaped_mapping, weights=wgts)
-            vgarr[:,i] = np.divide(sums,counts)
-      else:
-         sums = np.bincount(np.reshape(self.__vg_indexes_on_fg, self.__vg_indexes_on_fg.size), weights=np.reshape(array,array.size))
-         vgarr = np.divide(sums,counts)
+      vgarr = np.zeros((len(cellIds),)+array.shape[3:])
+      # Averages over the blocks of each level, pooled from the finest level up
+      pooled, pooled_block = array, np.ones(3, dtype=np.int64)
+      for level, block, blocks, vg_indexes in sorted(self.map_vg_onto_fg_levels(), key=lambda entry: -entry[0]):
+         factor = block // pooled_block
+         if np.any(factor > 1):
+            pooled = fg_block_view(pooled, factor).mean(axis=(1,3,5), dtype=np.float64)
+            pooled_block = block
+         vgarr[vg_indexes] = pooled[blocks[:,0], blocks[:,1], blocks[:,2]]
       return vgarr
 
    def vg_uniform_grid_process(self, variable, expr, exprtuple):
@@ -2857,18 +3768,26 @@ class VlsvReader(object):
       array.squeeze()
       return
 
-   def read_variable_as_fg(self, var, operator='pass'):
-      vg_cellids = self.read_variable('CellID')
-      sz = self.get_fsgrid_mesh_size()
-      sz_amr = self.get_spatial_mesh_size()
-      vg_var = self.read_variable(var, operator=operator)
-      varsize = vg_var[0].size
-      if(varsize > 1):
-         fg_var = np.zeros([sz[0], sz[1], sz[2], varsize], dtype=vg_var.dtype)
+   def read_variable_as_fg(self, var, operator='pass', memmap_file=None):
+      ''' Read a SpatialGrid variable upsampled onto the fsgrid: every fsgrid cell gets the value of
+      the vg cell covering it.
+
+      :param var:         Name of the variable
+      :kwarg operator:    Datareduction operator. "pass" does no operation on data
+      :kwarg memmap_file: If given, the result is written into a new .npy file of this name and returned as a memory map
+      :returns: numpy array [nx,ny,nz] or [nx,ny,nz,components] on the fsgrid
+
+      .. seealso:: :func:`map_vg_onto_fg_levels`
+      '''
+      sz = tuple(int(n) for n in self.get_fsgrid_mesh_size())
+      vg_var = np.asarray(self.read_variable(var, operator=operator))
+      shape = sz + vg_var.shape[1:]
+      if memmap_file is None:
+         fg_var = np.zeros(shape, dtype=vg_var.dtype)
       else:
-         fg_var = np.zeros(sz, dtype=vg_var.dtype)
-      self.map_vg_onto_fg()
-      fg_var = vg_var[self.__vg_indexes_on_fg]
+         fg_var = np.lib.format.open_memmap(memmap_file, mode="w+", dtype=vg_var.dtype, shape=shape)
+      for level, block, blocks, vg_indexes in self.map_vg_onto_fg_levels():
+         fg_block_view(fg_var, block)[blocks[:,0],:,blocks[:,1],:,blocks[:,2],:] = vg_var[vg_indexes][(slice(None),)+(np.newaxis,)*3]
       return fg_var
 
 
@@ -2878,22 +3797,67 @@ class VlsvReader(object):
    # vg_overlaying_CellID_at_ijk = self.read_variable('CellID')[self.__vg_indexes_on_fg[i,j,k]]
    # or, for all fsgrid cells:
    # vg_CellIDs_on_fg = self.read_variable('CellID')[self.__vg_indexes_on_fg]
-   def map_vg_onto_fg(self):
-      if(len(self.__vg_indexes_on_fg)==0):
-         vg_cellids = self.read_variable('CellID')
-         sz = self.get_fsgrid_mesh_size()
-         sz_amr = self.get_spatial_mesh_size()
-         max_amr_level = int(np.log2(sz[0] / sz_amr[0]))
-         self.__vg_indexes_on_fg = np.zeros(sz, dtype=np.int64) + 1000000000 # big number to catch errors in the latter code, 0 is not good for that
-         amr_levels = self.get_amr_level(vg_cellids)
-         cell_indices = np.array(self.get_cell_indices(vg_cellids,amr_levels),dtype=np.int64)
-         refined_ids_start = np.array(cell_indices * 2**(max_amr_level-amr_levels[:,np.newaxis]), dtype=np.int64)
-         refined_ids_end = np.array(refined_ids_start + 2**(max_amr_level-amr_levels[:,np.newaxis]), dtype=np.int64)
-
-         self.__vg_indexes_on_fg = map_vg_onto_fg_loop(self.__vg_indexes_on_fg,vg_cellids, refined_ids_start, refined_ids_end)
+   # The map is shared with other readers of the same layout, SEE: get_mesh_layout
+   def map_vg_onto_fg(self, memmap_file=None):
+      ''' Array of fsgrid size holding, for each fsgrid cell, the index of the vg cell covering it in the
+      file order arrays of SpatialGrid variables. Cells not covered hold 1000000000.
+
+      :kwarg memmap_file: If given, the map is written into a new .npy file of this name and returned as a memory map,
+                          instead of being kept (and shared) in memory.
+      :returns: numpy array of int64 [nx,ny,nz]
 
+      .. seealso:: :func:`map_vg_onto_fg_levels` for a compact form
+      '''
+      sz = tuple(int(n) for n in self.get_fsgrid_mesh_size())
+      if memmap_file is not None:
+         return self.__fill_vg_indexes_on_fg(np.lib.format.open_memmap(memmap_file, mode="w+", dtype=np.int64, shape=sz))
+      if(len(self.__vg_indexes_on_fg)==0):
+         self.__vg_indexes_on_fg = self.get_mesh_layout().get(("vg_indexes_on_fg",)+sz, lambda: self.__fill_vg_indexes_on_fg(np.empty(sz, dtype=np.int64)))
       return self.__vg_indexes_on_fg
 
+   def __fill_vg_indexes_on_fg(self, vg_indexes_on_fg):
+      vg_indexes_on_fg[...] = 1000000000 # big number to catch errors in the latter code, 0 is not good for that
+      for level, block, blocks, vg_indexes in self.map_vg_onto_fg_levels():
+         fg_block_view(vg_indexes_on_fg, block)[blocks[:,0],:,blocks[:,1],:,blocks[:,2],:] = vg_indexes[:,np.newaxis,np.newaxis,np.newaxis]
+      if not isinstance(vg_indexes_on_fg, np.memmap):
+         vg_indexes_on_fg.flags.writeable = False
+      return vg_indexes_on_fg
+
+   def map_vg_onto_fg_levels(self):
+      ''' Compact form of :func:`map_vg_onto_fg`: the vg cells of each refinement level as blocks of fsgrid cells.
+
+      :returns: list of tuples (level, block, blocks, vg_indexes), one per refinement level present, where
+                block      - number of fsgrid cells covered by one vg cell of the level along each axis [3],
+                blocks     - indices of the cells in units of block, so that a cell covers
+                             fsgrid[i*bx:(i+1)*bx, j*by:(j+1)*by, k*bz:(k+1)*bz] [n,3],
+                vg_indexes - indices of the cells in the file order arrays of SpatialGrid variables [n]
+
+      .. seealso:: :func:`fg_block_view`
+      '''
+      sz = tuple(int(n) for n in self.get_fsgrid_mesh_size())
+      return self.get_mesh_layout().get(("vg_indexes_on_fg_levels",)+sz, self.__build_vg_indexes_on_fg_levels)
+
+   def __build_vg_indexes_on_fg_levels(self):
+      vg_cellids = self.read_variable('CellID')
+      sz = self.get_fsgrid_mesh_size()
+      sz_amr = self.get_spatial_mesh_size()
+      max_amr_level = int(np.log2(sz[0] / sz_amr[0]))
+      amr_levels, cell_indices = self.get_cell_geometry(vg_cellids)[0:2]
+      levels = []
+      for level in np.unique(amr_levels):
+         vg_indexes = np.nonzero(amr_levels == level)[0]
+         span = 2**(max_amr_level-level)
+         # Collapsed (2D) dimensions hold a single fsgrid cell, covered by the cells at index 0
+         block = np.minimum(span, sz).astype(np.int64)
+         starts = cell_indices[vg_indexes]*span
+         inside = np.all(starts < sz, axis=1)
+         blocks = starts[inside] // block
+         vg_indexes = vg_indexes[inside]
+         blocks.flags.writeable = False
+         vg_indexes.flags.writeable = False
+         levels.append((int(level), block, blocks, vg_indexes))
+      return levels
+
    def get_cell_fsgrid(self, cellid):
       '''Returns a slice tuple of fsgrid indices that are contained in the SpatialGrid
       cell.
@@ -3026,60 +3990,34 @@ class VlsvReader(object):
 
       cellids = np.zeros((coordinates.shape[0]), dtype=np.int64)
 
-      # mask for cells that are unresolved - out-of-bounds coordinates stay at zero
+      # mask for coordinates inside the domain - out-of-bounds coordinates stay at zero
       mask = (
                (self.__xmax > coordinates[:,0]) & (self.__xmin < coordinates[:,0]) &
                (self.__ymax > coordinates[:,1]) & (self.__ymin < coordinates[:,1]) &
                (self.__zmax > coordinates[:,2]) & (self.__zmin < coordinates[:,2])
       )
 
-      # Get cell lengths:
-      cell_lengths = np.array([self.__dx, self.__dy, self.__dz])
-
-      cellindices = np.zeros(coordinates.shape, dtype=np.int64)
-
-
-
-      # Get cell indices:
-      cellindices[mask,0] = (coordinates[mask,0] - self.__xmin)/cell_lengths[0]
-      cellindices[mask,1] = (coordinates[mask,1] - self.__ymin)/cell_lengths[1]
-      cellindices[mask,2] = (coordinates[mask,2] - self.__zmin)/cell_lengths[2]
-      # Get the cell id:
-      cellids[mask] = cellindices[mask,0] + cellindices[mask,1] * self.__xcells + cellindices[mask,2] * self.__xcells * self.__ycells + 1
-
-      # Going through AMR levels as needed
-      AMR_count = 0
-      ncells_lowerlevel = 0
-      refmax = self.get_max_refinement_level()
-
-
-      while AMR_count < refmax +1:
-         # drop = ~dict_keys_exist(self.__fileindex_for_cellid, cellids[mask])
-         drop = ~self.query_cellid_exists(cellids[mask])
-
-         mask[mask] = mask[mask] & drop
-
-         ncells_lowerlevel += 2**(3*AMR_count)*(self.__xcells*self.__ycells*self.__zcells) # Increment of cellID from lower lvl
-         AMR_count += 1
-         # Get cell lengths:
-         cell_lengths = np.array([self.__dx, self.__dy, self.__dz]) / 2**AMR_count # Check next AMR level
-
-         # Get cell indices:
-         cellindices[mask,0] = (coordinates[mask,0] - self.__xmin)/cell_lengths[0]
-         cellindices[mask,1] = (coordinates[mask,1] - self.__ymin)/cell_lengths[1]
-         cellindices[mask,2] = (coordinates[mask,2] - self.__zmin)/cell_lengths[2]
-         # Get the cell id:
-         cellids[mask] = ncells_lowerlevel + cellindices[mask,0] + 2**(AMR_count)*cellindices[mask,1] * self.__xcells + 4**(AMR_count) * cellindices[mask,2] * self.__xcells * self.__ycells + 1
-
-      # drop = ~dict_keys_exist(self.__fileindex_for_cellid, cellids[mask])
-      drop = ~self.query_cellid_exists(cellids[mask])
-      mask[mask] = mask[mask] & drop
-      cellids[mask] = 0 # set missing cells to null cell
+      cellids[mask] = self.get_cellid_octree().lookup(coordinates[mask,:])
       if stack:
          return cellids
       else:
          return cellids[0]
 
+   @synchronized
+   def get_cellid_octree(self):
+      ''' Spatial index of the SpatialGrid cells, used by :func:`get_cellid`. Built once, and shared
+      with other readers in the process whose mesh is identical (SEE: :func:`get_mesh_geometry`).
+
+      :returns: a :class:`vlsvcache.CellIDOctree`
+      '''
+      if self.__cellid_octree is None:
+         self.__cellid_octree = self.get_mesh_geometry().get("octree", self.__build_cellid_octree)
+      return self.__cellid_octree
+
+   def __build_cellid_octree(self):
+      starts, cells, lengths = self.get_amr_level_tables()
+      return vlsvcache.CellIDOctree(self.get_cellid_ordering()[0], starts, cells, lengths, self.get_spatial_mesh_extent()[0:3])
+
    def get_cellid_with_vdf(self, coords, pop = 'proton'):
       ''' Returns the cell ids nearest to test points, that contain VDFs
 
@@ -3096,7 +4034,7 @@ class VlsvReader(object):
          coords_in = np.atleast_2d(coords_in)
          stack = False
 
-      if not pop in self.__cells_with_blocks:
+      if not pop in self.__cells_with_blocks_ordered:
          self.__set_cell_offset_and_blocks_nodict(pop)
       cid_w_vdf = self.__cells_with_blocks[pop]
       coords_w_vdf = self.get_cell_coordinates(cid_w_vdf)
@@ -3108,7 +4046,7 @@ class VlsvReader(object):
 
       # Boolean array flag_empty_in indicates if queried points (coords_in) don't already lie within vdf-containing cells,
       output = self.get_cellid(coords_in)
-      flag_empty_in = np.array( [cid not in self.__order_for_cellid_blocks[pop] for cid in output] )
+      flag_empty_in = ~self.cellids_have_vdf(output, pop)
       N_empty_in = sum(flag_empty_in)
 
       if N_empty_in == 0:   # every element of coords_in already within a vdf-containing cell
@@ -3145,9 +4083,7 @@ class VlsvReader(object):
       :param coords:    the cellid to test for
       :returns: bool
       '''
-      self.__set_cell_offset_and_blocks_nodict(pop)
-      cid_w_vdf = self.__cells_with_blocks[pop]
-      return cid in cid_w_vdf
+      return bool(self.cellids_have_vdf(cid, pop)[0])
 
    def get_vertex_indices(self, coordinates):
       ''' Get dual grid vertex indices for all coordinates.
@@ -3197,139 +4133,184 @@ class VlsvReader(object):
       else:
          return crds[0,:]
 
+   def get_vertex_codes(self, indices):
+      ''' Encode dual grid vertex indices into single integers, as used to key the dual mesh.
+
+      :param indices: numpy array of vertex indices, (3,) or (...,3)
+      :returns: numpy array of int64 vertex codes, with the shape of indices without the last dimension
+      '''
+      nvertices = self.get_amr_level_tables()[1][-1] + 1
+      indices = np.asarray(indices, dtype=np.int64)
+      return indices[...,0] + nvertices[0]*(indices[...,1] + nvertices[1]*indices[...,2])
+
+   def get_vertex_indices_from_codes(self, codes):
+      ''' Decode vertex codes into dual grid vertex indices.
+
+      :param codes: numpy array of vertex codes, see :func:`get_vertex_codes`
+      :returns: numpy array of vertex indices, with a trailing dimension of 3
+      '''
+      nvertices = self.get_amr_level_tables()[1][-1] + 1
+      rest, i = np.divmod(np.asarray(codes, dtype=np.int64), nvertices[0])
+      k, j = np.divmod(rest, nvertices[1])
+      return np.stack((i,j,k), axis=-1)
+
    # this should then do the proper search instead of intp for in which dual of the cell the point lies
    def get_dual(self, pts, cellids=None):
       ''' Find the duals that contain the coordinate points pts. This will call the iterative find_ksi function
-      to see if the resulting interpolation weights for the coordinate are in the range [0,1]; if not, it will iterate
-      through neighbouring duals until a dual is found.
+      to see if the resulting interpolation weights for the coordinate are in the range [0,1], for all the
+      duals of the vertices of the containing cell whose bounding box contains the point. The first dual found is used.
       :parameter pts: numpy array of coordinates (N,3)
+      :parameter cellids: numpy array of the cellids containing pts (N,), found with get_cellid if None
+
+      :returns: duals (numpy array of vertex indices (N,3), -1 where no dual was found), ksis (numpy array of trilinear coordinates (N, 3))
 
-      :returns: duals (numpy array of N 3-tuples), ksis (numpy array of interpolation weights (N, 8))
+      .. seealso:: :func:`get_dual_cells`
       '''
 
       from analysator.calculations.interpolator_amr import find_ksi
 
+      pts = np.atleast_2d(pts)
       # start the search from the vertices
       if cellids is None:
-         cid = self.get_cellid(np.atleast_2d(pts))
+         cid = self.get_cellid(pts)
       else:
          cid = cellids
-
-      self.build_cell_vertices(np.atleast_1d(cid),prune_unique=True)
-
-      vverts = [self.__cell_vertices[c] for c in cid]
-      set_of_verts = set()
-      # Loops over duals indexed by vertex tuple
-      self.build_dual_from_vertices(list(set_of_verts.union(*vverts)))
-
-      for i,verts in enumerate(vverts):
-         bboxes = np.array(itemgetter(*verts)(self.__dual_bboxes))
-         vmask = np.all(pts[i,:] >= bboxes[:,0:3],axis=1) & np.all(pts[i,:] <= bboxes[:,3:6],axis=1)
-         okverts = [verts[ind] for ind, val in enumerate(vmask) if val]
-         vverts[i] = okverts
+      cid = np.atleast_1d(cid).astype(np.int64)
+
+      ksis = np.full(pts.shape, np.nan)
+      duals = np.full(pts.shape, -1, dtype=np.int64)
+
+      # Candidate (point, vertex) pairs from the vertices of each containing cell
+      inside_domain = np.nonzero(cid != 0)[0]
+      cells, cell_of_point = np.unique(cid[inside_domain], return_inverse=True)
+      indptr, vertices = csr_take(*self.build_cell_vertices_csr(cells), cell_of_point)
+      pinds = np.repeat(inside_domain, np.diff(indptr))
+      codes, vinds = np.unique(vertices, return_inverse=True)
+      dual_cells, dual_bboxes = self.__build_duals_of_vertices(codes)
+
+      bboxes = dual_bboxes[vinds]
+      vmask = np.all(pts[pinds,:] >= bboxes[:,0:3],axis=1) & np.all(pts[pinds,:] <= bboxes[:,3:6],axis=1)
+      pinds = pinds[vmask]
+      vinds = vinds[vmask]
+      if len(pinds) == 0:
+         return duals, ksis
 
       # Breaks degeneracies by expanding the dual cells vertices along
       #  main-grid diagonals
       offset_eps = 1.0
-      offsets = np.array([[-1.0, -1.0, -1.0],
-                           [-1.0, -1.0,  1.0],
-                           [-1.0,  1.0, -1.0],
-                           [-1.0,  1.0,  1.0],
-                           [ 1.0, -1.0, -1.0],
-                           [ 1.0, -1.0,  1.0],
-                           [ 1.0,  1.0, -1.0],
-                           [ 1.0,  1.0,  1.0],
-                        ]) * offset_eps
-
-      verts_per_pt = [len(verts) for verts in vverts]
-      ppts = pts.repeat(verts_per_pt, axis=0)
-      pinds = np.indices((pts.shape[0],)).repeat(verts_per_pt)
-
-      all_verts = [v for vs in vverts for v in vs]
-
-      all_vcoords = self.get_cell_coordinates(np.array(itemgetter(*all_verts)(self.__dual_cells))[np.newaxis,:].reshape(-1))
+      offsets = (2*dual_corner_offsets - 1) * offset_eps
 
+      all_vcoords = self.get_cell_coordinates(dual_cells[vinds].reshape(-1))
       all_vcoords = offsets[np.newaxis,:,:]+all_vcoords.reshape(-1,8,3)
-      all_vksis = find_ksi(ppts, all_vcoords)
+      all_vksis = find_ksi(pts[pinds,:], all_vcoords)
 
       foundmask = np.all(all_vksis <=1, axis=1) & np.all(all_vksis >= 0, axis=1)
 
       ind = np.nonzero(foundmask)[0]
-      all_vksis = all_vksis[ind,:]
+      found_pts, inds = np.unique(pinds[ind], return_index = True)
 
-      found_pts = pinds[ind]
-      found_pts, inds = np.unique(found_pts, return_index = True)
+      ksis[found_pts,:] = all_vksis[ind[inds],:]
+      duals[found_pts,:] = self.get_vertex_indices_from_codes(codes[vinds[ind[inds]]])
 
+      return duals, ksis
 
+   def get_dual_cells(self, duals):
+      ''' The cellids at the corners of dual cells, building the duals if needed.
 
-      ksis = np.full_like(pts, np.nan)
-      duals = np.empty((pts.shape[0],),dtype="i,i,i")
-      duals[:] = (0,0,0)
-      dduals = np.array(np.array(all_verts,dtype="i,i,i")[ind], dtype="i,i,i")
-
-      ksis[found_pts,:] = all_vksis[inds,:]
-      duals[found_pts] = dduals[inds]
-
-      return duals.astype(object), ksis
+      :parameter duals: numpy array of vertex indices (N,3), as returned by get_dual; rows of -1 stand for no dual
+      :returns: numpy array of cellids (N,8), corners ordered with x varying slowest and z fastest; zeros for no dual
+      '''
+      duals = np.atleast_2d(duals)
+      cells = np.zeros((duals.shape[0], 8), dtype=np.int64)
+      valid = np.all(duals >= 0, axis=1)
+      if np.any(valid):
+         codes, inverse = np.unique(self.get_vertex_codes(duals[valid]), return_inverse=True)
+         cells[valid,:] = self.__build_duals_of_vertices(codes)[0][inverse]
+      return cells
+
+   @synchronized
+   def build_cell_vertices_csr(self, cid):
+      ''' Builds and caches the vertices that lie on the surfaces of CellIDs cid: the 8 corners, followed by
+      the hanging nodes of finer neighbours.
+
+      :parameter cid: numpy array of CellIDs, without zeros
+      :returns: the vertex codes of each cell in compressed sparse row form: indptr (len(cid)+1,) and codes
+
+      .. seealso:: :func:`get_vertex_codes`
+      '''
+      cid = np.atleast_1d(cid).astype(np.int64)
+      self.load_neighbor_stencils_from_filecache()
+      mask = ~self.__get_dual_mesh().cell_vertices.contains(cid)
+
+      if np.any(mask):
+         new_cells = np.unique(cid[mask])
+         ncells = len(new_cells)
+         corners = self.__build_cell_corner_codes(new_cells)
+         neighbor_indptr, neighbors = self.build_cell_neighborhoods_csr(new_cells)
+
+         # Possible hanging nodes are the corners of the neighbours (finer ones, in practice) that lie
+         # within the bounds of the cell, but are not its corners
+         rows = np.repeat(np.repeat(np.arange(ncells), np.diff(neighbor_indptr)), 8)
+         candidates = self.__build_cell_corner_codes(neighbors).reshape(-1)
+         corner_indices = self.get_vertex_indices_from_codes(corners)
+         candidate_indices = self.get_vertex_indices_from_codes(candidates)
+         hanging = (np.all(candidate_indices >= np.min(corner_indices, axis=1)[rows], axis=1) &
+                    np.all(candidate_indices <= np.max(corner_indices, axis=1)[rows], axis=1) &
+                    ~np.any(candidates[:,np.newaxis] == corners[rows], axis=1))
+         rows = rows[hanging]
+         candidates = candidates[hanging]
+         order = np.lexsort((candidates, rows))
+         rows = rows[order]
+         candidates = candidates[order]
+         first = np.ones(len(rows), dtype=bool)
+         first[1:] = (rows[1:] != rows[:-1]) | (candidates[1:] != candidates[:-1])
+         rows = rows[first]
+         candidates = candidates[first]
+
+         nhanging = np.bincount(rows, minlength=ncells)
+         indptr = np.zeros(ncells+1, dtype=np.int64)
+         np.cumsum(8 + nhanging, out=indptr[1:])
+         codes = np.empty(indptr[-1], dtype=np.int64)
+         codes[(indptr[:-1,np.newaxis] + np.arange(8)).reshape(-1)] = corners.reshape(-1)
+         hanging_starts = np.cumsum(nhanging) - nhanging
+         codes[indptr[rows] + 8 + np.arange(len(rows)) - hanging_starts[rows]] = candidates
+         self.__get_dual_mesh().cell_vertices.insert(new_cells, indptr, codes)
+
+      return self.__get_dual_mesh().cell_vertices.get(cid)
 
-   # For now, combined caching accessor and builder
    def build_cell_vertices(self, cid, prune_unique=False):
       ''' Builds, caches and returns the vertices that lie on the surfaces of CellIDs cid.
 
       :parameter cid: numpy array of CellIDs
-      :parameter prune_unique: bool [False], if you suspect you might be calling the function many times with the
-                               same CellID in the list, it might be beneficial to enable this and not repeat the operation for duplicate entries.
+      :parameter prune_unique: bool [False], kept for compatibility; duplicate entries are always built once.
 
-      :returns: Dictionary of cell c (int) : set of vertex indices (3-tuple) that touch the cell c.
+      :returns: Dictionary of cell c (int) : tuple of vertex indices (3-tuples) that touch the cell c, corners first.
 
+      .. seealso:: :func:`build_cell_vertices_csr`
       '''
-      if prune_unique:
-         cid = np.unique(cid)
-
-      mask = ~dict_keys_exist(self.__cell_vertices,cid,prune_unique=False)
-      # {cid : 8-tuple of vertex_inds}
-
-      cell_neighbors = self.build_cell_neighborhoods(cid[mask])
-      corner_vertices = self.get_cell_corner_vertices(cid[mask])
-
-      levels = self.get_amr_level(cid[mask])
-
-      # find irregular cells
-      # irregular_mask = np.array([np.any(levels[i] != self.get_amr_level(np.array(list(cell_neighbors[c])))) for i,c in enumerate(cid[mask])],dtype=bool)
-      mask[mask] = mask[mask] #& irregular_mask # beautiful
-
-      cell_hanging_nodes = {c: () for c in cid[mask]}
-
-      if(len(cid[mask])==1):
-         self.get_cell_corner_vertices(np.array(list(set().union(itemgetter(*cid[mask])(cell_neighbors)))))
-      elif(len(cid[mask])>=1):
-         self.get_cell_corner_vertices(np.array(list(set().union(*itemgetter(*cid[mask])(cell_neighbors)))))
-      # Loop over all the irregular cells (with finer neighbours) that may have hanging nodes
-      # for i,c in enumerate(irregular_cells):
-      for i,c in enumerate(cid[mask]):
-         corners = np.array(self.__cell_corner_vertices[c], dtype=np.int64)
-         # finer_neighbors = [n for n in cell_neighbors[c] if self.get_amr_level(n) > levels[i]]
-         hanging_set = set()
-         # ncorners = self.get_cell_corner_vertices(np.array(finer_neighbors))
-         ncorners = itemgetter(*cell_neighbors[c])(self.__cell_corner_vertices) #self.get_cell_corner_vertices(np.array(list(cell_neighbors[c])))
-
-         # Possible hanging nodes are those that are the vertices of finer neighbours.
-         for vertex_inds_set in ncorners:#.values():
-            hanging_set.update(set(vertex_inds_set) - set(corner_vertices[c])) # no need to add current corners
-
-         cmin = np.min(corners,axis=0)
-         cmax = np.max(corners,axis=0)
-
-         pruned_hangers = {v for v in hanging_set if np.all(np.array(v,dtype=np.int64) <= cmax) and np.all(np.array(v,dtype=np.int64) >= cmin)}
-         cell_hanging_nodes[c] = tuple(pruned_hangers)
-
-      vertices = {c: corner_vertices[c]+cell_hanging_nodes[c] for c in cid[mask]}
-      self.__cell_vertices.update(vertices)
+      cid = np.unique(np.atleast_1d(cid).astype(np.int64))
+      indptr, codes = self.build_cell_vertices_csr(cid)
+      indices = [tuple(v) for v in self.get_vertex_indices_from_codes(codes).tolist()]
+      return {c: tuple(indices[indptr[i]:indptr[i+1]]) for i, c in enumerate(cid.tolist())}
+
+   @synchronized
+   def __build_cell_corner_codes(self, cids):
+      ''' Builds, caches and returns the vertex codes of the 8 corners of CellIDs cids, as an array (len(cids), 8).
+      '''
+      cids = np.atleast_1d(cids).astype(np.int64)
+      found, (codes,) = self.__get_dual_mesh().cell_corner_vertices.get(cids)
 
-      for c in cid[~mask]:
-         vertices[c] = self.__cell_vertices[c]
+      if not np.all(found):
+         new_cells, inverse = np.unique(cids[~found], return_inverse=True)
+         levels, indices, coordinates, dx = self.get_cell_geometry(new_cells)
+         # The corners of a cell of level l are 2**(maxlevel-l) finest-level vertices apart
+         span = (2**(self.get_max_refinement_level() - np.maximum(levels,0)))[:,np.newaxis,np.newaxis]
+         vertices = indices[:,np.newaxis,:]*span + dual_corner_offsets[np.newaxis,:,:]*span
+         new_codes = self.get_vertex_codes(vertices)
+         self.__get_dual_mesh().cell_corner_vertices.insert(new_cells, new_codes)
+         codes[~found] = new_codes[inverse]
 
-      return vertices
+      return codes
 
    def get_cell_corner_vertices(self, cids):
       ''' Builds, caches and returns the vertices that lie on the corners of CellIDs cid.
@@ -3338,116 +4319,80 @@ class VlsvReader(object):
       :returns: Dictionary of cell c (int) : 8-tuple of vertex indices (3-tuples).
 
       '''
-
-      mask = ~dict_keys_exist(self.__cell_corner_vertices,cids,prune_unique=False)
-
-      cell_vertex_sets = {}
-
-      if(len(cids[mask]) > 0):
-         coords = self.get_cell_coordinates(cids[mask])
-         vertices = np.zeros((len(cids[mask]), 8, 3),dtype=int)
-
-         ii = 0
-         for x in [-1,1]:
-            for y in [-1,1]:
-               for z  in [-1,1]:
-                  vertices[:,ii,:] = np.array(self.get_vertex_indices(coords + np.array((x,y,z))[np.newaxis,:]*self.get_cell_dx(cids[mask])/2))
-                  ii += 1
-
-         for i, c in enumerate(cids[mask]):
-            vlist = vertices[i,:,:]
-            vtuple = tuple([tuple(inds) for inds in vlist])
-            cell_vertex_sets[c] = vtuple
-
-         self.__cell_corner_vertices.update(cell_vertex_sets)
-
-      for c in cids[~mask]:
-         cell_vertex_sets[c] = self.__cell_corner_vertices[c]
-
-      return cell_vertex_sets
-
+      cids = np.atleast_1d(cids).astype(np.int64)
+      indices = self.get_vertex_indices_from_codes(self.__build_cell_corner_codes(cids))
+      return {c: tuple(tuple(v) for v in vertices) for c, vertices in zip(cids.tolist(), indices.tolist())}
 
    # again, combined getter and builder..
-   def build_cell_neighborhoods(self, cids):
-
-      mask = ~dict_keys_exist(self.__cell_neighbours, cids, prune_unique=False)
-
-      cell_neighbor_sets = {}
-
-      if len(cids[mask]) > 0:
-         cell_vertex_sets = self.get_cell_corner_vertices(cids[mask]) # these are enough to fetch the neighbours
-         cell_neighbor_sets = {c: set() for c in cell_vertex_sets.keys()}
-         vertices_todo = set().union(*cell_vertex_sets.values())
-         neighbor_tuples_dict = self.build_dual_from_vertices(list(vertices_todo))
-         for c in cell_vertex_sets.keys():
-            # neighbor_tuples = self.build_dual_from_vertices(verts)
-            # cell_neighbor_sets[c].update(set().union(*neighbor_tuples.values()))
-            cell_neighbor_sets[c].update(set().union(*itemgetter(*cell_vertex_sets[c])(neighbor_tuples_dict)))
-
-         self.__cell_neighbours.update(cell_neighbor_sets)
-
-      for c in cids[~mask]:
-         cell_neighbor_sets[c] = self.__cell_neighbours[c]
-
-      return cell_neighbor_sets
-
-
-
-   def build_dual_from_vertices(self, vertices):
+   @synchronized
+   def build_cell_neighborhoods_csr(self, cids):
+      ''' Builds and caches the neighbours of CellIDs cids: all cells sharing a vertex, including the cell itself.
 
-      vertices = list(set(vertices))
-
-      # I don't like this, but alternatives seem worse.
-      done = []
-      todo = []
-      # mask = dict_keys_exist(self.__dual_cells, vertices)
-      # mask = np.array([v not in self.__dual_cells.keys() for v in vertices],dtype=bool)
-      for i,v in enumerate(vertices):
-         if v in self.__dual_cells.keys():
-            done.append(v)
-         else:
-            todo.append(v)
-      # vertices=np.array(vertices,dtype="i,i,i")
-      # done = [tuple(v) for v in vertices[mask]]
-      # todo = [tuple(v) for v in vertices[~mask]]
-
-      dual_sets_done   = {v : self.__dual_cells[v] for v in done}
+      :parameter cids: numpy array of CellIDs, without zeros
+      :returns: the neighbour cellids of each cell in compressed sparse row form: indptr (len(cids)+1,) and cellids
+      '''
+      cids = np.atleast_1d(cids).astype(np.int64)
+      self.load_neighbor_stencils_from_filecache()
+      mask = ~self.__get_dual_mesh().cell_neighbours.contains(cids)
+
+      if np.any(mask):
+         new_cells = np.unique(cids[mask])
+         corners = self.__build_cell_corner_codes(new_cells) # these are enough to fetch the neighbours
+         codes, inverse = np.unique(corners, return_inverse=True)
+         dual_cells = self.__build_duals_of_vertices(codes)[0]
+         neighbors = np.sort(dual_cells[inverse.reshape(-1)].reshape(len(new_cells), 64), axis=1)
+         keep = neighbors != 0
+         keep[:,1:] &= neighbors[:,1:] != neighbors[:,:-1]
+         indptr = np.zeros(len(new_cells)+1, dtype=np.int64)
+         np.cumsum(np.sum(keep, axis=1), out=indptr[1:])
+         self.__get_dual_mesh().cell_neighbours.insert(new_cells, indptr, neighbors[keep])
+
+      return self.__get_dual_mesh().cell_neighbours.get(cids)
 
-      dual_sets = {}
+   def build_cell_neighborhoods(self, cids):
+      ''' Builds, caches and returns the neighbours of CellIDs cids.
 
-      len_todo = len(todo)
+      :returns: Dictionary of cell c (int) : set of cellids of all cells sharing a vertex with c
 
-      if len_todo > 0:#np.sum(mask) > 0:
+      .. seealso:: :func:`build_cell_neighborhoods_csr`
+      '''
+      cids = np.atleast_1d(cids).astype(np.int64)
+      indptr, neighbors = self.build_cell_neighborhoods_csr(cids)
+      neighbors = neighbors.tolist()
+      return {c: set(neighbors[indptr[i]:indptr[i+1]]) for i, c in enumerate(cids.tolist())}
+
+   @synchronized
+   def __build_duals_of_vertices(self, codes):
+      ''' Builds, caches and returns the duals of vertex codes: the cellids at the 8 corners of each
+      dual cell (len(codes), 8) and the dual cell bounding boxes (len(codes), 6).
+      '''
+      codes = np.atleast_1d(codes).astype(np.int64)
+      found, (cells, bboxes) = self.__get_dual_mesh().duals.get(codes)
 
-         dual_bboxes = {}
+      if not np.all(found):
+         todo, inverse = np.unique(codes[~found], return_inverse=True)
          eps = 1
-         v_cells = np.zeros((len_todo, 8),dtype=int)
-         v_cellcoords = np.zeros((len_todo, 8,3))
-         ii = 0
-         vcoords = self.get_vertex_coordinates_from_indices(todo)
-
-         # TODO get rid of the loop
-         offsets = []
-         for x in [-1,1]:
-            for y in [-1,1]:
-               for z  in [-1,1]:
-                  offsets.append([x,y,z])
-                  v_cellcoords[:,ii,:] = eps*np.array((x,y,z))[np.newaxis,:] + vcoords
-                  v_cells[:,ii] = self.get_cellid(v_cellcoords[:,ii])
-                  ii += 1
+         vcoords = self.get_vertex_coordinates_from_indices(self.get_vertex_indices_from_codes(todo))
+         v_cellcoords = vcoords[:,np.newaxis,:] + eps*(2*dual_corner_offsets[np.newaxis,:,:] - 1)
+         v_cells = self.get_cellid(v_cellcoords.reshape(-1,3)).reshape(-1,8)
 
          v_cellcoords = self.get_cell_coordinates(v_cells.reshape((-1))).reshape((-1,8,3))
+         v_bboxes = np.hstack((np.min(v_cellcoords, axis=1), np.max(v_cellcoords, axis=1)))
+         self.__get_dual_mesh().duals.insert(todo, v_cells, v_bboxes)
+         cells[~found] = v_cells[inverse]
+         bboxes[~found] = v_bboxes[inverse]
 
-         dual_sets.update({vinds: tuple(v_cells[i,:]) for i,vinds in enumerate(todo)})
-         mins = np.min(v_cellcoords, axis=1)
-         maxs = np.max(v_cellcoords, axis=1)
-         dual_bboxes.update({vinds: np.hstack((mins[i,:],maxs[i,:])) for i,vinds in enumerate(todo)})
+      return cells, bboxes
 
-         self.__dual_cells.update(dual_sets)
-         self.__dual_bboxes.update(dual_bboxes)
-      dual_sets_done.update(dual_sets)
+   def build_dual_from_vertices(self, vertices):
+      ''' Builds, caches and returns the duals of vertices.
 
-      return dual_sets_done
+      :parameter vertices: list of vertex indices (3-tuples) or numpy array (N,3)
+      :returns: Dictionary of vertex indices v (3-tuple) : 8-tuple of cellids at the corners of the dual cell of v
+      '''
+      indices = np.unique(np.array(vertices, dtype=np.int64).reshape(-1,3), axis=0)
+      cells = self.__build_duals_of_vertices(self.get_vertex_codes(indices))[0]
+      return {tuple(v): tuple(c) for v, c in zip(indices.tolist(), cells.tolist())}
 
    # build a dual coverage to enable interpolation to each coordinate
    def build_duals_from_coordinates(self, coordinates):
@@ -3460,33 +4405,27 @@ class VlsvReader(object):
       if(coords.shape[1] != 3):
          raise IndexError("Coordinates are required to be three-dimensional (coords.shape[1]==3 or convertible to such))")
 
-      vertices = set()
-      vsets = self.build_cell_vertices(cid,prune_unique=False)
-      vertices = vertices.union(*vsets.values())
-
-      return self.build_dual_from_vertices(list(vertices))
+      cid = cid[cid != 0]
+      codes = np.unique(self.build_cell_vertices_csr(cid)[1])
+      indices = self.get_vertex_indices_from_codes(codes)
+      cells = self.__build_duals_of_vertices(codes)[0]
+      return {tuple(v): tuple(c) for v, c in zip(indices.tolist(), cells.tolist())}
 
    # build a dual coverage to enable interpolation to each coordinate
+   @synchronized
    def build_duals(self, cid):
 
-      cid = np.atleast_1d(cid)
+      cid = np.atleast_1d(cid).astype(np.int64)
+      cid = cid[cid != 0]
 
-      mask = ~dict_keys_exist(self.__cell_duals, cid, prune_unique=False)
+      mask = ~self.__get_dual_mesh().cell_duals.contains(cid)
 
       if(np.sum(mask) > 0):
-         coords = self.get_cell_coordinates(cid[mask])
-
-         ncoords = coords.shape[0]
-         if(coords.shape[1] != 3):
-            raise IndexError("Coordinates are required to be three-dimensional (coords.shape[1]==3 or convertible to such))")
+         new_cells = np.unique(cid[mask])
+         self.__build_duals_of_vertices(np.unique(self.build_cell_vertices_csr(new_cells)[1]))
 
-         vertices = set()
-         vsets = self.build_cell_vertices(cid[mask])
-         vertices = vertices.union(*vsets.values())
-         for c in cid[mask]:
-            self.__cell_duals[c] = vsets[c]
-
-         self.build_dual_from_vertices(list(vertices))
+         # Record the cell duals only after the duals exist, get_duals reads them without the lock
+         self.__get_dual_mesh().cell_duals.insert(new_cells)
 
 
    @wrap_array(dimensions=1)
@@ -3502,24 +4441,13 @@ class VlsvReader(object):
       '''
 
 
-      # Get cell lengths:
-      xcells = np.zeros((self.get_max_refinement_level()+1), dtype=np.int64)
-      ycells = np.zeros((self.get_max_refinement_level()+1), dtype=np.int64)
-      zcells = np.zeros((self.get_max_refinement_level()+1), dtype=np.int64)
-      for r in range(self.get_max_refinement_level()+1):
-         xcells[r] = self.__xcells*2**(r)
-         ycells[r] = self.__ycells*2**(r)
-         zcells[r] = self.__zcells*2**(r)
-
+      lengths = self.get_amr_level_tables()[2]
       reflevels = self.get_amr_level(cellids)
-      cellindices = self.get_cell_indices(cellids)
+      cellindices = self.get_cell_indices(cellids, reflevels)
 
       # Get cell coordinates:
-      cell_lengths = np.array([(self.__xmax - self.__xmin)/(xcells[reflevels]),
-                               (self.__ymax - self.__ymin)/(ycells[reflevels]),
-                               (self.__zmax - self.__zmin)/(zcells[reflevels])]).T
       mins = np.array([self.__xmin,self.__ymin,self.__zmin])
-      cellcoordinates = mins + (cellindices + 0.5)*cell_lengths
+      cellcoordinates = mins + (cellindices + 0.5)*lengths[reflevels]
 
       # Return the coordinates:
       return cellcoordinates
@@ -3541,21 +4469,15 @@ class VlsvReader(object):
       else:
          reflevels = np.atleast_1d(reflevels)
 
+      starts, cells, lengths = self.get_amr_level_tables()
       mask = reflevels >= 0
-      # Calculating the index of the first cell at this reflevel
-      index_at_reflevel = np.zeros(self.get_max_refinement_level()+1, dtype=np.int64)
-      isum = 0
-      for i in range(0,self.get_max_refinement_level()):
-         isum = isum + 2**(3*i) * self.__xcells * self.__ycells * self.__zcells
-         index_at_reflevel[i+1] = isum
+      levels = reflevels[mask]
 
-
-      # Get cell indices:
-      cellids = np.array(cellids - 1 - index_at_reflevel[reflevels], dtype=np.int64)
-      cellindices = np.full((len(cellids),3), -1)
-      cellindices[mask,0] = (cellids[mask])%(np.power(2,reflevels[mask])*self.__xcells)
-      cellindices[mask,1] = ((cellids[mask])//(np.power(2,reflevels[mask])*self.__xcells))%(np.power(2,reflevels[mask])*self.__ycells)
-      cellindices[mask,2] = (cellids[mask])//(np.power(4,reflevels[mask])*self.__xcells*self.__ycells)
+      # Get cell indices from the id within the level:
+      cellids = np.asarray(cellids)[mask].astype(np.int64) - starts[levels]
+      cellindices = np.full((len(reflevels),3), -1)
+      rows, cellindices[mask,0] = np.divmod(cellids, cells[levels,0])
+      cellindices[mask,2], cellindices[mask,1] = np.divmod(rows, cells[levels,1])
 
       return cellindices
 
@@ -3594,10 +4516,9 @@ class VlsvReader(object):
 
       # Getting the neighbour at the same refinement level
       ngbr_indices = np.zeros((len(cellids),3))
+      starts, cells, lengths = self.get_amr_level_tables()
       sys_sizes= np.ones(ngbr_indices.shape, dtype=np.float64)
-      sys_sizes[mask,0] = 2**reflevel[mask]*self.__xcells
-      sys_sizes[mask,1] = 2**reflevel[mask]*self.__ycells
-      sys_sizes[mask,2] = 2**reflevel[mask]*self.__zcells
+      sys_sizes[mask,:] = cells[reflevel[mask]]
       for i in range(3):
          ngbr_indices[:,i] = indices[:,i] + offsets[:,i]
          if periodic[i]:
@@ -3610,7 +4531,7 @@ class VlsvReader(object):
             raise ValueError("Error in Vlsvreader get_cell_neighbor: neighbor out of bounds")
 
       coord_neighbor = np.zeros(ngbr_indices.shape, dtype=np.float64)
-      coord_neighbor[mask,:] = np.array([self.__xmin,self.__ymin,self.__zmin]) + (ngbr_indices[mask,:] + np.array((0.5,0.5,0.5))) * np.array([self.__dx,self.__dy,self.__dz])/2**np.repeat(np.atleast_2d(reflevel[mask]).T,3,axis=1)
+      coord_neighbor[mask,:] = np.array([self.__xmin,self.__ymin,self.__zmin]) + (ngbr_indices[mask,:] + 0.5) * lengths[reflevel[mask]]
 
       cellid_neighbors[mask] = self.get_cellid(coord_neighbor[mask,:])
       cellid_neighbors[(offsets[:,0]==0) & (offsets[:,1]==0) & (offsets[:,2]==0)] = cellids[(offsets[:,0]==0) & (offsets[:,1]==0) & (offsets[:,2]==0)]
@@ -3957,10 +4878,8 @@ class VlsvReader(object):
       :returns: dense_array [np.ndarray], edges
       '''
 
-      velocity_cell_map = self.read_velocity_cells(cellid, pop)
-      maps = list(zip(*velocity_cell_map.items()))
-      velocity_cell_ids = np.array(maps[0],dtype=np.int64)
-      velocity_cell_values = np.array(maps[1], dtype=np.float32)
+      velocity_cell_ids, velocity_cell_values = self.read_velocity_cell_arrays(cellid, pop)
+      velocity_cell_values = velocity_cell_values.astype(np.float32)
 
       if setThreshold is None:
          # Drop all velocity cells which are below the sparsity threshold. Otherwise the plot will show buffer
@@ -4039,92 +4958,74 @@ class VlsvReader(object):
       .. seealso:: :func:`read_blocks`
       '''
 
+      velocity_cell_ids, velocity_cell_values = self.read_velocity_cell_arrays(cellid, pop)
+      # Make a dictionary (hash map) out of velocity cell ids and avgs:
+      return dict(zip(velocity_cell_ids.tolist(), velocity_cell_values))
+
+   def __velocity_block_location(self, cellid, pop):
+      ''' Offset (in blocks) and number of blocks of the velocity space of a cell,
+      or None if the cell has no velocity distribution.
+      '''
       if self.use_dict_for_blocks: # old deprecated version, uses dict for blocks data
          if not pop in self.__fileindex_for_cellid_blocks:
             self.__set_cell_offset_and_blocks(pop)
          # Check that cells has vspace
          if not cellid in self.__fileindex_for_cellid_blocks[pop]:
-            warnings.warn("Cell(s) does not have velocity distribution")
-            return {}
+            return None
          # Navigate to the correct position:
          offset = self.__fileindex_for_cellid_blocks[pop][cellid][0]
          num_of_blocks = self.__fileindex_for_cellid_blocks[pop][cellid][1]
 
       else:  # Uses arrays (much faster to initialize)
-         if not pop in self.__cells_with_blocks:
-            self.__set_cell_offset_and_blocks_nodict(pop)
          # Check that cells has vspace
-         try:
-            cells_with_blocks_index = self.__order_for_cellid_blocks[pop][cellid]
-         except:
-            warnings.warn("Cell(s) does not have velocity distribution")
-            return {}
+         cells_with_blocks_index, has_blocks = self.__get_cells_with_blocks_indices(cellid, pop)
+         if not has_blocks[0]:
+            return None
          # Navigate to the correct position:
-         offset = self.__blocks_per_cell_offsets[pop][cells_with_blocks_index]
-         num_of_blocks = self.__blocks_per_cell[pop][cells_with_blocks_index]
-
-      if self.__fptr.closed:
-         fptr = open(self.file_name,"rb")
-      else:
-         fptr = self.__fptr
-      data_avgs=None
-      data_block_ids=None
-      # Read in avgs and velocity cell ids:
-      for child in self.__xml_root:
-         # Read in avgs
-         if "name" in child.attrib and (child.attrib["name"] == pop) and (child.tag == "BLOCKVARIABLE"):
-            vector_size = ast.literal_eval(child.attrib["vectorsize"])
-            #array_size = ast.literal_eval(child.attrib["arraysize"])
-            element_size = ast.literal_eval(child.attrib["datasize"])
-            datatype = child.attrib["datatype"]
-
-            # Navigate to the correct position
-            offset_avgs = int(offset * vector_size * element_size + ast.literal_eval(child.text))
-            fptr.seek(offset_avgs)
-
-            if datatype == "float" and element_size == 4:
-               data_avgs = np.fromfile(fptr, dtype = np.float32, count = vector_size*num_of_blocks) 
-            elif datatype == "float" and element_size == 8:
-               data_avgs = np.fromfile(fptr, dtype = np.float64, count = vector_size*num_of_blocks) 
-            else:
-               raise TypeError("Error! Bad data type in blocks! datatype found was "+datatype)
-            data_avgs = data_avgs.reshape(num_of_blocks, vector_size)
-         # Read in block coordinates:
-         if ("name" in child.attrib) and (child.attrib["name"] == pop) and (child.tag == "BLOCKIDS"):
-            vector_size = ast.literal_eval(child.attrib["vectorsize"])
-            #array_size = ast.literal_eval(child.attrib["arraysize"])
-            element_size = ast.literal_eval(child.attrib["datasize"])
-            datatype = child.attrib["datatype"]
-
-            offset_block_ids = int(offset * vector_size * element_size + ast.literal_eval(child.text))
-            fptr.seek(offset_block_ids)
-
-            if datatype == "uint" and element_size == 4:
-               data_block_ids = np.fromfile(fptr, dtype = np.uint32, count = vector_size*num_of_blocks)
-            elif datatype == "uint" and element_size == 8:
-               data_block_ids = np.fromfile(fptr, dtype = np.uint64, count = vector_size*num_of_blocks)
-            else:
-               raise TypeError("Error! Bad data type in blocks! datatype found was "+datatype)
+         offset = self.__blocks_per_cell_offsets[pop][cells_with_blocks_index[0]]
+         num_of_blocks = self.__blocks_per_cell[pop][cells_with_blocks_index[0]]
 
-         if (pop=="avgs") and (child.tag == "BLOCKIDS"): # Old avgs files did not have the name set for BLOCKIDS
-            vector_size = ast.literal_eval(child.attrib["vectorsize"])
-            #array_size = ast.literal_eval(child.attrib["arraysize"])
-            element_size = ast.literal_eval(child.attrib["datasize"])
-            datatype = child.attrib["datatype"]
+      return offset, num_of_blocks
 
-            offset_block_ids = int(offset * vector_size * element_size + ast.literal_eval(child.text))
-            fptr.seek(offset_block_ids)
+   def read_velocity_blocks(self, cellid, pop="proton"):
+      ''' Read the velocity blocks of a spatial cell as arrays
 
-            if datatype == "uint" and element_size == 4:
-               data_block_ids = np.fromfile(fptr, dtype = np.uint32, count = vector_size*num_of_blocks)
-            elif datatype == "uint" and element_size == 8:
-               data_block_ids = np.fromfile(fptr, dtype = np.uint64, count = vector_size*num_of_blocks)
-            else:
-               raise TypeError("Error! Bad data type in blocks! datatype found was "+datatype)
+      :param cellid: Cell ID of the cell whose velocity blocks the function will read
+      :kwarg pop:    Population to read ["proton"]
+      :returns: block ids (numpy array of length N) and block data (numpy array of shape (N, WID3)).
+                Both are empty if the cell has no velocity distribution.
 
-            data_block_ids = data_block_ids.reshape(num_of_blocks, vector_size)
+      .. seealso:: :func:`read_velocity_cell_arrays`
+      '''
+      location = self.__velocity_block_location(cellid, pop)
+      if location is None:
+         warnings.warn("Cell(s) does not have velocity distribution")
+         WID = self.get_WID()
+         return np.array([],dtype=np.uint32), np.empty((0,WID*WID*WID),dtype=np.float32)
+      offset, num_of_blocks = location
 
-      fptr.close()
+      data_avgs=None
+      data_block_ids=None
+      # Read in avgs
+      entry = self.__footer.find("BLOCKVARIABLE", pop)
+      if entry is not None:
+         # Navigate to the correct position
+         offset_avgs = int(offset * entry.vector_size * entry.element_size)
+
+         if entry.datatype != "float" or not entry.element_size in (4,8):
+            raise TypeError("Error! Bad data type in blocks! datatype found was "+entry.datatype)
+         data_avgs = self.read_with_offset(entry.datatype, entry.offset, num_of_blocks, [offset_avgs], entry.element_size, entry.vector_size)
+         data_avgs = data_avgs.reshape(num_of_blocks, entry.vector_size)
+      # Read in block coordinates:
+      # (old avgs files did not have the name set for BLOCKIDS)
+      entry = self.__blocks_footer_entry(pop)
+      if entry is not None:
+         offset_block_ids = int(offset * entry.vector_size * entry.element_size)
+
+         if entry.datatype != "uint" or not entry.element_size in (4,8):
+            raise TypeError("Error! Bad data type in blocks! datatype found was "+entry.datatype)
+         data_block_ids = self.read_with_offset(entry.datatype, entry.offset, num_of_blocks, [offset_block_ids], entry.element_size, entry.vector_size)
+         data_block_ids = np.reshape(data_block_ids, -1)
 
       #Check for None in case nothing was read into the variables
       if data_avgs is None:
@@ -4135,29 +5036,182 @@ class VlsvReader(object):
       # Check to make sure the sizes match (just some extra debugging)
       if len(data_avgs) != len(data_block_ids):
         raise ValueError("BAD DATA SIZES")
-      # Make a dictionary (hash map) out of velocity cell ids and avgs:
-      velocity_cells = {}
-      array_size = len(data_avgs)
 
-      # Construct velocity cells:
-      WID=self.get_WID()
-      WID2=WID*WID
-      WID3=WID2*WID
-      velocity_cell_ids = []
-      for kv in range(WID):
-         for jv in range(WID):
-            for iv in range(WID):
-               velocity_cell_ids.append(kv*WID2 + jv*WID + iv)
-
-      for i in range(array_size):
-         velocity_block_id = data_block_ids[i]
-         avgIndex = 0
-         avgs = data_avgs[i]
-
-         for j in velocity_cell_ids + WID3*velocity_block_id:
-            velocity_cells[(int)(j)] = avgs[avgIndex]
-            avgIndex = avgIndex + 1
-      return velocity_cells
+      return data_block_ids, data_avgs
+
+   def read_velocity_cell_arrays(self, cellid, pop="proton"):
+      ''' Read velocity cells from a spatial cell as arrays. This is the array counterpart
+      of :func:`read_velocity_cells`, with the velocity cells in the same order.
+
+      :param cellid: Cell ID of the cell whose velocity cells the function will read
+      :kwarg pop:    Population to read ["proton"]
+      :returns: velocity cell ids (int64) and the corresponding values, as numpy arrays.
+                Both are empty if the cell has no velocity distribution.
+
+      .. code-block:: python
+
+         # Example usage:
+         vcellids, values = vlsvReader.read_velocity_cell_arrays(cellid)
+         V = vlsvReader.get_velocity_cell_coordinates(vcellids)
+
+      .. seealso:: :func:`read_velocity_blocks`
+      '''
+      data_block_ids, data_avgs = self.read_velocity_blocks(cellid, pop)
+
+      # Construct velocity cells: cell j of block b has the id b*WID3 + j
+      WID3 = data_avgs.shape[1]
+      velocity_cell_ids = data_block_ids.astype(np.int64)[:,np.newaxis]*WID3 + np.arange(WID3, dtype=np.int64)[np.newaxis,:]
+      return velocity_cell_ids.reshape(-1), data_avgs.reshape(-1)
+
+   def __velocity_block_ranges(self, cellids, pop):
+      ''' Positions of the velocity blocks of cellids in the block arrays of a population.
+
+      :returns: index of the first block and number of blocks of each cellid (0 for cells without blocks)
+      '''
+      range_starts = np.zeros(cellids.size, dtype=np.int64)
+      range_lengths = np.zeros(cellids.size, dtype=np.int64)
+      if self.use_dict_for_blocks:
+         for i,cellid in enumerate(cellids):
+            location = self.__velocity_block_location(cellid, pop)
+            if location is not None:
+               range_starts[i] = location[0]
+               range_lengths[i] = location[1]
+      else:
+         cells_with_blocks_index, has_blocks = self.__get_cells_with_blocks_indices(cellids, pop)
+         range_starts[has_blocks] = self.__blocks_per_cell_offsets[pop][cells_with_blocks_index[has_blocks]]
+         range_lengths[has_blocks] = self.__blocks_per_cell[pop][cells_with_blocks_index[has_blocks]]
+      return range_starts, range_lengths
+
+   def __read_vspace_reducer(self, reducer, cellids, tag, mesh, pop="proton"):
+      ''' Evaluate a velocity-space data reducer on cellids. The cells are ordered by the position
+      of their velocity blocks in the file, cells without blocks last, and cut into chunks of at most
+      vspace_chunk_blocks blocks (and reducer_block_cells cells). Each chunk is one coalesced read of
+      its blocks and one read of each input variable, see :func:`__evaluate_vspace_chunk`. With
+      :func:`set_vspace_processes` the chunks are evaluated on a process pool.
+
+      :returns: numpy array with one value per cell, in the order of cellids
+      '''
+      actualcellids = np.atleast_1d(self.read(mesh="SpatialGrid", name="CellID", tag="VARIABLE", operator="pass", cellids=cellids)).astype(np.int64)
+      ncells = len(actualcellids)
+      range_starts, range_lengths = self.__velocity_block_ranges(actualcellids, pop)
+      # Block-sorted order, so that the blocks of a chunk are contiguous in the file
+      order = np.argsort(np.where(range_lengths > 0, range_starts, np.iinfo(np.int64).max), kind="stable")
+
+      # Chunk boundaries: a new chunk starts when the blocks or the cells of the current one are full
+      bounds = [0]
+      chunk_blocks = 0
+      for position, blocks in enumerate(range_lengths[order]):
+         if position > bounds[-1] and (chunk_blocks + blocks > vspace_chunk_blocks or position - bounds[-1] >= reducer_block_cells):
+            bounds.append(position)
+            chunk_blocks = 0
+         chunk_blocks += blocks
+      bounds.append(ncells)
+      chunks = [actualcellids[order[start:stop]] for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+      output = None
+      def store(index, values):
+         nonlocal output
+         values = np.asarray(values)
+         if output is None:
+            output = np.zeros((ncells,)+values.shape[1:], dtype=values.dtype)
+         output[order[bounds[index]:bounds[index+1]]] = values
+         logging.info("Velocity-space reducer: chunk "+str(index+1)+"/"+str(len(chunks)))
+
+      processes = min(self.__vspace_processes, len(chunks))
+      if processes > 1:
+         from multiprocessing import Pool
+         tasks = [(index, reducer, chunk, tag, mesh, pop) for index, chunk in enumerate(chunks)]
+         with Pool(processes, initializer=_vspace_worker_init, initargs=(self.file_name,)) as pool:
+            for index, values in pool.imap_unordered(_vspace_worker_task, tasks):
+               store(index, values)
+      else:
+         for index, chunk in enumerate(chunks):
+            store(index, self.__evaluate_vspace_chunk(reducer, chunk, tag, mesh, pop))
+
+      if output is None:
+         output = np.zeros(0)
+      if np.ndim(cellids) == 0 and cellids != -1:
+         return output[0]
+      return output
+
+   def __evaluate_vspace_chunk(self, reducer, cellids, tag, mesh, pop):
+      ''' Evaluate a velocity-space data reducer on a chunk of cells: the input variables are read for
+      all the cells at once and the velocity blocks with :func:`read_velocity_cells_batch`. Batched
+      operations (see :func:`reducer.vspace_batch`) get the whole chunk, others are called per cell
+      on slices of the chunk arrays.
+
+      :returns: numpy array with one value per cell
+      '''
+      tmp_vars = []
+      for i in np.atleast_1d(reducer.variables):
+         data = self.read( i, tag, mesh, "pass", cellids )
+         if len(cellids) == 1: # reads of a single cell drop the cell dimension
+            data = np.asarray(data)[np.newaxis,...]
+         tmp_vars.append(data)
+
+      block_offsets, block_ids, block_data = self.read_velocity_cells_batch(cellids, pop)
+      WID3 = block_data.shape[1]
+      velocity_cell_ids = (block_ids.astype(np.int64)[:,np.newaxis]*WID3 + np.arange(WID3, dtype=np.int64)[np.newaxis,:]).reshape(-1)
+      velocity_cell_data = block_data.reshape(-1)
+      velocity_coordinates = self.get_velocity_cell_coordinates(velocity_cell_ids, pop)
+      cell_offsets = block_offsets*WID3
+
+      if reducer.vspace_batch:
+         return reducer.operation( tmp_vars, cell_offsets, velocity_cell_data, velocity_coordinates )
+      output = []
+      for index in range(len(cellids)):
+         start, stop = cell_offsets[index], cell_offsets[index+1]
+         output.append( reducer.operation( [data[index] for data in tmp_vars], velocity_cell_data[start:stop], velocity_coordinates[start:stop] ) )
+      return np.array(output)
+
+   def read_velocity_cells_batch(self, cellids, pop="proton"):
+      ''' Read the velocity blocks of many spatial cells in one pass. The block ranges of
+      the cells are sorted by their position in the file and read with coalesced reads
+      (see :func:`set_read_gap_tolerance`).
+
+      :param cellids: list or array of cell IDs
+      :kwarg pop:     Population to read ["proton"]
+      :returns: block_offsets, block_ids, block_data in a CSR-like layout: the blocks of
+                cellids[i] are block_ids[block_offsets[i]:block_offsets[i+1]] and the
+                corresponding rows of block_data (shape (N, WID3)). Cells without a velocity
+                distribution have no blocks.
+
+      .. code-block:: python
+
+         # Example usage:
+         offsets, block_ids, block_data = vlsvReader.read_velocity_cells_batch(cellids)
+         for i,cid in enumerate(cellids):
+            cell_blocks = block_ids[offsets[i]:offsets[i+1]]
+            cell_data = block_data[offsets[i]:offsets[i+1],:]
+
+      .. seealso:: :func:`read_velocity_blocks` :func:`read_velocity_cell_arrays`
+      '''
+      cellids = np.atleast_1d(np.asarray(cellids, dtype=np.int64))
+      range_starts, range_lengths = self.__velocity_block_ranges(cellids, pop)
+
+      block_offsets = np.zeros(cellids.size+1, dtype=np.int64)
+      block_offsets[1:] = np.cumsum(range_lengths)
+
+      data_entry = self.__footer.find("BLOCKVARIABLE", pop)
+      ids_entry = self.__blocks_footer_entry(pop)
+      if data_entry is None or ids_entry is None:
+         raise ValueError("Velocity space data for population "+pop+" not found in "+self.file_name)
+      if data_entry.datatype != "float" or not data_entry.element_size in (4,8):
+         raise TypeError("Error! Bad data type in blocks! datatype found was "+data_entry.datatype)
+      if ids_entry.datatype != "uint" or not ids_entry.element_size in (4,8):
+         raise TypeError("Error! Bad data type in blocks! datatype found was "+ids_entry.datatype)
+
+      has_blocks = range_lengths > 0
+      max_gap = self.__read_gap_bytes // (data_entry.element_size*data_entry.vector_size)
+      read_starts, read_lengths, positions = coalesce_ranges(range_starts[has_blocks], range_lengths[has_blocks], max_gap)
+
+      block_data = self.read_with_ranges(data_entry.datatype, data_entry.offset, read_starts, read_lengths, data_entry.element_size, data_entry.vector_size)
+      block_data = block_data.reshape(-1, data_entry.vector_size)
+      block_ids = self.read_with_ranges(ids_entry.datatype, ids_entry.offset, read_starts, read_lengths, ids_entry.element_size, ids_entry.vector_size)
+
+      # Gather the blocks of each requested cell, in request order
+      gather = np.repeat(positions - block_offsets[:-1][has_blocks], range_lengths[has_blocks]) + np.arange(block_offsets[-1], dtype=np.int64)
+      return block_offsets, block_ids[gather], block_data[gather,:]
 
    def get_spatial_mesh_size(self):
       ''' Read spatial mesh size
@@ -4413,6 +5467,8 @@ class VlsvReader(object):
                variables.append(vlsvReader.read_variable("rho", cellids=i))
             vlsvReader.optimize_close_file()
 
+         The open file is read with positional reads, so it can be shared by threads reading from this reader.
+
          .. note:: This should only be used for optimization purposes.
       '''
       self.__fptr = open(self.file_name,"rb")
@@ -4439,6 +5495,7 @@ class VlsvReader(object):
          self.__fptr.close()
          return
 
+   @synchronized
    def optimize_clear_fileindex_for_cellid_blocks(self):
       ''' Clears a private variable containing number of blocks and offsets for particular cell ids
 
@@ -4458,12 +5515,14 @@ class VlsvReader(object):
 
          .. note:: This should only be used for optimization purposes.
       '''
+      self.__cells_with_blocks_ordered = {} # Cleared first, it marks a population as set up
       self.__fileindex_for_cellid_blocks = {}
       self.__cells_with_blocks = {}
       self.__blocks_per_cell = {}
       self.__blocks_per_cell_offsets = {}
       self.__order_for_cellid_blocks = {}
 
+   @synchronized
    def optimize_clear_fileindex_for_cellid(self):
       ''' Clears a private variable containing cell ids and their locations
 
@@ -4551,32 +5610,66 @@ class VlsvReader(object):
       # print(path)
       return path
 
+   def get_sidecar_array(self, name):
+      ''' Load a persisted index array from the .npy sidecars in the cache folder, memory-mapped.
+      Returns None if the sidecar does not exist or is stale (the vlsv file size or
+      modification time changed since it was written).
+
+      :param name: str, name of the sidecar
+      '''
+      return self.__metadata_cache.load_sidecar_array(self, name)
+
+   def set_sidecar_array(self, name, array):
+      ''' Persist an index array as a .npy sidecar in the cache folder, if file caching is
+      enabled for this reader (file_cache).
+
+      :param name:  str, name of the sidecar
+      :param array: numpy array
+      '''
+      if self.file_cache:
+         self.__metadata_cache.save_sidecar_array(self, name, array)
+
+   @synchronized
    def cache_neighbor_stencils(self):
+      ''' Save the cell corners, vertices, neighbourhoods and duals built so far into the cache folder,
+      to be loaded by later readers of the same file.
+      '''
       self.load_neighbor_stencils_from_filecache()
       path = self.get_cache_folder()
       os.makedirs(path,exist_ok=True)
-      cache_file_neighbors = os.path.join(path, "neighbors_cache.pkl")
-      with open(cache_file_neighbors,'wb') as cache:
-            pickle.dump({
-               "cell_neighbours": self.__cell_neighbours,
-               "cell_vertices":self.__cell_vertices,
-               "cell_corner_vertices":self.__cell_corner_vertices}
-               ,cache)
-
+      cache_file_neighbors = os.path.join(path, neighbors_cache_file)
+      arrays = {}
+      dual_mesh = self.__get_dual_mesh()
+      for prefix, structure in (("cell_neighbours", dual_mesh.cell_neighbours),
+                                ("cell_vertices", dual_mesh.cell_vertices),
+                                ("cell_corner_vertices", dual_mesh.cell_corner_vertices),
+                                ("duals", dual_mesh.duals)):
+         for i, array in enumerate(structure.arrays()):
+            arrays[prefix+"_"+str(i)] = array
+      # Write to a temporary file first so that concurrent readers never see a partial cache
+      temporary = cache_file_neighbors + "." + str(os.getpid()) + ".tmp.npz"
+      np.savez_compressed(temporary, **arrays)
+      os.replace(temporary, cache_file_neighbors)
+      self.__neighbors_cache_available = True
+
+   @synchronized
    def load_neighbor_stencils_from_filecache(self):
+      ''' Load the cell corners, vertices, neighbourhoods and duals saved by :func:`cache_neighbor_stencils`, once.
+      '''
       if self.__neighbors_cache_available and not self.__neighbors_cache_loaded:
          path = self.get_cache_folder()
-         cache_file_neighbors = os.path.join(path, "neighbors_cache.pkl")
+         cache_file_neighbors = os.path.join(path, neighbors_cache_file)
          if(os.path.isfile(cache_file_neighbors)):
-            with open(cache_file_neighbors,'rb') as cache:
-               loaded = pickle.load(cache)
-
-               self.__cell_neighbours.update(loaded["cell_neighbours"])
-               self.__cell_vertices.update(loaded["cell_vertices"])
-               self.__cell_corner_vertices.update(loaded["cell_corner_vertices"])
-               self.__neighbors_cache_len = len(self.__cell_neighbours)
-         else:
-            self.__neighbors_cache_loaded = True
+            dual_mesh = self.__get_dual_mesh()
+            with np.load(cache_file_neighbors) as loaded:
+               for prefix, structure in (("cell_neighbours", dual_mesh.cell_neighbours),
+                                         ("cell_vertices", dual_mesh.cell_vertices),
+                                         ("cell_corner_vertices", dual_mesh.cell_corner_vertices),
+                                         ("duals", dual_mesh.duals)):
+                  nkeys = len([k for k in loaded.files if k.startswith(prefix+"_")])
+                  loaded_arrays = [loaded[prefix+"_"+str(i)] for i in range(nkeys)]
+                  structure.insert(*loaded_arrays)
+         self.__neighbors_cache_loaded = True
 
    def set_cellid_spatial_index(self, force=False):
       self.__cellid_spatial_index =  self.__metadata_cache.set_cellid_spatial_index(self, force)
@@ -29,42 +29,6 @@ import argparse
 import logging
 
 
-def extract_file(filename):
-    out = []
-    try:
-        cellids=[]
-        values=[]
-        f=pt.vlsvfile.VlsvReader(filename)
-        f.optimize_open_file()
-        t=f.read_parameter("time")
-        if t == None:
-            t=f.read_parameter("t")
-        if t == None:	    
-            logging.info("Unknown time format in file " + filename)
-
-        
-        for coord in coords:
-            if(args.re):
-                cellids.append(f.get_cellid(coord * 6371000))
-            else:
-                cellids.append(f.get_cellid(coord))
-
-        for i,var in enumerate(variables):
-            values.append(f.read_variable(variables[i],operator=operators[i],cellids=cellids))
-        
-        for i,id in enumerate(cellids):
-            out_line = str(t) + " " +  ' '.join(map(str, coords[i])) + " " + str(id)
-            for j,varval in enumerate(values):
-                out_line = out_line +  " " + str(varval[i])
-            out.append([filename, out_line])
-        f.optimize_close_file()
-    except:
-        out.append([filename, "#Could not read " + filename])
-        pass
-    
-    return out
-
-
 parser = argparse.ArgumentParser()
 parser.add_argument('-var', nargs='*', help="a list of variable.operator's to output, e.g., v.magnitude rho B.x " )
 parser.add_argument('-i', nargs='*', help="a list of vlsv files")
@@ -93,9 +57,9 @@ for i,var in enumerate(varnames):
 
 #read in coordinates
 if args.c is None:
-    coords = np.loadtxt(sys.stdin, dtype=np.float)
+    coords = np.loadtxt(sys.stdin, dtype=float)
 else:
-    coords = np.loadtxt(args.c, dtype=np.float)
+    coords = np.loadtxt(args.c, dtype=float)
 
 #if just single point make it into array with 1 row
 coords = np.atleast_2d(coords)
@@ -111,13 +75,22 @@ else:
     numproc = int(args.n)
 
 
-## Parallel processing
-from multiprocessing import Pool
+## Parallel processing: every file is read once, with one vectorised query per variable
 if __name__ == '__main__':
-   pool = Pool(numproc)
-   return_array = pool.map(extract_file, args.i)
-
-
-for i in sorted(return_array):
-    for j in i:
-        print(j[1])
+    files = sorted(args.i)
+    series = pt.calculations.time_series(files, variables, operators=operators,
+                                         coordinates=coords * 6371000 if args.re else coords,
+                                         parameters=["time"], processes=numproc, skip_unreadable=True)
+
+    for t,filename in enumerate(files):
+        if not series["readable"][t]:
+            print("#Could not read " + filename)
+            continue
+        if np.isnan(series["parameters"]["time"][t]):
+            logging.info("Unknown time format in file " + filename)
+        for i,id in enumerate(series["cellids"][t]):
+            out_line = str(series["parameters"]["time"][t]) + " " +  ' '.join(map(str, coords[i])) + " " + str(id)
+            for values in series["variables"]:
+                varval = values[t,i,:]
+                out_line = out_line +  " " + str(varval[0] if len(varval) == 1 else varval)
+            print(out_line)